@@ -0,0 +1,467 @@
+"""
+Ingests the serverinfo statistics in NC_STATS_DIR (stats_raw_*.json from
+the cron mode, stats_batch_*.jsonl / *.ncsnap from the collector) into a
+local columnar cache and computes rollups per period: mean, min, max and
+95th percentile of every metric, plus the growth over the selected range.
+
+The cache (NC_STATS_CACHE) holds one little-endian float64 file per column
+and an index of the ingested files with their ETags, so re-runs only
+download new or changed files. Rollups are vectorised with NumPy when it
+is installed and fall back to plain Python otherwise.
+
+    python analyze_serverinfo.py --period day --start 2025-01-01 --csv rollup.csv
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+
+from nextcloud_client import NC_HTTP_MAX_CONNECTIONS, NextcloudClient
+from stats_snapshot import SNAPSHOT_EXTENSION, SnapshotReader
+from tracing import NC_TRACE_FILE, traced, tracer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NC_URL = os.getenv("NC_URL")
+NC_USER = os.getenv("NC_ANCHOR_USER")
+NC_APP_PW = os.getenv("NC_ANCHOR_APP_PW")
+DEST_FOLDER = os.getenv("NC_STATS_DIR")
+# Local columnar cache of the ingested samples
+NC_STATS_CACHE = os.getenv("NC_STATS_CACHE", "./stats_cache")
+# Stats files downloaded at the same time
+NC_STATS_WORKERS = int(os.getenv("NC_STATS_WORKERS", "8"))
+
+http_client = NextcloudClient(NC_URL, NC_USER, NC_APP_PW)
+
+# Column name -> path below ocs.data of the serverinfo response
+METRICS = {
+    'cpu_load_1': ('nextcloud', 'system', 'cpuload', 0),
+    'cpu_load_5': ('nextcloud', 'system', 'cpuload', 1),
+    'cpu_load_15': ('nextcloud', 'system', 'cpuload', 2),
+    'mem_total': ('nextcloud', 'system', 'mem_total'),
+    'mem_free': ('nextcloud', 'system', 'mem_free'),
+    'swap_free': ('nextcloud', 'system', 'swap_free'),
+    'disk_free': ('nextcloud', 'system', 'freespace'),
+    'users': ('nextcloud', 'storage', 'num_users'),
+    'files': ('nextcloud', 'storage', 'num_files'),
+    'storages': ('nextcloud', 'storage', 'num_storages'),
+    'shares': ('nextcloud', 'shares', 'num_shares'),
+    'db_size': ('server', 'database', 'size'),
+    'active_users_5m': ('activeUsers', 'last5minutes'),
+    'active_users_1h': ('activeUsers', 'last1hour'),
+    'active_users_24h': ('activeUsers', 'last24hours'),
+}
+COLUMNS = ['time'] + list(METRICS)
+PERIODS = ('hour', 'day', 'week', 'month')
+STATS_PREFIXES = ('stats_raw_', 'stats_batch_')
+STATS_EXTENSIONS = ('.json', '.jsonl', SNAPSHOT_EXTENSION)
+DAV = '{DAV:}'
+
+
+# --- INGEST ---
+
+def metric_values(serverinfo):
+    """
+    The METRICS of one serverinfo response (with or without the ocs
+    envelope) as floats; missing or non-numeric values become NaN.
+    """
+    data = serverinfo.get('ocs', {}).get('data', serverinfo) if isinstance(serverinfo, dict) else {}
+    values = []
+    for path in METRICS.values():
+        value = data
+        for key in path:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                value = None
+                break
+        try:
+            values.append(float(value))
+        except (TypeError, ValueError):
+            values.append(math.nan)
+    return values
+
+
+def parse_stats_file(name, data):
+    """
+    Samples of one stats file as [(timestamp, [metric values])].
+    """
+    if name.endswith(SNAPSHOT_EXTENSION):
+        return [(t, metric_values(sample)) for t, sample in SnapshotReader(data).samples()]
+    if name.endswith('.jsonl'):
+        rows = []
+        for line in data.decode('utf-8').splitlines():
+            if line.strip():
+                record = json.loads(line)
+                rows.append((datetime.fromisoformat(record['time']).timestamp(), metric_values(record['serverinfo'])))
+        return rows
+    # stats_raw_<local time>.json holds one response
+    taken = datetime.strptime(name[len('stats_raw_'):-len('.json')], "%Y-%m-%d_%H-%M-%S")
+    return [(taken.timestamp(), metric_values(json.loads(data)))]
+
+
+@traced()
+def list_stats_files(folder_url):
+    """
+    The stats files of a folder as {name: etag}, from one Depth 1 PROPFIND.
+    """
+    resp = http_client.request('PROPFIND', folder_url, headers={'Depth': '1', 'Content-Type': 'application/xml'},
+                               data='<?xml version="1.0"?><d:propfind xmlns:d="DAV:"><d:prop>'
+                                    '<d:getetag/><d:resourcetype/></d:prop></d:propfind>')
+    if resp.status_code != 207:
+        raise RuntimeError(f"Could not list {folder_url}: {resp.status_code}")
+    files = {}
+    for response in ET.fromstring(resp.content).iter(f'{DAV}response'):
+        name = unquote(response.findtext(f'{DAV}href', '')).rstrip('/').rpartition('/')[2]
+        if name.startswith(STATS_PREFIXES) and name.endswith(STATS_EXTENSIONS):
+            files[name] = response.findtext(f'.//{DAV}getetag', '').strip('"')
+    return files
+
+
+@traced()
+def download_stats_file(folder_url, name):
+    resp = http_client.get(f"{folder_url}{name}")
+    resp.raise_for_status()
+    return parse_stats_file(name, resp.content)
+
+
+class ColumnStore:
+    """
+    The local cache: one <column>.f64 file of little-endian float64 values
+    per column and index.json with the row count and the ingested files'
+    ETags. Columns are appended to; rows beyond the indexed count (from an
+    interrupted run) are cut off when the store is opened.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, 'index.json')
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = None
+        if self.index is None or self.index.get('columns') != COLUMNS:
+            # New cache or different metrics: start over
+            self.index = {'columns': COLUMNS, 'rows': 0, 'files': {}}
+        for column in COLUMNS:
+            with open(self._column_path(column), 'ab') as f:
+                f.truncate(self.index['rows'] * 8)
+
+    def _column_path(self, column):
+        return os.path.join(self.path, f"{column}.f64")
+
+    def append(self, rows):
+        """
+        Appends [(timestamp, [metric values])]; call save() to commit them.
+        """
+        if not rows:
+            return
+        for number, column in enumerate(COLUMNS):
+            values = array('d', (row[0] for row in rows) if number == 0 else (row[1][number - 1] for row in rows))
+            if sys.byteorder == 'big':
+                values.byteswap()
+            with open(self._column_path(column), 'ab') as f:
+                f.write(values.tobytes())
+        self.index['rows'] += len(rows)
+
+    def save(self):
+        temp = self.index_path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(temp, self.index_path)
+
+    def load(self):
+        """
+        All columns as {name: array}, deduplicated by time (a re-ingested
+        file wins) and sorted by time; NumPy arrays when NumPy is available.
+        """
+        rows = self.index['rows']
+        columns = {}
+        for column in COLUMNS:
+            if np is not None:
+                columns[column] = np.fromfile(self._column_path(column), dtype='<f8', count=rows)
+            else:
+                values = array('d')
+                with open(self._column_path(column), 'rb') as f:
+                    values.frombytes(f.read(rows * 8))
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                columns[column] = values
+        if np is not None:
+            # Last occurrence of each timestamp, in time order
+            reversed_times = columns['time'][::-1]
+            _, first = np.unique(reversed_times, return_index=True)
+            keep = rows - 1 - first
+            return {column: values[keep] for column, values in columns.items()}
+        latest = {t: i for i, t in enumerate(columns['time'])}
+        order = [latest[t] for t in sorted(latest)]
+        return {column: [values[i] for i in order] for column, values in columns.items()}
+
+
+@traced()
+def ingest(store, folder_url, workers=NC_STATS_WORKERS):
+    """
+    Downloads the stats files that are new or changed since the last run,
+    workers at a time, and appends their samples to the store. Returns
+    (files ingested, samples added, files that failed).
+    """
+    remote = list_stats_files(folder_url)
+    known = store.index['files']
+    pending = sorted(name for name, etag in remote.items() if known.get(name) != etag)
+    print(f"{len(remote)} stats files, {len(pending)} new or changed")
+    samples = 0
+    failed = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = {pool.submit(download_stats_file, folder_url, name): name for name in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"Error: Could not ingest {name}: {e}")
+                failed.append(name)
+                continue
+            store.append(rows)
+            known[name] = remote[name]
+            samples += len(rows)
+            # Commit now and then so an interrupted run keeps most of its work
+            if done % 500 == 0:
+                store.save()
+                print(f"{done} of {len(pending)} files ingested")
+    store.save()
+    if pending:
+        print(f"Ingested {len(pending) - len(failed)} files ({samples} samples) in {time.monotonic() - start:.1f}s")
+    return len(pending) - len(failed), samples, failed
+
+
+# --- ROLLUPS ---
+
+def local_offsets(times):
+    """
+    UTC offset in seconds of every timestamp, looked up once per hour so DST changes are honoured.
+    """
+    if np is not None:
+        hours, inverse = np.unique((times // 3600).astype(np.int64), return_inverse=True)
+        offsets = np.array([datetime.fromtimestamp(h * 3600).astimezone().utcoffset().total_seconds()
+                            for h in hours.tolist()])
+        return offsets[inverse]
+    cache = {}
+    offsets = []
+    for t in times:
+        hour = int(t // 3600)
+        if hour not in cache:
+            cache[hour] = datetime.fromtimestamp(hour * 3600).astimezone().utcoffset().total_seconds()
+        offsets.append(cache[hour])
+    return offsets
+
+
+def period_keys(times, period):
+    """
+    Integer key of the local period of every timestamp: hours or days since
+    the epoch, Monday-based weeks or months since 1970-01.
+    """
+    if np is not None:
+        local = times + local_offsets(times)
+        if period == 'hour':
+            return (local // 3600).astype(np.int64)
+        days = (local // 86400).astype(np.int64)
+        if period == 'day':
+            return days
+        if period == 'week':
+            # 1970-01-01 was a Thursday
+            return (days + 3) // 7
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    keys = []
+    for t, offset in zip(times, local_offsets(times)):
+        local = t + offset
+        days = int(local // 86400)
+        if period == 'hour':
+            keys.append(int(local // 3600))
+        elif period == 'day':
+            keys.append(days)
+        elif period == 'week':
+            keys.append((days + 3) // 7)
+        else:
+            date = datetime(1970, 1, 1) + timedelta(days=days)
+            keys.append((date.year - 1970) * 12 + date.month - 1)
+    return keys
+
+
+def period_label(key, period):
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    if period == 'hour':
+        return (epoch + timedelta(hours=key)).strftime("%Y-%m-%d %H:00")
+    if period == 'day':
+        return (epoch + timedelta(days=key)).strftime("%Y-%m-%d")
+    if period == 'week':
+        return (epoch + timedelta(days=key * 7 - 3)).strftime("%Y-%m-%d")
+    return f"{1970 + key // 12}-{key % 12 + 1:02d}"
+
+
+def percentile_index(count, fraction=0.95):
+    """
+    Nearest-rank index of a percentile in a sorted group of count values.
+    """
+    return max(math.ceil(fraction * count) - 1, 0)
+
+
+def rollup(keys, values):
+    """
+    Groups values by period key and returns [(key, count, mean, min, max,
+    p95)] in key order; NaN values are left out.
+    """
+    if np is not None:
+        valid = ~np.isnan(values)
+        keys, values = keys[valid], values[valid]
+        if not len(values):
+            return []
+        order = np.lexsort((values, keys))
+        keys, values = keys[order], values[order]
+        groups, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        means = np.add.reduceat(values, starts) / counts
+        p95 = values[starts + np.ceil(0.95 * counts).astype(np.int64) - 1]
+        return list(zip(groups.tolist(), counts.tolist(), means.tolist(), values[starts].tolist(),
+                        values[starts + counts - 1].tolist(), p95.tolist()))
+    grouped = {}
+    for key, value in zip(keys, values):
+        if not math.isnan(value):
+            grouped.setdefault(key, []).append(value)
+    result = []
+    for key in sorted(grouped):
+        group = sorted(grouped[key])
+        result.append((key, len(group), sum(group) / len(group), group[0], group[-1],
+                       group[percentile_index(len(group))]))
+    return result
+
+
+def growth(rows, period):
+    """
+    Growth of a metric over its rollup rows: (first mean, last mean, change
+    per day from a least-squares fit of the period means, total change in %).
+    """
+    if len(rows) < 2:
+        return None
+    seconds = {'hour': 3600, 'day': 86400, 'week': 7 * 86400, 'month': 30.44 * 86400}[period]
+    xs = [(row[0] - rows[0][0]) * seconds / 86400 for row in rows]
+    ys = [row[2] for row in rows]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0
+    change = (ys[-1] - ys[0]) / abs(ys[0]) * 100 if ys[0] else math.nan
+    return ys[0], ys[-1], slope, change
+
+
+def select_range(columns, start=None, end=None):
+    times = columns['time']
+    if start is None and end is None:
+        return columns
+    low = datetime.fromisoformat(start).timestamp() if start else -math.inf
+    high = datetime.fromisoformat(end).timestamp() if end else math.inf
+    if np is not None:
+        mask = (times >= low) & (times < high)
+        return {name: values[mask] for name, values in columns.items()}
+    keep = [i for i, t in enumerate(times) if low <= t < high]
+    return {name: [values[i] for i in keep] for name, values in columns.items()}
+
+
+@traced()
+def analyze(columns, metrics, period='day'):
+    """
+    Rollups and growth of the given metrics: {metric: (rows, growth)}.
+    """
+    keys = period_keys(columns['time'], period)
+    return {metric: (rows, growth(rows, period))
+            for metric in metrics for rows in [rollup(keys, columns[metric])]}
+
+
+def format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '-'
+    if abs(value) >= 1e6:
+        return f"{value:.4g}"
+    return f"{value:.2f}" if value != int(value) else f"{int(value)}"
+
+
+def print_analysis(results, period, show_rollups=True):
+    if show_rollups:
+        for metric, (rows, _) in results.items():
+            if not rows:
+                continue
+            print(f"\n{metric:<18} {'samples':>8} {'mean':>12} {'min':>12} {'max':>12} {'p95':>12}")
+            for key, count, mean, low, high, p95 in rows:
+                print(f"  {period_label(key, period):<16} {count:>8} {format_value(mean):>12} {format_value(low):>12} "
+                      f"{format_value(high):>12} {format_value(p95):>12}")
+    print(f"\n{'growth':<18} {'first':>12} {'last':>12} {'per day':>12} {'change %':>9}")
+    for metric, (_, trend) in results.items():
+        if trend:
+            first, last, per_day, change = trend
+            print(f"{metric:<18} {format_value(first):>12} {format_value(last):>12} {format_value(per_day):>12} "
+                  f"{format_value(change):>9}")
+
+
+def write_csv(results, period, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("metric,period,samples,mean,min,max,p95\n")
+        for metric, (rows, _) in results.items():
+            for key, count, mean, low, high, p95 in rows:
+                f.write(f"{metric},{period_label(key, period)},{count},{mean!r},{low!r},{high!r},{p95!r}\n")
+    print(f"Rollups written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and roll up the serverinfo statistics in NC_STATS_DIR.")
+    parser.add_argument("--period", choices=PERIODS, default='day', help="rollup period")
+    parser.add_argument("--start", help="first day/time to analyse (ISO)")
+    parser.add_argument("--end", help="end of the range (ISO, exclusive)")
+    parser.add_argument("--metrics", help=f"comma-separated metrics (default: all of {', '.join(METRICS)})")
+    parser.add_argument("--offline", action="store_true", help="only analyse the local cache, do not fetch")
+    parser.add_argument("--growth-only", action="store_true", help="print only the growth summary")
+    parser.add_argument("--csv", metavar="FILE", help="write the rollups as CSV")
+    parser.add_argument("--cache", default=NC_STATS_CACHE, help="directory of the columnar cache")
+    parser.add_argument("--workers", type=int, default=NC_STATS_WORKERS, help="parallel downloads")
+    parser.add_argument("--trace", metavar="FILE", default=NC_TRACE_FILE,
+                        help="write JSONL spans and HTTP requests and print a latency summary")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+
+    metrics = [m.strip() for m in args.metrics.split(',')] if args.metrics else list(METRICS)
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        print(f"Unknown metric(s) {', '.join(unknown)}; available: {', '.join(METRICS)}")
+        sys.exit(1)
+
+    store = ColumnStore(args.cache)
+    failed = []
+    if not args.offline:
+        http_client.set_max_connections(max(NC_HTTP_MAX_CONNECTIONS, args.workers))
+        try:
+            _, _, failed = ingest(store, f"{NC_URL}/remote.php/dav/files/{NC_USER}/{DEST_FOLDER}/", args.workers)
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    start = time.monotonic()
+    columns = select_range(store.load(), args.start, args.end)
+    if not len(columns['time']):
+        print("No samples in the selected range")
+        sys.exit(1)
+    results = analyze(columns, metrics, args.period)
+    print_analysis(results, args.period, show_rollups=not args.growth_only)
+    print(f"\nAnalysed {len(columns['time'])} samples in {time.monotonic() - start:.2f}s"
+          f"{'' if np is not None else ' (without NumPy)'}")
+    if args.csv:
+        write_csv(results, args.period, args.csv)
+    sys.exit(1 if failed else 0)
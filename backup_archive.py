@@ -0,0 +1,298 @@
+import hashlib
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+ARCHIVE_FORMATS = {'zip': '.zip', 'tar.zst': '.tar.zst'}
+
+# Formats that are already compressed; recompressing them only burns CPU
+PRECOMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif', '.pdf',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar',
+    '.mp3', '.m4a', '.ogg', '.opus', '.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.woff', '.woff2',
+}
+
+# A sample that deflates to more than this fraction of its size is stored as is
+INCOMPRESSIBLE_RATIO = 0.95
+SAMPLE_SIZE = 64 * 1024
+COPY_BUFFER = 1024 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+
+# Checksum type of the per-file and archive checksums in manifests; Nextcloud
+# stores it from the OC-Checksum upload header and reports it as oc:checksums
+CHECKSUM_TYPE = 'SHA1'
+
+
+def new_checksum():
+    return hashlib.new(CHECKSUM_TYPE.lower())
+
+
+def format_checksum(digest):
+    """
+    A hash object as Nextcloud writes checksums, e.g. SHA1:<hex>.
+    """
+    return f"{CHECKSUM_TYPE}:{digest.hexdigest()}"
+
+
+class HashingStream:
+    """
+    Wraps a file object and hashes every byte read from or written through it,
+    so a checksum is known without a second pass over the data.
+    """
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self.digest = new_checksum()
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.digest.update(data)
+        return data
+
+    def write(self, data):
+        self.digest.update(data)
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def checksum(self):
+        return format_checksum(self.digest)
+
+
+def is_precompressed(path):
+    """
+    True for files that should be stored without compression: known compressed
+    formats by extension, or content whose first SAMPLE_SIZE bytes barely deflate.
+    """
+    if os.path.splitext(path)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+        return True
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if len(sample) < 4096:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _compress_entry(path, level):
+    """
+    Runs on a worker thread (zlib releases the GIL). Returns the entry's
+    method, CRC-32, sizes, a spooled file holding the data to write, so a
+    large file never needs to fit in memory, and the content's checksum.
+    """
+    stored = is_precompressed(path)
+    digest = new_checksum()
+    crc = 0
+    size = 0
+    output = tempfile.SpooledTemporaryFile(max_size=16 * COPY_BUFFER)
+    compressor = None if stored else zlib.compressobj(level, zlib.DEFLATED, -15)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(COPY_BUFFER)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            digest.update(block)
+            size += len(block)
+            output.write(block if stored else compressor.compress(block))
+    if compressor is not None:
+        output.write(compressor.flush())
+    compressed_size = output.tell()
+    output.seek(0)
+    return (ZIP_STORED if stored else ZIP_DEFLATED), crc, size, compressed_size, output, format_checksum(digest)
+
+
+class ParallelZipWriter:
+    """
+    Minimal ZIP64-capable writer whose entries are compressed on a thread pool
+    and written in order. The output is a standard archive readable by zipfile
+    and unzip; the writer only exists because zipfile compresses on the calling
+    thread and cannot take precompressed data. Everything written is hashed
+    into checksum; checksums maps the entries to their content's checksum.
+    """
+    def __init__(self, path):
+        self._file = HashingStream(open(path, 'wb'))
+        self._central = []
+        self.entries = 0
+        self.stored = 0
+        self.checksums = {}
+
+    def _local_header(self, name, method, dos_time, dos_date, crc, size, compressed_size):
+        zip64 = size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, size, compressed_size) if zip64 else b''
+        header = struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', 45 if zip64 else 20, 0x800, method, dos_time, dos_date,
+                             crc, ZIP64_LIMIT if zip64 else compressed_size, ZIP64_LIMIT if zip64 else size,
+                             len(name), len(extra))
+        return header + name + extra
+
+    def add(self, arcname, method, crc, size, compressed_size, data, mtime, is_dir=False):
+        name = arcname.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(mtime)
+        offset = self._file.tell()
+        self._file.write(self._local_header(name, method, dos_time, dos_date, crc, size, compressed_size))
+        if data is not None:
+            shutil.copyfileobj(data, self._file, COPY_BUFFER)
+        attributes = (0o40755 << 16) | 0x10 if is_dir else 0o100644 << 16
+        self._central.append((name, method, dos_time, dos_date, crc, size, compressed_size, offset, attributes))
+        self.entries += 1
+        self.stored += method == ZIP_STORED and not is_dir
+
+    def close(self):
+        cd_offset = self._file.tell()
+        for name, method, dos_time, dos_date, crc, size, compressed_size, offset, attributes in self._central:
+            zip64_fields = [v for v in (size, compressed_size, offset) if v >= ZIP64_LIMIT]
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b''
+            version = 45 if zip64_fields else 20
+            self._file.write(struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', (3 << 8) | version, version, 0x800,
+                                         method, dos_time, dos_date, crc,
+                                         min(compressed_size, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+                                         len(name), len(extra), 0, 0, 0, attributes, min(offset, ZIP64_LIMIT)))
+            self._file.write(name + extra)
+        cd_end = self._file.tell()
+        cd_size = cd_end - cd_offset
+        count = len(self._central)
+        if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            self._file.write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, (3 << 8) | 45, 45, 0, 0,
+                                         count, count, cd_size, cd_offset))
+            self._file.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, cd_end, 1))
+        self._file.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                     min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0))
+        self._file.close()
+
+    @property
+    def checksum(self):
+        return self._file.checksum
+
+
+def _walk_sorted(source_dir):
+    """
+    Yields (relative path, absolute path, is_dir) for everything below source_dir, directories first.
+    """
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        rel_root = os.path.relpath(root, source_dir)
+        for name in dirs:
+            yield os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/'), os.path.join(root, name), True
+        for name in sorted(files):
+            yield os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/'), os.path.join(root, name), False
+
+
+def create_zip(source_dir, output_path, level=6, workers=None):
+    """
+    Zips source_dir with per-entry parallel deflate; precompressed files are stored.
+    At most 2 * workers entries are in flight, which bounds memory and temp space.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = ParallelZipWriter(output_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        window = []
+
+        def write_oldest():
+            rel_path, path, future = window.pop(0)
+            method, crc, size, compressed_size, data, checksum = future.result()
+            writer.checksums[rel_path] = checksum
+            with data:
+                writer.add(rel_path, method, crc, size, compressed_size, data, os.path.getmtime(path))
+
+        for rel_path, path, is_dir in _walk_sorted(source_dir):
+            if is_dir:
+                while window:
+                    write_oldest()
+                writer.add(rel_path + '/', ZIP_STORED, 0, 0, 0, None, os.path.getmtime(path), is_dir=True)
+                continue
+            window.append((rel_path, path, pool.submit(_compress_entry, path, level)))
+            if len(window) >= 2 * workers:
+                write_oldest()
+        while window:
+            write_oldest()
+    writer.close()
+    return writer
+
+
+def require_format(archive_format):
+    """
+    Raises ValueError for unknown formats and RuntimeError if the backend's
+    optional dependency is missing, so callers can fail before downloading.
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format '{archive_format}' (use {', '.join(ARCHIVE_FORMATS)})")
+    if archive_format == 'tar.zst':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise RuntimeError("The tar.zst format needs the 'zstandard' package (pip install zstandard)")
+
+
+def create_tar_zst(source_dir, output_path, level=10, workers=None):
+    """
+    Writes a tar stream through zstd's multi-threaded compressor. Needs the
+    optional zstandard package; zstd passes incompressible data through at
+    almost no cost, so attachments need no special handling here.
+    Returns (file checksums, archive checksum).
+    """
+    require_format('tar.zst')
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=level, threads=workers or -1)
+    checksums = {}
+    output = HashingStream(open(output_path, 'wb'))
+    with output, compressor.stream_writer(output) as stream:
+        with tarfile.open(fileobj=stream, mode='w|') as tar:
+            for rel_path, path, is_dir in _walk_sorted(source_dir):
+                info = tar.gettarinfo(path, arcname=rel_path)
+                if is_dir or not info.isfile():
+                    tar.addfile(info)
+                    continue
+                with open(path, 'rb') as f:
+                    source = HashingStream(f)
+                    tar.addfile(info, source)
+                checksums[rel_path] = source.checksum
+    return checksums, output.checksum
+
+
+def create_archive(source_dir, output_path, archive_format='zip', level=None, workers=None):
+    """
+    Archives source_dir into output_path with the selected backend and prints
+    the wall time and size. level=None uses the backend's default.
+    Returns the checksums computed while writing: (relative path -> file
+    checksum, checksum of the archive itself).
+    """
+    require_format(archive_format)
+    start = time.monotonic()
+    if archive_format == 'zip':
+        writer = create_zip(source_dir, output_path, 6 if level is None else level, workers)
+        checksums, archive_checksum = writer.checksums, writer.checksum
+        detail = f"{writer.entries} entries, {writer.stored} stored without recompression"
+    else:
+        checksums, archive_checksum = create_tar_zst(source_dir, output_path, 10 if level is None else level, workers)
+        detail = f"zstd level {10 if level is None else level}"
+    seconds = time.monotonic() - start
+    print(f"Archive {output_path}: {os.path.getsize(output_path) / 1024 / 1024:.1f} MB in {seconds:.1f}s ({detail})")
+    return checksums, archive_checksum
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+# Retention periods of a GFS policy and how a backup timestamp is bucketed
+GFS_PERIODS = {
+    'daily': lambda d: d.date(),
+    'weekly': lambda d: tuple(d.isocalendar()[:2]),
+    'monthly': lambda d: (d.year, d.month),
+}
+
+
+class BackupCatalog:
+    """
+    Small SQLite index of the backups in NC_COLLECTIVES_BACKUP_FOLDER.
+    It is synced to the backup folder, so retention and listing don't need to
+    scan the folder with PROPFIND on every run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS backups (
+                               name TEXT PRIMARY KEY,
+                               kind TEXT NOT NULL,
+                               created TEXT NOT NULL,
+                               size INTEGER,
+                               files INTEGER,
+                               chain TEXT,
+                               manifest TEXT)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self.db.commit()
+
+    def add(self, name, kind, created, size=None, files=None, chain=None, manifest=None):
+        """
+        Records a backup; created is a timezone-aware datetime, stored as UTC ISO 8601.
+        """
+        self.db.execute("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (name, kind, created.astimezone(timezone.utc).isoformat(), size, files,
+                         json.dumps(chain or [name]), json.dumps(manifest) if manifest is not None else None))
+        self.db.commit()
+
+    def remove(self, names):
+        self.db.executemany("DELETE FROM backups WHERE name = ?", [(n,) for n in names])
+        self.db.commit()
+
+    def backups(self, kinds=None):
+        """
+        Backups as dicts, oldest first, optionally limited to the given kinds.
+        """
+        rows = self.db.execute("SELECT name, kind, created, size, files, chain FROM backups ORDER BY created, name")
+        result = []
+        for name, kind, created, size, files, chain in rows:
+            if kinds and kind not in kinds:
+                continue
+            result.append({'name': name, 'kind': kind, 'created': datetime.fromisoformat(created),
+                           'size': size, 'files': files, 'chain': json.loads(chain)})
+        return result
+
+    def manifest(self, name):
+        row = self.db.execute("SELECT manifest FROM backups WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def close(self):
+        self.db.close()
+
+
+def parse_retention_policy(spec, default_last=None):
+    """
+    Parses "last=3,daily=7,weekly=4,monthly=12" into a dict of counts.
+    Without a spec, default_last (NC_COLLECTIVES_BACKUP_COUNT) gives keep-last-N;
+    returns None if there is no policy at all, meaning nothing is deleted.
+    """
+    if not spec:
+        return {'last': int(default_last)} if default_last else None
+    policy = {}
+    for part in spec.split(','):
+        key, _, value = part.strip().partition('=')
+        if key not in ('last', *GFS_PERIODS):
+            raise ValueError(f"Unknown retention rule '{key}' (use last, daily, weekly, monthly)")
+        policy[key] = int(value)
+    return policy
+
+
+def select_retained(backups, policy):
+    """
+    Names of the backups a policy keeps: the newest `last` backups plus, for
+    each GFS period, the newest backup of each of the most recent `daily`
+    days, `weekly` ISO weeks and `monthly` months (bucketed in local time).
+    The newest backup is always kept, and every kept backup keeps its chain.
+    """
+    ordered = sorted(backups, key=lambda b: b['created'], reverse=True)
+    if not ordered:
+        return set()
+    keep = {ordered[0]['name']}
+    keep.update(b['name'] for b in ordered[:policy.get('last', 0)])
+    for period, bucket in GFS_PERIODS.items():
+        seen = set()
+        for backup in ordered:
+            key = bucket(backup['created'].astimezone())
+            if key in seen:
+                continue
+            if len(seen) >= policy.get(period, 0):
+                break
+            seen.add(key)
+            keep.add(backup['name'])
+    for backup in ordered:
+        if backup['name'] in keep:
+            keep.update(backup['chain'])
+    return keep
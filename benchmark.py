@@ -0,0 +1,168 @@
+"""
+Benchmarks the scripts against mock_nextcloud.py, without touching a real server.
+
+Every scenario gets a fresh mock server (in this process) and runs the script
+as a child process in a scratch directory, recording wall time, requests seen
+by the server and the child's peak RSS:
+
+    python benchmark.py                                  # all scenarios
+    python benchmark.py --scenarios backup-1k,setup-1 --latency 5
+    python benchmark.py --backup-args="--stream" --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from mock_nextcloud import build_server, parse_args as mock_args
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    'backup-1k': {'kind': 'backup', 'files': 1000},
+    'backup-10k': {'kind': 'backup', 'files': 10000},
+    'backup-100k': {'kind': 'backup', 'files': 100000},
+    'setup-1': {'kind': 'setup', 'groups': 1},
+    'setup-many': {'kind': 'setup', 'groups': None},
+}
+
+SETUP_CODE = """
+import sys
+import setup_working_group
+ok = all(setup_working_group.run_group_setup(f"BENCH_{i:03d}") for i in range(int(sys.argv[1])))
+sys.exit(0 if ok else 1)
+"""
+
+
+def start_mock(args, files):
+    """
+    Starts a mock server on a free port; returns (server, base URL).
+    """
+    argv = ['--port', '0', '--files', str(files), '--collectives', str(args.collectives),
+            '--file-size', str(args.file_size), '--latency', str(args.latency), '--throttle', str(args.throttle)]
+    if not args.depth_infinity:
+        argv.append('--no-depth-infinity')
+    config = mock_args(argv)
+    server = build_server(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def child_env(url):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': REPO_DIR,
+        'NC_URL': url,
+        'NC_ANCHOR_USER': 'anchor_user',
+        'NC_ANCHOR_APP_PW': 'benchmark',
+        'NC_COLLECTIVES_FOLDER': 'Collectives',
+        'NC_COLLECTIVES_BACKUP_FOLDER': 'Backup/Collectives',
+        'NC_COLLECTIVES_BACKUP_COUNT': '2',
+        'NC_ALL_MEMBERS_GROUP': 'all_users',
+        'NC_ADMIN_GROUP': 'admin',
+        'NC_QUOTA_GB': '10',
+        'NC_COLLECTIVE_NAME': 'Wiki',
+        'NC_PUB_FOLDER_PREFIX': '01',
+        'NC_PRIV_FOLDER_PREFIX': '02',
+        'NC_PUBLIC_SUBFOLDER': 'Oeffentlich',
+        'NC_SUBFOLDERS': 'Oeffentlich,Internal,Archive,Special_Project',
+        'NC_STATS_DIR': 'Stats',
+    })
+    return env
+
+
+def run_child(command, cwd, env, log_path):
+    """
+    Runs command to completion; returns (exit code, wall seconds, peak RSS in MB).
+    """
+    start = time.monotonic()
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux
+    return process.returncode, time.monotonic() - start, usage.ru_maxrss / 1024
+
+
+def run_scenario(name, spec, args):
+    server, url = start_mock(args, spec.get('files', 0))
+    state = server.RequestHandlerClass.state
+    env = child_env(url)
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as work_dir:
+            if spec['kind'] == 'backup':
+                command = [sys.executable, os.path.join(REPO_DIR, 'collectives_backup.py'),
+                           *shlex.split(args.backup_args)]
+            else:
+                for group in ('all_users', 'admin'):
+                    state.groups.setdefault(group, set())
+                groups = spec['groups'] or args.groups
+                command = [sys.executable, '-c', SETUP_CODE, str(groups)]
+            log_path = os.path.join(args.log_dir, f"{name}.log")
+            code, seconds, rss = run_child(command, work_dir, env, log_path)
+    finally:
+        server.shutdown()
+        server.server_close()
+    with state.lock:
+        requests = {k: v for k, v in state.stats.items()}
+    total = sum(v for k, v in requests.items() if k != 'throttled')
+    return {'scenario': name, 'exit_code': code, 'seconds': round(seconds, 3), 'requests': total,
+            'throttled': requests.get('throttled', 0), 'peak_rss_mb': round(rss, 1),
+            'requests_by_endpoint': requests, 'log': log_path}
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'scenario':<12} {'exit':>4} {'wall s':>9} {'requests':>9} {'req/s':>8} {'429s':>6} {'RSS MB':>8}"
+          + ("  speedup" if baseline else ""))
+    for r in results:
+        rate = r['requests'] / r['seconds'] if r['seconds'] else 0
+        line = (f"{r['scenario']:<12} {r['exit_code']:>4} {r['seconds']:>9.2f} {r['requests']:>9} {rate:>8.0f} "
+                f"{r['throttled']:>6} {r['peak_rss_mb']:>8.1f}")
+        if baseline and r['scenario'] in baseline:
+            line += f"  {baseline[r['scenario']]['seconds'] / r['seconds']:>6.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Nextcloud scripts against the offline mock.")
+    parser.add_argument("--scenarios", default=','.join(SCENARIOS),
+                        help=f"comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--backup-args", default="", help="extra arguments for collectives_backup.py")
+    parser.add_argument("--groups", type=int, default=20, help="groups created by setup-many")
+    parser.add_argument("--collectives", type=int, default=10)
+    parser.add_argument("--file-size", type=int, default=2048)
+    parser.add_argument("--latency", type=float, default=0, help="mock latency per request in ms")
+    parser.add_argument("--throttle", type=float, default=0, help="mock requests per second before 429")
+    parser.add_argument("--no-depth-infinity", dest="depth_infinity", action="store_false")
+    parser.add_argument("--log-dir", default=tempfile.gettempdir(), help="where the script output is kept")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compute speedups against")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f"Error: Unknown scenario(s): {', '.join(unknown)}")
+        sys.exit(1)
+
+    results = []
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        results.append(run_scenario(name, SCENARIOS[name], args))
+        if results[-1]['exit_code'] != 0:
+            print(f"Warning: {name} exited with {results[-1]['exit_code']}, see {results[-1]['log']}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r['scenario']: r for r in json.load(f)['results']}
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=1)
+    sys.exit(0 if all(r['exit_code'] == 0 for r in results) else 1)
@@ -1,9 +1,33 @@
+import argparse
+import atexit
+import glob
+import hashlib
+import io
+import json
 import os
-import requests
+import queue
+import re
 import shutil
+import struct
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
-from urllib.parse import unquote
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, unquote
+
+from backup_archive import (ARCHIVE_FORMATS, HashingStream, create_archive, format_checksum, new_checksum,
+                            require_format)
+from backup_catalog import BackupCatalog, parse_retention_policy, select_retained
+from nextcloud_client import NC_HTTP_MAX_CONNECTIONS, NextcloudClient
+from tracing import NC_TRACE_FILE, traced, tracer
 
 # --- CONFIGURATION ---
 NEXTCLOUD_URL = os.getenv("NC_URL")
@@ -12,6 +36,29 @@ ANCHOR_APP_PW = os.getenv("NC_ANCHOR_APP_PW")
 NC_COLLECTIVES_FOLDER = os.getenv("NC_COLLECTIVES_FOLDER")
 NC_COLLECTIVES_BACKUP_FOLDER = os.getenv("NC_COLLECTIVES_BACKUP_FOLDER")
 NC_COLLECTIVES_BACKUP_COUNT = os.getenv("NC_COLLECTIVES_BACKUP_COUNT")
+# Optional GFS retention, e.g. "last=3,daily=7,weekly=4,monthly=12"; defaults to keep-last NC_COLLECTIVES_BACKUP_COUNT
+NC_COLLECTIVES_RETENTION = os.getenv("NC_COLLECTIVES_RETENTION")
+# Number of parallel PROPFIND/GET requests; 1 keeps the old sequential walk
+NC_COLLECTIVES_WORKERS = int(os.getenv("NC_COLLECTIVES_WORKERS", "8"))
+
+# Incremental mode starts a new full backup after this many deltas in a chain
+NC_COLLECTIVES_MAX_DELTAS = int(os.getenv("NC_COLLECTIVES_MAX_DELTAS", "6"))
+
+# Archives larger than one chunk are uploaded with Nextcloud's chunked upload (v2)
+NC_COLLECTIVES_UPLOAD_CHUNK_MB = int(os.getenv("NC_COLLECTIVES_UPLOAD_CHUNK_MB", "10"))
+NC_COLLECTIVES_UPLOAD_PARALLEL = int(os.getenv("NC_COLLECTIVES_UPLOAD_PARALLEL", "4"))
+
+# Collectives backed up at the same time by --per-collective (they share NC_COLLECTIVES_WORKERS)
+NC_COLLECTIVES_PARALLEL = int(os.getenv("NC_COLLECTIVES_PARALLEL", "2"))
+
+# Archive backend of the temp directory mode: "zip" (parallel deflate) or "tar.zst" (needs zstandard)
+NC_COLLECTIVES_ARCHIVE_FORMAT = os.getenv("NC_COLLECTIVES_ARCHIVE_FORMAT", "zip")
+# Compression level (zip 0-9, zstd 1-22); unset uses the backend's default
+NC_COLLECTIVES_COMPRESSION_LEVEL = os.getenv("NC_COLLECTIVES_COMPRESSION_LEVEL")
+NC_COLLECTIVES_COMPRESSION_WORKERS = int(os.getenv("NC_COLLECTIVES_COMPRESSION_WORKERS", str(os.cpu_count() or 1)))
+
+# Read/write granularity for streamed downloads and uploads
+CHUNK_SIZE = 1024 * 1024
 
 
 
@@ -27,59 +74,553 @@ REMOTE_SOURCE_PATH = f"/remote.php/dav/files/{ANCHOR_USER}/{NC_COLLECTIVES_FOLDE
 
 REMOTE_TARGET_FOLDER = f"/remote.php/dav/files/{ANCHOR_USER}/{NC_COLLECTIVES_BACKUP_FOLDER}/"
 
+# Staging area for chunked uploads
+REMOTE_UPLOADS_FOLDER = f"/remote.php/dav/uploads/{ANCHOR_USER}/"
+
+# Streamed archives are uploaded under this suffix and only renamed once complete and verified
+PARTIAL_SUFFIX = ".partial"
+
+# Per-collective archives of --per-collective, one subfolder per collective
+PER_COLLECTIVE_FOLDER = "collectives/"
+
+# Content-addressed store used by --dedup (objects/ and snapshots/ below it)
+REMOTE_STORE_FOLDER = f"{REMOTE_TARGET_FOLDER}store/"
+
 LOCAL_TEMP_DIR = "./temp_collectives"
-TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-ZIP_FILENAME = f"collectives_backup_{TIMESTAMP}.zip"
+# Checkpoint journal of the temp directory download, used by --resume
+LOCAL_JOURNAL = f"{LOCAL_TEMP_DIR}.journal"
+BACKUP_TIME = datetime.now().astimezone()
+TIMESTAMP = BACKUP_TIME.strftime("%Y-%m-%d_%H-%M-%S")
+ARCHIVE_BASENAME = f"collectives_backup_{TIMESTAMP}"
+ZIP_FILENAME = f"{ARCHIVE_BASENAME}.zip"
+DELTA_FILENAME = f"collectives_backup_{TIMESTAMP}.delta.zip"
+SNAPSHOT_FILENAME = f"snapshot_{TIMESTAMP}.json"
+
+# Backup catalog, kept locally and synced to the backup folder
+CATALOG_FILENAME = "collectives_catalog.sqlite"
+LOCAL_CATALOG = f"./{CATALOG_FILENAME}"
+
+# Properties requested for every listed item
+PROPFIND_BODY = """<?xml version="1.0"?>
+<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">
+  <d:prop>
+    <d:resourcetype/>
+    <d:getcontentlength/>
+    <d:getetag/>
+    <d:getlastmodified/>
+    <oc:checksums/>
+  </d:prop>
+</d:propfind>"""
+DAV_NS = '{DAV:}'
+OC_NS = '{http://owncloud.org/ns}'
 
-def download_recursive(remote_url, local_path):
+# Shared keep-alive pool with retries and rate limiting; resized to the worker count in __main__
+http_client = NextcloudClient(NEXTCLOUD_URL, ANCHOR_USER, ANCHOR_APP_PW)
+
+# --- LISTING ---
+
+class Entry(namedtuple('Entry', ['href', 'is_dir', 'size', 'etag', 'mtime', 'checksum'], defaults=(None,))):
     """
-    Recursively downloads files and directories via WebDAV.
+    One item of a PROPFIND listing; href is the raw (URL-encoded) server path.
+    checksum holds the oc:checksums Nextcloud stored from the upload's
+    OC-Checksum header (e.g. "SHA1:<hex> MD5:<hex>"), mostly None.
     """
-    if not os.path.exists(local_path):
-        os.makedirs(local_path)
+    __slots__ = ()
 
-    headers = {'Depth': '1'}
-    response = requests.request('PROPFIND', remote_url, auth=(ANCHOR_USER, ANCHOR_APP_PW), headers=headers)
+    @property
+    def url(self):
+        return f"{NEXTCLOUD_URL}{self.href}"
 
-    #print(f"PROPFIND {remote_url} - Status: {response.status_code}")
-    
-    if response.status_code != 207:
-        print(f"Error: Expected 207, got {response.status_code}")
-        return
+    @property
+    def name(self):
+        return unquote(self.href).rstrip('/').split('/')[-1]
+
+# None = not tried yet; set by the first walk() that requests Depth: infinity
+_depth_infinity_allowed = None
 
-    # Extract items from XML response
-    items = response.text.split('<d:response')[1:]
-    #print(f"Found {len(items)} items")
-    
-    for item in items:
-        href = item.split('<d:href>')[1].split('</d:href>')[0]
-        decoded_href = unquote(href)
-        full_remote_item_url = f"{NEXTCLOUD_URL}{href}"
-        
-        # Skip the current directory itself by comparing paths
-        remote_path = remote_url.replace(NEXTCLOUD_URL, '')
-        if decoded_href.rstrip('/') == unquote(remote_path).rstrip('/'):
+def _parse_response(elem):
+    """
+    Builds an Entry from a <d:response> element, regardless of the namespace prefix the server uses.
+    """
+    props = {}
+    for propstat in elem.iter(f'{DAV_NS}propstat'):
+        if ' 200 ' not in (propstat.findtext(f'{DAV_NS}status') or ''):
             continue
-            
-        item_name = decoded_href.rstrip('/').split('/')[-1]
-        local_item_path = os.path.join(local_path, item_name)
+        for prop in propstat.find(f'{DAV_NS}prop'):
+            props[prop.tag] = prop
+    href = elem.findtext(f'{DAV_NS}href').strip()
+    resourcetype = props.get(f'{DAV_NS}resourcetype')
+    size = props.get(f'{DAV_NS}getcontentlength')
+    etag = props.get(f'{DAV_NS}getetag')
+    mtime = props.get(f'{DAV_NS}getlastmodified')
+    checksums = props.get(f'{OC_NS}checksums')
+    checksum = ' '.join(c.text.strip() for c in checksums.iter(f'{OC_NS}checksum') if c.text) if checksums is not None else ''
+    return Entry(
+        href=href,
+        is_dir=href.endswith('/') or (resourcetype is not None and resourcetype.find(f'{DAV_NS}collection') is not None),
+        size=int(size.text) if size is not None and size.text else None,
+        etag=etag.text.strip('"') if etag is not None and etag.text else None,
+        mtime=mtime.text if mtime is not None else None,
+        checksum=checksum or None,
+    )
 
-        if href.endswith('/'):
-            download_recursive(full_remote_item_url, local_item_path)
-        else:
-            #print(f"Downloading: {item_name}")
-            file_resp = requests.get(full_remote_item_url, auth=(ANCHOR_USER, ANCHOR_APP_PW))
-            with open(local_item_path, 'wb') as f:
-                f.write(file_resp.content)
+def checksum_matches(remote, expected):
+    """
+    True if the server's checksum list (see Entry.checksum) contains expected
+    (TYPE:hex), None if either side has no checksum of that type.
+    """
+    if not remote or not expected:
+        return None
+    kind = expected.split(':', 1)[0].upper()
+    for checksum in remote.split():
+        if checksum.split(':', 1)[0].upper() == kind:
+            return checksum.lower() == expected.lower()
+    return None
+
+def iter_multistatus(stream):
+    """
+    Incrementally parses a multistatus body from a file-like stream and yields
+    one Entry per <d:response>. Parsed elements are discarded right away, so
+    memory use does not grow with the size of the listing.
+    """
+    context = ET.iterparse(stream, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == f'{DAV_NS}response':
+            yield _parse_response(elem)
+            root.clear()
+
+def propfind(remote_url, depth):
+    """
+    Sends a streaming PROPFIND for remote_url and returns (entries, status).
+    entries lazily yields every Entry below remote_url (the folder itself is
+    skipped), or is None if the server does not answer with 207.
+    """
+    response = http_client.request('PROPFIND', remote_url, data=PROPFIND_BODY, stream=True,
+                                  headers={'Depth': depth, 'Content-Type': 'application/xml'})
+    if response.status_code != 207:
+        response.close()
+        return None, response.status_code
+
+    def entries():
+        remote_path = unquote(remote_url.replace(NEXTCLOUD_URL, '')).rstrip('/')
+        with response:
+            response.raw.decode_content = True
+            for entry in iter_multistatus(response.raw):
+                if unquote(entry.href).rstrip('/') != remote_path:
+                    yield entry
+
+    return entries(), response.status_code
+
+def list_directory(remote_url):
+    """
+    Lists one directory level and returns (subdirectory entries, file entries).
+    """
+    entries, status = propfind(remote_url, '1')
+    if entries is None:
+        print(f"Error: Expected 207, got {status} for {remote_url}")
+        return None
+
+    dirs, files = [], []
+    for entry in entries:
+        (dirs if entry.is_dir else files).append(entry)
+    return dirs, files
+
+def walk(remote_url, pool, journal=None):
+    """
+    Yields every Entry below remote_url. Uses a single Depth: infinity PROPFIND
+    when the server allows it, otherwise a parallel Depth: 1 walk on pool.
+    With a BackupJournal, completed listings are recorded per folder and
+    folders listed by an interrupted run are replayed instead of fetched again.
+    Raises RuntimeError if any folder cannot be listed.
+    """
+    global _depth_infinity_allowed
+    if _depth_infinity_allowed is not False and not (journal and journal.listings):
+        entries, status = propfind(remote_url, 'infinity')
+        if entries is not None:
+            _depth_infinity_allowed = True
+            listed = {'': []}
+            for entry in entries:
+                if journal is not None:
+                    rel_path = relative_path(entry.href, remote_url)
+                    listed.setdefault(rel_path.rpartition('/')[0], []).append(entry)
+                    if entry.is_dir:
+                        listed.setdefault(rel_path, [])
+                yield entry
+            # Only a fully received listing counts as completed
+            if journal is not None:
+                for rel_dir, children in listed.items():
+                    journal.record_listing(rel_dir, children)
+            return
+        print(f"Depth: infinity not allowed (status {status}), walking folders in parallel")
+        _depth_infinity_allowed = False
+
+    def list_or_replay(url):
+        if journal is None:
+            return list_directory(url)
+        rel_dir = relative_path(url.replace(NEXTCLOUD_URL, ''), remote_url)
+        children = journal.listings.get(rel_dir)
+        if children is None:
+            result = list_directory(url)
+            if result is not None:
+                journal.record_listing(rel_dir, result[0] + result[1])
+            return result
+        return [e for e in children if e.is_dir], [e for e in children if not e.is_dir]
+
+    pending = {pool.submit(list_or_replay, remote_url)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result is None:
+                raise RuntimeError("Directory listing failed, refusing to write an incomplete backup")
+            dirs, files = result
+            for entry in dirs:
+                pending.add(pool.submit(list_or_replay, entry.url))
+                yield entry
+            yield from files
+
+@traced()
+def list_tree(remote_url, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Lists the whole tree below remote_url.
+    Returns sorted lists of relative directory paths and (relative path, Entry) file pairs.
+    """
+    all_dirs, all_files = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for entry in walk(remote_url, pool):
+            if entry.is_dir:
+                all_dirs.append(relative_path(entry.href, remote_url))
+            else:
+                all_files.append((relative_path(entry.href, remote_url), entry))
+    return sorted(all_dirs), sorted(all_files)
+
+def relative_path(href, root_url):
+    """
+    Path of href relative to the folder at root_url, as stored in archives and manifests.
+    """
+    root_path = unquote(root_url.replace(NEXTCLOUD_URL, '')).rstrip('/') + '/'
+    return unquote(href)[len(root_path):].rstrip('/')
+
+# --- DOWNLOAD ---
 
-def upload_zip(local_zip_path, remote_target_url):
+def download_file(remote_url, local_item_path):
     """
-    Uploads the created ZIP file back to Nextcloud.
+    Downloads a single file and returns (bytes written, ETag), or None on failure.
+    The data goes to a .part file that only replaces local_item_path once the
+    byte count matches Content-Length, so a crash or a truncated response never
+    leaves a partial file under its real name.
     """
+    written = 0
+    part_path = f"{local_item_path}.part"
+    os.makedirs(os.path.dirname(local_item_path), exist_ok=True)
+    with http_client.get(remote_url, stream=True) as file_resp:
+        if file_resp.status_code != 200:
+            print(f"Error: Download of {remote_url} failed with status {file_resp.status_code}")
+            return None
+        with open(part_path, 'wb') as f:
+            for chunk in file_resp.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+        expected = file_resp.headers.get('Content-Length')
+        etag = file_resp.headers.get('ETag', '').removeprefix('W/').strip('"') or None
+    if expected is not None and int(expected) != written:
+        print(f"Error: Download of {remote_url} was truncated ({written} of {expected} bytes)")
+        os.remove(part_path)
+        return None
+    os.replace(part_path, local_item_path)
+    return written, etag
+
+class BackupJournal:
+    """
+    Append-only JSON lines log of completed directory listings and fully
+    written files for one temp directory download. Each record is flushed as
+    soon as the work it describes is done, so after a crash every record is
+    either complete or a torn last line, which is ignored.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.listings = {}
+        self.completed = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a' if resume else 'w')
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['type'] == 'listing':
+                    self.listings[record['dir']] = [Entry(*e) for e in record['entries']]
+                elif record['type'] == 'file':
+                    self.completed[record['path']] = (record['size'], record['etag'])
+
+    def _append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def record_listing(self, rel_dir, entries):
+        self.listings[rel_dir] = entries
+        self._append({'type': 'listing', 'dir': rel_dir, 'entries': [list(e) for e in entries]})
+
+    def record_file(self, rel_path, size, etag):
+        self.completed[rel_path] = (size, etag)
+        self._append({'type': 'file', 'path': rel_path, 'size': size, 'etag': etag})
+
+    def is_complete(self, rel_path, local_item_path, etag):
+        """
+        True if an earlier run finished this file, it is still intact on disk
+        and the listed etag is still the one it was downloaded with, so a file
+        rewritten on the server since (even to the same size) is fetched again.
+        """
+        done = self.completed.get(rel_path)
+        return (done is not None and done[1] == etag and os.path.isfile(local_item_path)
+                and os.path.getsize(local_item_path) == done[0])
+
+    def close(self):
+        self._file.close()
+
+def remove_partial_files(local_path):
+    """
+    Deletes .part files a crashed run left in local_path; returns how many.
+    """
+    removed = 0
+    for root, _, names in os.walk(local_path):
+        for name in names:
+            if name.endswith('.part'):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+@traced('download')
+def download_concurrent(remote_url, local_path, max_workers=NC_COLLECTIVES_WORKERS, journal=None):
+    """
+    Downloads the tree below remote_url into local_path using a bounded pool of
+    worker threads. Listing (see walk) and file downloads share the pool, so
+    downloads start while the tree is still being listed and the number of
+    concurrent requests never exceeds max_workers.
+    With a BackupJournal, listings and finished files are checkpointed, and
+    files a previous run already completed are skipped.
+    Returns a dict with files, bytes, skipped, failed and seconds, plus the
+    listed dirs and file entries (relative path -> Entry) for the manifest.
+    """
+    stats = {'files': 0, 'bytes': 0, 'skipped': 0, 'failed': 0, 'dirs': [], 'entries': {}}
+    start = time.monotonic()
+    os.makedirs(local_path, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        downloads = {}
+        for entry in walk(remote_url, pool, journal):
+            rel_path = relative_path(entry.href, remote_url)
+            local_item_path = os.path.join(local_path, *rel_path.split('/'))
+            if entry.is_dir:
+                stats['dirs'].append(rel_path)
+                os.makedirs(local_item_path, exist_ok=True)
+            elif journal is not None and journal.is_complete(rel_path, local_item_path, entry.etag):
+                size, etag = journal.completed[rel_path]
+                stats['entries'][rel_path] = entry._replace(size=size, etag=etag or entry.etag)
+                stats['skipped'] += 1
+            else:
+                stats['entries'][rel_path] = entry
+                downloads[pool.submit(download_file, entry.url, local_item_path)] = rel_path
+
+        for future in as_completed(downloads):
+            result = future.result()
+            if result is None:
+                stats['failed'] += 1
+                continue
+            written, etag = result
+            rel_path = downloads[future]
+            # The manifest describes what was actually downloaded, even if the
+            # file changed between listing and GET
+            stats['entries'][rel_path] = stats['entries'][rel_path]._replace(size=written, etag=etag or stats['entries'][rel_path].etag)
+            if journal is not None:
+                journal.record_file(rel_path, written, etag)
+            stats['files'] += 1
+            stats['bytes'] += written
+
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+def print_transfer_stats(stats):
+    seconds = max(stats['seconds'], 1e-6)
+    print(f"Downloaded {stats['files']} files ({stats['bytes'] / 1024 / 1024:.1f} MB) in {seconds:.1f}s: "
+          f"{stats['files'] / seconds:.1f} files/s, {stats['bytes'] / 1024 / 1024 / seconds:.2f} MB/s")
+    if stats.get('skipped'):
+        print(f"Skipped {stats['skipped']} files completed by the interrupted run")
+    if stats['failed']:
+        print(f"Warning: {stats['failed']} listings or downloads failed")
+
+# --- UPLOAD ---
+
+@traced('upload')
+def upload_zip(local_zip_path, remote_target_url, chunk_mb=NC_COLLECTIVES_UPLOAD_CHUNK_MB,
+               parallel=NC_COLLECTIVES_UPLOAD_PARALLEL, checksum=None):
+    """
+    Uploads the created ZIP file back to Nextcloud. Files larger than one chunk
+    go through chunked_upload so an interrupted transfer can be resumed.
+    With a checksum (TYPE:hex) the server stores it as the file's checksum.
+    Returns the ETag of the upload response.
+    """
+    if os.path.getsize(local_zip_path) > chunk_mb * 1024 * 1024:
+        return chunked_upload(local_zip_path, remote_target_url, chunk_mb * 1024 * 1024, parallel, checksum)
+
     print(f"Uploading {local_zip_path} to {remote_target_url}...")
     with open(local_zip_path, 'rb') as f:
-        response = requests.put(remote_target_url, data=f, auth=(ANCHOR_USER, ANCHOR_APP_PW))
+        response = http_client.put(remote_target_url, data=f, headers={'OC-Checksum': checksum} if checksum else None)
+    check_upload_response(response)
+    return _remote_etag(response)
+
+def _upload_journal_path(local_path):
+    return f"{local_path}.upload.json"
+
+def _write_journal(journal_path, journal):
+    """
+    Replaces the journal atomically so a crash never leaves it half written.
+    """
+    tmp_path = f"{journal_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(journal, f)
+    os.replace(tmp_path, journal_path)
+
+def _confirmed_chunks(upload_url, chunk_size, total_size):
+    """
+    Chunk numbers the server already holds completely, or None if the upload
+    collection no longer exists (Nextcloud expires them after a while).
+    """
+    result = list_directory(upload_url)
+    if result is None:
+        return None
+    confirmed = set()
+    for entry in result[1]:
+        if entry.name.isdigit():
+            number = int(entry.name)
+            expected = min(chunk_size, total_size - (number - 1) * chunk_size)
+            if entry.size == expected:
+                confirmed.add(number)
+    return confirmed
+
+@traced()
+def chunked_upload(local_path, remote_target_url, chunk_size, parallel=NC_COLLECTIVES_UPLOAD_PARALLEL, checksum=None):
+    """
+    Uploads local_path with Nextcloud's chunked upload v2: MKCOL an upload
+    collection, PUT numbered chunks (several in parallel) and MOVE the
+    assembled .file to the destination. A journal next to the file records the
+    upload id; a later run resumes by asking the server which chunks it already
+    has and only sends the missing ones. The checksum goes with the MOVE.
+    Returns the ETag of the assembled file.
+    """
+    total_size = os.path.getsize(local_path)
+    # Chunk numbers are limited to 1..10000
+    chunk_size = max(chunk_size, -(-total_size // 10000))
+    chunk_count = max(1, -(-total_size // chunk_size))
+    journal_path = _upload_journal_path(local_path)
+    headers = {'Destination': remote_target_url, 'OC-Total-Length': str(total_size)}
+
+    journal = None
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            journal = json.load(f)
+        if (journal['destination'], journal['size'], journal['chunk_size']) != (remote_target_url, total_size, chunk_size):
+            journal = None
+        else:
+            checksum = checksum or journal.get('checksum')
+
+    confirmed = set()
+    if journal is not None:
+        upload_url = f"{NEXTCLOUD_URL}{REMOTE_UPLOADS_FOLDER}{journal['upload_id']}"
+        confirmed = _confirmed_chunks(upload_url, chunk_size, total_size)
+        if confirmed is None:
+            print("Previous upload session expired, starting over")
+            journal = None
+        else:
+            print(f"Resuming upload {journal['upload_id']}: {len(confirmed)}/{chunk_count} chunks already on the server")
+
+    if journal is None:
+        journal = {'upload_id': f"collectives-backup-{TIMESTAMP}-{os.getpid()}", 'destination': remote_target_url,
+                   'size': total_size, 'chunk_size': chunk_size, 'checksum': checksum, 'done': []}
+        upload_url = f"{NEXTCLOUD_URL}{REMOTE_UPLOADS_FOLDER}{journal['upload_id']}"
+        response = http_client.request('MKCOL', upload_url, headers=headers)
+        if response.status_code != 201:
+            print(f"Error: Could not create upload session (status {response.status_code})")
+            sys.exit(1)
+        confirmed = set()
+    journal['done'] = sorted(confirmed)
+    _write_journal(journal_path, journal)
+
+    def put_chunk(number):
+        with open(local_path, 'rb') as f:
+            f.seek((number - 1) * chunk_size)
+            data = f.read(chunk_size)
+        response = http_client.put(f"{upload_url}/{number:05d}", data=data, headers=headers)
+        return response.status_code in [201, 204]
+
+    missing = [n for n in range(1, chunk_count + 1) if n not in confirmed]
+    print(f"Uploading {local_path} in {len(missing)} chunks of {chunk_size / 1024 / 1024:.0f} MB "
+          f"({parallel} in parallel) to {remote_target_url}...")
+    start = time.monotonic()
+    failed = []
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = {pool.submit(put_chunk, n): n for n in missing}
+        for future in as_completed(futures):
+            number = futures[future]
+            if future.result():
+                confirmed.add(number)
+                journal['done'] = sorted(confirmed)
+                _write_journal(journal_path, journal)
+            else:
+                failed.append(number)
+    if failed:
+        print(f"Error: {len(failed)} chunks failed, run again to resume the upload")
+        sys.exit(1)
+    seconds = max(time.monotonic() - start, 1e-6)
+    sent = sum(min(chunk_size, total_size - (n - 1) * chunk_size) for n in missing)
+    print(f"Chunks uploaded in {seconds:.1f}s ({sent / 1024 / 1024 / seconds:.2f} MB/s), assembling...")
+
+    # Assembling a large file can take longer than the default read timeout
+    if checksum:
+        headers['OC-Checksum'] = checksum
+    response = http_client.request('MOVE', f"{upload_url}/.file", headers=headers, timeout=None)
+    check_upload_response(response)
+    os.remove(journal_path)
+    return _remote_etag(response)
+
+@traced()
+def resume_pending_uploads():
+    """
+    Finishes archive uploads a previous run left behind (see chunked_upload),
+    including their manifests, before a new backup is started.
+    """
+    for journal_path in sorted(glob.glob("collectives_backup_*.upload.json")):
+        local_zip_path = journal_path[:-len('.upload.json')]
+        if not os.path.exists(local_zip_path):
+            os.remove(journal_path)
+            continue
+        with open(journal_path) as f:
+            journal = json.load(f)
+        print(f"Resuming interrupted upload of {local_zip_path}")
+        etag = chunked_upload(local_zip_path, journal['destination'], journal['chunk_size'])
+        etag = verify_upload(journal['destination'], os.path.getsize(local_zip_path), journal.get('checksum'), etag)
+        local_manifest = manifest_name(local_zip_path)
+        if os.path.exists(local_manifest):
+            with open(local_manifest) as f:
+                manifest = json.load(f)
+            manifest['archive_etag'] = etag
+            upload_manifest(manifest)
+            register_backup(manifest, os.path.getsize(local_zip_path))
+            os.remove(local_manifest)
+        os.remove(local_zip_path)
 
+def check_upload_response(response):
+    """
+    Exits the script unless the backup PUT was accepted.
+    """
     if response.status_code == 404:
         print(f"Error: Backup folder does not exist at {REMOTE_TARGET_FOLDER}")
         sys.exit(1)
@@ -89,64 +630,1797 @@ def upload_zip(local_zip_path, remote_target_url):
         print(f"Upload failed with status: {response.status_code}")
         sys.exit(1)
 
-def cleanup_old_backups():
+def stat_remote(remote_url):
     """
-    Remove old backups if count exceeds NC_COLLECTIVES_BACKUP_COUNT.
+    The Entry of a single remote item (PROPFIND Depth: 0), or None if it cannot be read.
     """
-    if not NC_COLLECTIVES_BACKUP_COUNT:
-        return
-    
-    max_backups = int(NC_COLLECTIVES_BACKUP_COUNT)
-    backup_folder_url = f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}"
-    
-    headers = {'Depth': '1'}
-    response = requests.request('PROPFIND', backup_folder_url, auth=(ANCHOR_USER, ANCHOR_APP_PW), headers=headers)
-    
+    response = http_client.request('PROPFIND', remote_url, data=PROPFIND_BODY,
+                                  headers={'Depth': '0', 'Content-Type': 'application/xml'})
     if response.status_code != 207:
+        return None
+    return next(iter_multistatus(io.BytesIO(response.content)), None)
+
+def check_remote_archive(entry, size, checksum=None):
+    """
+    Compares an uploaded archive's Entry with the expected size and checksum.
+    Returns a list of problems; a checksum the server does not report is not one.
+    """
+    problems = []
+    if size is not None and entry.size != size:
+        problems.append(f"size is {entry.size} bytes, expected {size}")
+    if checksum_matches(entry.checksum, checksum) is False:
+        problems.append(f"server checksum {entry.checksum} does not match {checksum}")
+    return problems
+
+class BackupError(Exception):
+    """
+    A streamed archive could not be written completely; raised by
+    stream_backup after the partial upload was removed.
+    """
+
+@traced()
+def verify_upload(remote_url, size, checksum=None, etag=None, exit_on_error=True):
+    """
+    Reads the properties of a freshly uploaded archive back (one PROPFIND):
+    its size must match what was sent, the checksum Nextcloud stored from
+    OC-Checksum must match ours, and its ETag must still be the one of the
+    upload response, otherwise something replaced it. Exits on a mismatch,
+    or raises BackupError without exit_on_error; returns the archive's ETag
+    for the manifest.
+    """
+    entry = stat_remote(remote_url)
+    problems = [f"{remote_url} cannot be found"] if entry is None else check_remote_archive(entry, size, checksum)
+    if entry is not None and etag and entry.etag != etag:
+        problems.append(f"ETag changed from {etag} to {entry.etag} after the upload")
+    if problems:
+        if not exit_on_error:
+            raise BackupError(f"Uploaded archive {'; '.join(problems)}")
+        for problem in problems:
+            print(f"Error: Uploaded archive {problem}")
+        sys.exit(1)
+    matched = "size and checksum" if checksum_matches(entry.checksum, checksum) else "size"
+    print(f"Upload verified: {matched} match")
+    return entry.etag
+
+class ChunkedPipe:
+    """
+    File-like object connecting the ZIP writer to a streaming PUT.
+    Writes are coalesced into CHUNK_SIZE blocks and handed over through a bounded
+    queue, so at most max_chunks blocks are held in memory at any time.
+    Everything written is hashed into digest.
+    """
+    def __init__(self, max_chunks=4):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self.bytes_written = 0
+        self.digest = new_checksum()
+        self.reader_done = threading.Event()
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        self.digest.update(data)
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(None)
+
+    def abort(self):
+        """
+        Makes the reading side fail instead of ending the stream, so an
+        incomplete archive is never sent as a finished upload.
+        """
+        try:
+            self._put(BrokenPipeError)
+        except BrokenPipeError:
+            pass
+
+    def _put(self, item):
+        while True:
+            if self.reader_done.is_set():
+                raise BrokenPipeError("Upload ended before the archive was complete")
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if chunk is BrokenPipeError:
+                raise BrokenPipeError("The archive was aborted while it was written")
+            yield chunk
+
+@traced()
+def stream_backup(dirs, files, remote_target_url, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Streams the listed files (as returned by list_tree) straight into a ZIP64
+    archive that is uploaded with a chunked PUT while it is being written.
+    Nothing touches the local disk and each file is only ever held in memory one
+    chunk at a time. Up to max_workers GETs are opened ahead of the writer to hide latency.
+    Files and the archive are checksummed on the way through. The archive is
+    uploaded as <name>.partial and only moved to its name once every file made
+    it in and verify_upload passed; otherwise the partial upload is deleted
+    and BackupError raised.
+    """
+    pipe = ChunkedPipe()
+    upload_result = {}
+    partial_url = remote_target_url + PARTIAL_SUFFIX
+
+    def upload():
+        try:
+            upload_result['response'] = http_client.put(partial_url, data=iter(pipe))
+        except Exception as e:
+            upload_result['error'] = e
+        finally:
+            pipe.reader_done.set()
+
+    def open_remote(url):
+        return http_client.get(url, stream=True)
+
+    def close_response(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def discard_partial():
+        response = http_client.delete(partial_url)
+        if response.status_code not in [200, 204, 404]:
+            print(f"Warning: Could not delete the incomplete archive {partial_url} (status {response.status_code})")
+
+    print(f"Streaming archive to {remote_target_url}...")
+    stats = {'files': 0, 'bytes': 0, 'failed': 0, 'checksums': {}}
+    start = time.monotonic()
+    uploader = threading.Thread(target=upload, daemon=True)
+    uploader.start()
+    try:
+        with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for rel_dir in dirs:
+                zf.writestr(zipfile.ZipInfo(rel_dir + '/'), b'')
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                window = []
+                next_index = 0
+                try:
+                    for rel_path, entry in files:
+                        while next_index < len(files) and len(window) < max_workers:
+                            window.append(pool.submit(open_remote, files[next_index][1].url))
+                            next_index += 1
+                        with window.pop(0).result() as file_resp:
+                            if file_resp.status_code != 200:
+                                print(f"Error: Download of {entry.url} failed with status {file_resp.status_code}")
+                                stats['failed'] += 1
+                                continue
+                            info = zipfile.ZipInfo(rel_path,
+                                                   date_time=_zip_timestamp(file_resp.headers.get('Last-Modified')))
+                            info.compress_type = zipfile.ZIP_DEFLATED
+                            digest = new_checksum()
+                            with zf.open(info, 'w', force_zip64=True) as dest:
+                                for chunk in file_resp.iter_content(CHUNK_SIZE):
+                                    dest.write(chunk)
+                                    digest.update(chunk)
+                                    stats['bytes'] += len(chunk)
+                        stats['checksums'][rel_path] = format_checksum(digest)
+                        stats['files'] += 1
+                finally:
+                    # Downloads opened ahead of a failure still hold a connection
+                    for future in window:
+                        future.add_done_callback(close_response)
+        pipe.close()
+    except BrokenPipeError:
+        pass
+    except BaseException as e:
+        pipe.abort()
+        uploader.join()
+        discard_partial()
+        # Network and file errors of a download end this archive, not the caller
+        if isinstance(e, OSError):
+            raise BackupError(f"Archive aborted: {e}") from e
+        raise
+    uploader.join()
+    stats['seconds'] = time.monotonic() - start
+
+    if 'error' in upload_result:
+        discard_partial()
+        raise BackupError(f"Upload failed: {upload_result['error']}")
+    print_transfer_stats(stats)
+    print(f"Archive size: {pipe.bytes_written / 1024 / 1024:.1f} MB")
+    stats['archive_bytes'] = pipe.bytes_written
+    try:
+        response = upload_result['response']
+        if response.status_code not in [201, 204]:
+            raise BackupError(f"Upload failed with status: {response.status_code}")
+        print("Upload successful!")
+        if stats['failed']:
+            raise BackupError(f"{stats['failed']} files could not be downloaded, the backup is incomplete")
+        # The checksum is only known at the end of the stream, too late for OC-Checksum
+        stats['archive_checksum'] = format_checksum(pipe.digest)
+        verify_upload(partial_url, pipe.bytes_written, etag=_remote_etag(response), exit_on_error=False)
+    except BackupError:
+        discard_partial()
+        raise
+    response = http_client.request('MOVE', partial_url, headers={'Destination': remote_target_url, 'Overwrite': 'T'})
+    if response.status_code not in [201, 204]:
+        discard_partial()
+        raise BackupError(f"Could not move {partial_url} to {remote_target_url} (status {response.status_code})")
+    # The rename may give the archive a new ETag, which --verify compares against
+    entry = stat_remote(remote_target_url)
+    stats['archive_etag'] = entry.etag if entry else _remote_etag(response)
+    return stats
+
+def _zip_timestamp(http_date):
+    """
+    Converts a Last-Modified header into a ZIP date_time tuple (local time).
+    """
+    try:
+        modified = parsedate_to_datetime(http_date).astimezone()
+    except (TypeError, ValueError):
+        modified = datetime.now()
+    return modified.timetuple()[:6] if modified.year >= 1980 else (1980, 1, 1, 0, 0, 0)
+
+def manifest_name(archive_name):
+    """
+    collectives_backup_<ts>[.delta].zip -> collectives_backup_<ts>[.delta].manifest.json
+    (likewise for the other ARCHIVE_FORMATS)
+    """
+    for suffix in ARCHIVE_FORMATS.values():
+        if archive_name.endswith(suffix):
+            return archive_name[:-len(suffix)] + '.manifest.json'
+    return archive_name + '.manifest.json'
+
+def build_manifest(archive_name, dirs, entries, chain, changed=None, deleted=(), checksums=None, archive=None):
+    """
+    Describes the full state of the collectives tree at backup time.
+    'files' always lists every file (not just the archived ones), so the next
+    incremental run can diff against it; 'changed' and 'deleted' describe the
+    delta this archive holds relative to the previous link of its chain.
+    checksums holds the content checksum (TYPE:hex) of each file computed
+    while archiving; archive the archive_bytes, archive_checksum and
+    archive_etag of the archive itself (as returned by stream_backup), which
+    --verify checks the uploaded archive against.
+    """
+    checksums = checksums or {}
+    files = {
+        rel_path: {'etag': entry.etag, 'size': entry.size, 'mtime': entry.mtime, 'checksum': checksums.get(rel_path)}
+        for rel_path, entry in sorted(entries.items())
+    }
+    manifest = {
+        'version': 1,
+        'archive': archive_name,
+        'type': 'delta' if len(chain) > 1 else 'full',
+        'created': TIMESTAMP,
+        'chain': chain,
+        'dirs': sorted(dirs),
+        'files': files,
+        'changed': sorted(files) if changed is None else sorted(changed),
+        'deleted': sorted(deleted),
+    }
+    if archive:
+        manifest.update(archive_size=archive['archive_bytes'], archive_checksum=archive.get('archive_checksum'),
+                        archive_etag=archive.get('archive_etag'))
+    return manifest
+
+@traced()
+def upload_manifest(manifest):
+    name = manifest_name(manifest['archive'])
+    response = http_client.put(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}",
+                              data=json.dumps(manifest, indent=1).encode('utf-8'),
+                              headers={'Content-Type': 'application/json'})
+    if response.status_code not in [201, 204]:
+        print(f"Error: Manifest upload failed with status: {response.status_code}")
+        sys.exit(1)
+    print(f"Manifest {name} uploaded ({len(manifest['files'])} files)")
+
+def load_manifest(name):
+    response = http_client.get(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}")
+    if response.status_code != 200:
+        print(f"Error: Could not load manifest {name} (status {response.status_code})")
+        return None
+    return response.json()
+
+def list_backup_folder():
+    """
+    Returns the file entries of the backup folder, or None if it cannot be listed.
+    """
+    result = list_directory(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}")
+    if result is None:
+        return None
+    return result[1]
+
+def latest_manifest():
+    """
+    Manifest of the newest ZIP backup according to the catalog. Delta chains
+    are rebuilt with zipfile, so other archive formats never start a chain.
+    """
+    catalog = get_catalog()
+    archives = [b for b in catalog.backups(kinds=('full', 'delta')) if b['name'].endswith('.zip')]
+    if not archives:
+        return None
+    name = archives[-1]['name']
+    return catalog.manifest(name) or load_manifest(manifest_name(name))
+
+def file_changed(previous, entry):
+    """
+    ETags change with the content; size and mtime are the fallback when the server sends none.
+    """
+    if previous['etag'] and entry.etag:
+        return previous['etag'] != entry.etag
+    return (previous['size'], previous['mtime']) != (entry.size, entry.mtime)
+
+@traced()
+def incremental_backup(max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Archives only files that are new or changed since the newest manifest.
+    Deleted files are recorded as tombstones in the delta manifest. Without a
+    previous manifest, or once the chain holds NC_COLLECTIVES_MAX_DELTAS deltas,
+    a new full backup is written instead. Returns False if nothing changed.
+    """
+    previous = latest_manifest()
+
+    print("Listing remote files...")
+    dirs, files = list_tree(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}", max_workers)
+    entries = dict(files)
+    print(f"Found {len(files)} files in {len(dirs)} folders")
+
+    if previous is None or len(previous['chain']) > NC_COLLECTIVES_MAX_DELTAS:
+        print("Writing a full backup to start a new chain")
+        archive_name = ZIP_FILENAME
+        chain = [archive_name]
+        changed, deleted = None, []
+        to_archive = files
+    else:
+        archive_name = DELTA_FILENAME
+        chain = previous['chain'] + [archive_name]
+        old_files = previous['files']
+        changed = [rel for rel, entry in files if rel not in old_files or file_changed(old_files[rel], entry)]
+        deleted = [rel for rel in old_files if rel not in entries]
+        print(f"Changes since {previous['archive']}: {len(changed)} new or modified, {len(deleted)} deleted")
+        if not changed and not deleted and set(dirs) == set(previous['dirs']):
+            print("Nothing changed, no backup written.")
+            return False
+        changed_set = set(changed)
+        to_archive = [(rel, entry) for rel, entry in files if rel in changed_set]
+
+    stats = stream_backup(dirs, to_archive, f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{archive_name}", max_workers)
+    # Unchanged files keep the checksum recorded when they were archived
+    checksums = {} if changed is None else {rel: info.get('checksum') for rel, info in previous['files'].items()}
+    checksums.update(stats['checksums'])
+    manifest = build_manifest(archive_name, dirs, entries, chain, changed, deleted, checksums, stats)
+    upload_manifest(manifest)
+    register_backup(manifest, stats['archive_bytes'])
+    return True
+
+def download_to_file(remote_url, local_file):
+    with http_client.get(remote_url, stream=True) as response:
+        if response.status_code != 200:
+            print(f"Error: Download of {remote_url} failed with status {response.status_code}")
+            sys.exit(1)
+        for chunk in response.iter_content(CHUNK_SIZE):
+            local_file.write(chunk)
+
+@traced()
+def rebuild_restore_point(archive_name, output_path):
+    """
+    Rebuilds a full archive for the state recorded by archive_name by walking
+    its chain from the base backup forward: each file is taken from the newest
+    archive in the chain that contains it, and files missing from the target
+    manifest (tombstoned along the way) are left out.
+    """
+    if not archive_name.endswith('.zip'):
+        print(f"Error: {archive_name} is not a ZIP backup; only ZIP chains need rebuilding")
+        return False
+    manifest = load_manifest(manifest_name(archive_name))
+    if manifest is None:
+        sys.exit(1)
+    print(f"Rebuilding {archive_name} from {len(manifest['chain'])} archive(s)...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archives = []
+        for name in manifest['chain']:
+            local = os.path.join(tmp_dir, os.path.basename(name))
+            with open(local, 'wb') as f:
+                download_to_file(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}", f)
+            archives.append(zipfile.ZipFile(local))
+
+        missing = 0
+        with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as out:
+            for rel_dir in manifest['dirs']:
+                out.writestr(zipfile.ZipInfo(rel_dir + '/'), b'')
+            for rel_path in manifest['files']:
+                source = next((zf for zf in reversed(archives) if rel_path in zf.NameToInfo), None)
+                if source is None:
+                    print(f"Warning: {rel_path} is not contained in any archive of the chain")
+                    missing += 1
+                    continue
+                info = source.getinfo(rel_path)
+                with source.open(info) as src, out.open(info, 'w', force_zip64=True) as dst:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        for zf in archives:
+            zf.close()
+
+    print(f"Restore point written to {output_path} ({len(manifest['files']) - missing} files)")
+    return missing == 0
+
+# --- PER-COLLECTIVE BACKUPS ---
+
+def collective_slug(name):
+    """
+    File system safe folder name for a collective's archives.
+    """
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'collective'
+
+def list_collectives():
+    """
+    Top-level folders of NC_COLLECTIVES_FOLDER, one per collective. Their ETag
+    changes whenever anything below them changes.
+    """
+    result = list_directory(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}")
+    if result is None:
+        return None
+    return sorted(result[0], key=lambda e: e.name)
+
+def backup_collective(entry, max_workers):
+    """
+    Streams one collective into its own archive and uploads its manifest.
+    Runs on a worker thread, so the catalog is updated by the caller.
+    """
+    archive_name = f"{PER_COLLECTIVE_FOLDER}{collective_slug(entry.name)}/collective_{TIMESTAMP}.zip"
+    with tracer.span('backup_collective', collective=entry.name):
+        dirs, files = list_tree(entry.url, max_workers)
+        stats = stream_backup(dirs, files, f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{archive_name}", max_workers)
+        manifest = build_manifest(archive_name, dirs, dict(files), [archive_name], checksums=stats['checksums'],
+                                  archive=stats)
+        manifest.update(type='collective', collective=entry.name, etag=entry.etag)
+        upload_manifest(manifest)
+    return manifest, stats['archive_bytes']
+
+@traced()
+def per_collective_backup(parallel=NC_COLLECTIVES_PARALLEL, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Backs up every collective as an independent archive, up to `parallel` at
+    a time, splitting max_workers between them. Collectives whose folder ETag
+    matches their newest catalogued backup are skipped, and a failing
+    collective does not stop the others. Returns the names that failed.
+    """
+    catalog = get_catalog()
+    collectives = list_collectives()
+    if collectives is None:
+        sys.exit(1)
+
+    newest = {}
+    for backup in catalog.backups(kinds=('collective',)):
+        newest[os.path.dirname(backup['name'])] = backup['name']
+    pending = []
+    for entry in collectives:
+        folder = f"{PER_COLLECTIVE_FOLDER}{collective_slug(entry.name)}"
+        previous = catalog.manifest(newest[folder]) if folder in newest else None
+        if previous and entry.etag and previous.get('etag') == entry.etag:
+            print(f"Collective {entry.name} unchanged since {previous['created']}, skipped")
+            continue
+        pending.append(entry)
+    print(f"Backing up {len(pending)} of {len(collectives)} collectives")
+    if not pending:
+        return []
+
+    ensure_collection(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{PER_COLLECTIVE_FOLDER}")
+    for entry in pending:
+        ensure_collection(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{PER_COLLECTIVE_FOLDER}{collective_slug(entry.name)}/")
+
+    failed = []
+    parallel = max(min(parallel, len(pending)), 1)
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = {pool.submit(backup_collective, entry, max(max_workers // parallel, 1)): entry.name
+                   for entry in pending}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                manifest, size = future.result()
+            except (SystemExit, Exception) as e:
+                print(f"Error: Backup of collective {name} failed" + ("" if isinstance(e, SystemExit) else f": {e}"))
+                failed.append(name)
+                continue
+            register_backup(manifest, size)
+            print(f"Collective {name} backed up ({len(manifest['files'])} files)")
+    return failed
+
+def list_collective_archives():
+    """
+    Archive entries below PER_COLLECTIVE_FOLDER as (name relative to the backup folder, Entry).
+    """
+    archives = []
+    folders, _ = propfind(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{PER_COLLECTIVE_FOLDER}", '1')
+    for folder in [e for e in folders or [] if e.is_dir]:
+        entries, _ = propfind(folder.url, '1')
+        for entry in entries or []:
+            if entry.name.startswith('collective_') and entry.name.endswith('.zip'):
+                archives.append((f"{PER_COLLECTIVE_FOLDER}{folder.name}/{entry.name}", entry))
+    return archives
+
+# --- DEDUPLICATED STORE ---
+
+def _store_url(path=''):
+    return f"{NEXTCLOUD_URL}{REMOTE_STORE_FOLDER}{path}"
+
+def _object_path(digest):
+    return f"objects/{digest[:2]}/{digest}"
+
+def ensure_collection(url):
+    """
+    MKCOL that treats an existing collection (405) as success.
+    """
+    response = http_client.request('MKCOL', url)
+    return response.status_code in [201, 405]
+
+def list_snapshots():
+    """
+    Snapshot index names in the store, oldest first (names embed the timestamp).
+    """
+    entries, _ = propfind(_store_url('snapshots/'), '1')
+    if entries is None:
+        return []
+    return sorted(e.name for e in entries if e.name.startswith('snapshot_') and e.name.endswith('.json'))
+
+def load_snapshot(name):
+    response = http_client.get(_store_url(f"snapshots/{name}"))
+    if response.status_code != 200:
+        print(f"Error: Could not load snapshot {name} (status {response.status_code})")
+        return None
+    return response.json()
+
+def list_store_objects(pool):
+    """
+    Returns (object digests, existing two-character prefix folders) of the store.
+    """
+    objects, prefixes = set(), set()
+    for entry in walk(_store_url('objects/'), pool):
+        if entry.is_dir:
+            prefixes.add(entry.name)
+        else:
+            objects.add(entry.name)
+    return objects, prefixes
+
+@traced()
+def dedup_backup(max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Backs up the collectives into the content-addressed store: every distinct
+    file content is stored once as objects/<sha256[:2]>/<sha256>, and the backup
+    itself is a small snapshot index mapping paths to digests. Files whose ETag
+    matches the previous snapshot reuse its digest without being downloaded;
+    changed files are hashed while streaming into a spooled buffer and only
+    uploaded if the store does not hold that content yet. The first thread to
+    need a new prefix folder or object creates it; the others wait for its
+    Future, so no object is PUT before its folder exists or reported as stored
+    before its upload succeeded.
+    """
+    for folder in ['', 'objects/', 'snapshots/']:
+        if not ensure_collection(_store_url(folder)):
+            print(f"Error: Could not create store folder {REMOTE_STORE_FOLDER}{folder}")
+            sys.exit(1)
+
+    catalog = get_catalog()
+    snapshots = catalog.backups(kinds=('snapshot',))
+    previous = None
+    if snapshots:
+        name = snapshots[-1]['name']
+        previous = catalog.manifest(name) or load_snapshot(name)
+    previous_files = previous['files'] if previous else {}
+
+    stats = {'files': 0, 'reused': 0, 'downloaded': 0, 'uploaded': 0, 'bytes': 0, 'failed': 0}
+    start = time.monotonic()
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        print("Listing store objects and remote files...")
+        objects, prefixes = list_store_objects(pool)
+        # Prefix folders and objects created during this run -> Future of whether that worked
+        new_folders, new_objects = {}, {}
+        dirs, files = list_tree(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}", max_workers)
+        print(f"Found {len(files)} files in {len(dirs)} folders, {len(objects)} objects in store")
+
+        def store_file(entry):
+            with tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE) as buffer:
+                digest = hashlib.sha256()
+                with http_client.get(entry.url, stream=True) as response:
+                    if response.status_code != 200:
+                        print(f"Error: Download of {entry.url} failed with status {response.status_code}")
+                        return None
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        buffer.write(chunk)
+                digest = digest.hexdigest()
+                prefix = digest[:2]
+                with lock:
+                    stats['downloaded'] += 1
+                    if digest in objects:
+                        return digest
+                    # Claim the digest so identical files in flight are uploaded once
+                    stored = new_objects.get(digest)
+                    if stored is not None:
+                        claimed = False
+                    else:
+                        stored = new_objects[digest] = Future()
+                        claimed = True
+                    folder = new_folders.get(prefix)
+                    create_folder = prefix not in prefixes and folder is None
+                    if create_folder:
+                        folder = new_folders[prefix] = Future()
+                if not claimed:
+                    return digest if stored.result() else None
+                try:
+                    if create_folder:
+                        folder.set_result(ensure_collection(_store_url(f"objects/{prefix}/")))
+                    if folder is not None and not folder.result():
+                        print(f"Error: Could not create store folder objects/{prefix}/")
+                        return None
+                    size = buffer.tell()
+                    buffer.seek(0)
+                    response = http_client.put(_store_url(_object_path(digest)), data=buffer)
+                    if response.status_code not in [201, 204]:
+                        print(f"Error: Upload of object {digest} failed with status {response.status_code}")
+                        return None
+                    with lock:
+                        objects.add(digest)
+                        stats['uploaded'] += 1
+                        stats['bytes'] += size
+                    return digest
+                finally:
+                    if create_folder and not folder.done():
+                        folder.set_result(False)
+                    stored.set_result(digest in objects)
+
+        snapshot_files = {}
+        futures = {}
+        for rel_path, entry in files:
+            old = previous_files.get(rel_path)
+            if old and entry.etag and old['etag'] == entry.etag and old['hash'] in objects:
+                snapshot_files[rel_path] = old
+                stats['reused'] += 1
+            else:
+                futures[pool.submit(store_file, entry)] = (rel_path, entry)
+        for future in as_completed(futures):
+            rel_path, entry = futures[future]
+            digest = future.result()
+            if digest is None:
+                stats['failed'] += 1
+                continue
+            snapshot_files[rel_path] = {'hash': digest, 'etag': entry.etag, 'size': entry.size, 'mtime': entry.mtime}
+    stats['files'] = len(snapshot_files)
+
+    if stats['failed']:
+        print(f"Error: {stats['failed']} files could not be stored, no snapshot written")
+        sys.exit(1)
+
+    # The index is written last, so a snapshot never references a missing object
+    snapshot = {'version': 1, 'created': TIMESTAMP, 'dirs': dirs, 'files': dict(sorted(snapshot_files.items()))}
+    response = http_client.put(_store_url(f"snapshots/{SNAPSHOT_FILENAME}"),
+                              data=json.dumps(snapshot, indent=1).encode('utf-8'),
+                              headers={'Content-Type': 'application/json'})
+    check_upload_response(response)
+    catalog.add(SNAPSHOT_FILENAME, 'snapshot', BACKUP_TIME, size=stats['bytes'], files=stats['files'], manifest=snapshot)
+    save_catalog()
+    seconds = time.monotonic() - start
+    print(f"Snapshot {SNAPSHOT_FILENAME}: {stats['files']} files, {stats['reused']} unchanged, "
+          f"{stats['downloaded']} downloaded, {stats['uploaded']} new objects "
+          f"({stats['bytes'] / 1024 / 1024:.1f} MB uploaded) in {seconds:.1f}s")
+    return stats
+
+@traced()
+def collect_garbage(policy, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Retention for the store: deletes the snapshots the retention policy does
+    not keep, then every object no remaining snapshot references. Snapshots go
+    first so an interrupted run can only leave unreferenced objects behind,
+    never dangling references.
+    """
+    catalog = get_catalog()
+    snapshots = catalog.backups(kinds=('snapshot',))
+    kept = select_retained(snapshots, policy)
+    expired = [b['name'] for b in snapshots if b['name'] not in kept]
+    if not expired:
+        return
+
+    referenced = set()
+    for name in kept:
+        snapshot = catalog.manifest(name) or load_snapshot(name)
+        if snapshot is None:
+            print("Error: Could not load all kept snapshots, skipping garbage collection")
+            return
+        referenced.update(f['hash'] for f in snapshot['files'].values())
+
+    for name in expired:
+        print(f"Deleting old snapshot: {name}")
+    if delete_remote([_store_url(f"snapshots/{name}") for name in expired], max_workers) != len(expired):
+        print("Error: Could not delete all expired snapshots, keeping their objects")
         return
-    
-    # Extract backup files
-    items = response.text.split('<d:response')[1:]
-    backups = []
-    
-    for item in items:
-        href = item.split('<d:href>')[1].split('</d:href>')[0]
-        if 'collectives_backup_' in href and href.endswith('.zip'):
-            # Extract last modified time
-            if '<d:getlastmodified>' in item:
-                modified = item.split('<d:getlastmodified>')[1].split('</d:getlastmodified>')[0]
-                backups.append((href, modified))
-    
-    # Sort by date (oldest first)
-    backups.sort(key=lambda x: x[1])
-    
-    # Delete oldest backups if exceeding limit
-    if len(backups) > max_backups:
-        to_delete = backups[:len(backups) - max_backups]
-        for href, _ in to_delete:
-            delete_url = f"{NEXTCLOUD_URL}{href}"
-            print(f"Deleting old backup: {href}")
-            requests.delete(delete_url, auth=(ANCHOR_USER, ANCHOR_APP_PW))
+    catalog.remove(expired)
+    save_catalog()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        objects, _ = list_store_objects(pool)
+    garbage = sorted(objects - referenced)
+    deleted = delete_remote([_store_url(_object_path(d)) for d in garbage], max_workers)
+    print(f"Garbage collection: {len(expired)} snapshots and {deleted} unreferenced objects deleted, "
+          f"{len(referenced)} objects still referenced")
+
+@traced()
+def rebuild_snapshot(snapshot_name, output_path):
+    """
+    Writes the state recorded by a store snapshot into a local ZIP archive.
+    """
+    snapshot = load_snapshot(snapshot_name)
+    if snapshot is None:
+        sys.exit(1)
+    print(f"Rebuilding {snapshot_name} ({len(snapshot['files'])} files)...")
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as out:
+        for rel_dir in snapshot['dirs']:
+            out.writestr(zipfile.ZipInfo(rel_dir + '/'), b'')
+        for rel_path, info in snapshot['files'].items():
+            with http_client.get(_store_url(_object_path(info['hash'])), stream=True) as response:
+                if response.status_code != 200:
+                    print(f"Error: Object {info['hash']} for {rel_path} is missing (status {response.status_code})")
+                    return False
+                zip_info = zipfile.ZipInfo(rel_path, date_time=_zip_timestamp(info['mtime']))
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+                with out.open(zip_info, 'w', force_zip64=True) as dst:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        dst.write(chunk)
+    print(f"Restore point written to {output_path}")
+    return True
+
+# --- CATALOG & RETENTION ---
+
+_catalog = None
+
+def _catalog_url():
+    return f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{CATALOG_FILENAME}"
+
+def _remote_etag(response):
+    return response.headers.get('ETag', '').strip('"') or None
+
+def get_catalog():
+    """
+    Opens the backup catalog. The local copy is used as long as its recorded
+    ETag matches the remote one (a single HEAD); otherwise the remote catalog
+    is downloaded. Without any catalog, the backup folder is imported once.
+    """
+    global _catalog
+    if _catalog is not None:
+        return _catalog
+
+    head = http_client.head(_catalog_url())
+    remote_etag = _remote_etag(head) if head.status_code == 200 else None
+    catalog = BackupCatalog(LOCAL_CATALOG)
+    if remote_etag and catalog.get_meta('remote_etag') != remote_etag:
+        catalog.close()
+        print("Downloading backup catalog...")
+        with open(f"{LOCAL_CATALOG}.tmp", 'wb') as f:
+            download_to_file(_catalog_url(), f)
+        os.replace(f"{LOCAL_CATALOG}.tmp", LOCAL_CATALOG)
+        catalog = BackupCatalog(LOCAL_CATALOG)
+        catalog.set_meta('remote_etag', remote_etag)
+    _catalog = catalog
+    if remote_etag is None and not catalog.get_meta('imported'):
+        import_backup_folder()
+    return catalog
+
+@traced()
+def save_catalog():
+    """
+    Uploads the catalog and remembers the ETag the server assigned to it.
+    """
+    catalog = get_catalog()
+    with open(LOCAL_CATALOG, 'rb') as f:
+        response = http_client.put(_catalog_url(), data=f)
+    if response.status_code not in [201, 204]:
+        print(f"Warning: Catalog upload failed with status {response.status_code}")
+        return
+    remote_etag = _remote_etag(response) or _remote_etag(http_client.head(_catalog_url()))
+    catalog.set_meta('remote_etag', remote_etag)
+
+def _created_from_name(name, mtime):
+    """
+    Backup time from the timestamp embedded in the name (local time), falling
+    back to the parsed RFC 1123 getlastmodified date.
+    """
+    match = re.search(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}', name)
+    if match:
+        return datetime.strptime(match.group(0), "%Y-%m-%d_%H-%M-%S").astimezone()
+    return parsedate_to_datetime(mtime)
+
+@traced()
+def import_backup_folder(max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Fills the catalog from the backup folder and the store (one-time PROPFIND
+    scan plus a parallel fetch of the manifests) and uploads it.
+    """
+    print("Importing existing backups into the catalog...")
+    catalog = get_catalog()
+    entries = list_backup_folder() or []
+    archives = [e for e in entries if e.name.startswith('collectives_backup_')
+                and e.name.endswith(tuple(ARCHIVE_FORMATS.values()))]
+    collective_archives = list_collective_archives()
+    snapshots = list_snapshots()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        manifests = list(pool.map(lambda e: load_manifest(manifest_name(e.name)), archives))
+        collective_manifests = list(pool.map(lambda a: load_manifest(manifest_name(a[0])), collective_archives))
+        snapshot_indexes = list(pool.map(load_snapshot, snapshots))
+    for entry, manifest in zip(archives, manifests):
+        kind = 'delta' if entry.name.endswith('.delta.zip') else 'full'
+        catalog.add(entry.name, kind, _created_from_name(entry.name, entry.mtime), size=entry.size,
+                    files=len(manifest['files']) if manifest else None,
+                    chain=manifest['chain'] if manifest else None, manifest=manifest)
+    for (name, entry), manifest in zip(collective_archives, collective_manifests):
+        catalog.add(name, 'collective', _created_from_name(name, entry.mtime), size=entry.size,
+                    files=len(manifest['files']) if manifest else None, manifest=manifest)
+    for name, snapshot in zip(snapshots, snapshot_indexes):
+        catalog.add(name, 'snapshot', _created_from_name(name, None),
+                    files=len(snapshot['files']) if snapshot else None, manifest=snapshot)
+    catalog.set_meta('imported', BACKUP_TIME.isoformat())
+    save_catalog()
+    print(f"Catalog holds {len(archives)} archives, {len(collective_archives)} collective archives "
+          f"and {len(snapshots)} snapshots")
+
+def register_backup(manifest, size):
+    """
+    Records a freshly uploaded ZIP backup in the catalog and syncs it.
+    """
+    get_catalog().add(manifest['archive'], manifest['type'], _created_from_name(manifest['archive'], None),
+                      size=size, files=len(manifest['files']), chain=manifest['chain'], manifest=manifest)
+    save_catalog()
+
+@traced()
+def delete_remote(urls, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Deletes the given URLs concurrently; returns how many are gone afterwards.
+    """
+    def delete(url):
+        return http_client.delete(url).status_code in [200, 204, 404]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return sum(pool.map(delete, urls))
+
+def print_catalog():
+    for backup in get_catalog().backups():
+        size = f"{backup['size'] / 1024 / 1024:9.1f} MB" if backup['size'] is not None else "        ? MB"
+        print(f"{backup['created'].astimezone():%Y-%m-%d %H:%M}  {backup['kind']:10}  {size}  "
+              f"{backup['files'] or '?':>6} files  {backup['name']}")
+
+@traced('cleanup')
+def cleanup_old_backups(policy=None, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Remove archive backups (and their manifests) the retention policy does not keep.
+    The policy applies to the backup folder's archives and to each collective's
+    archives separately. The decision uses the parsed timestamps in the
+    catalog; deletes run as a concurrent batch.
+    """
+    if policy is None:
+        return
+
+    catalog = get_catalog()
+    archives = catalog.backups(kinds=('full', 'delta', 'collective'))
+    groups = {}
+    for backup in archives:
+        groups.setdefault(os.path.dirname(backup['name']), []).append(backup)
+    kept = set()
+    for group in groups.values():
+        kept |= select_retained(group, policy)
+    expired = [b['name'] for b in archives if b['name'] not in kept]
+    if not expired:
+        return
+
+    for name in expired:
+        print(f"Deleting old backup: {name}")
+    urls = [f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}" for name in expired]
+    urls += [f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{manifest_name(name)}" for name in expired]
+    deleted = delete_remote(urls, max_workers)
+    if deleted != len(urls):
+        print(f"Warning: {len(urls) - deleted} deletes failed, they will be retried on the next run")
+        return
+    catalog.remove(expired)
+    save_catalog()
+
+# --- VERIFICATION ---
+
+# Read from the end of a ZIP to find its end of central directory record (22 bytes plus the longest comment)
+ZIP_TAIL_SIZE = 22 + 0xFFFF
+ZIP_END = struct.Struct('<4sHHHHLLH')
+ZIP64_END = struct.Struct('<4sQHHLLQQQQ')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+ZIP_CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+ZIP64_LIMIT = 0xFFFFFFFF
+# Consecutive entries are read back with one Range request of about this size
+VERIFY_SPAN_BYTES = 16 * CHUNK_SIZE
+
+ZipMember = namedtuple('ZipMember', ['name', 'method', 'crc', 'compressed_size', 'size', 'offset'])
+
+def fetch_range(remote_url, start, end):
+    """
+    Bytes start..end (inclusive) of a remote file.
+    """
+    response = http_client.get(remote_url, headers={'Range': f"bytes={start}-{end}"})
+    if response.status_code != 206:
+        raise RuntimeError(f"Range request for {remote_url} failed with status {response.status_code}")
+    return response.content
+
+def _zip64_values(extra, size, compressed_size, offset):
+    """
+    Replaces the 0xFFFFFFFF fields of a central directory entry with the values of its ZIP64 extra field.
+    """
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, position)
+        if tag == 1:
+            values = list(struct.unpack_from(f'<{length // 8}Q', extra, position + 4))
+            fields = [size, compressed_size, offset]
+            for i, value in enumerate(fields):
+                if value == ZIP64_LIMIT and values:
+                    fields[i] = values.pop(0)
+            return fields
+        position += 4 + length
+    return size, compressed_size, offset
+
+@traced()
+def read_central_directory(remote_url, size):
+    """
+    Reads the central directory of a remote ZIP with one or two Range
+    requests. Returns (members sorted by offset, offset of the central
+    directory); raises ValueError for archives that are not valid ZIPs.
+    """
+    tail_start = max(size - ZIP_TAIL_SIZE, 0)
+    tail = fetch_range(remote_url, tail_start, size - 1)
+    end = tail.rfind(b'PK\x05\x06')
+    if end < 0 or len(tail) - end < ZIP_END.size:
+        raise ValueError("end of central directory record not found")
+    _, _, _, _, count, cd_size, cd_offset, _ = ZIP_END.unpack_from(tail, end)
+    if count == 0xFFFF or ZIP64_LIMIT in (cd_size, cd_offset):
+        locator = end - ZIP64_LOCATOR.size
+        if locator < 0 or tail[locator:locator + 4] != b'PK\x06\x07':
+            raise ValueError("ZIP64 end of central directory locator not found")
+        record_offset = ZIP64_LOCATOR.unpack_from(tail, locator)[2]
+        if record_offset >= tail_start:
+            record = tail[record_offset - tail_start:record_offset - tail_start + ZIP64_END.size]
+        else:
+            record = fetch_range(remote_url, record_offset, record_offset + ZIP64_END.size - 1)
+        if len(record) < ZIP64_END.size or record[:4] != b'PK\x06\x06':
+            raise ValueError("ZIP64 end of central directory record not found")
+        count, cd_size, cd_offset = ZIP64_END.unpack(record)[7:]
+    if cd_offset + cd_size > size:
+        raise ValueError("central directory lies beyond the end of the archive")
+    if cd_size == 0:
+        directory = b''
+    elif cd_offset >= tail_start:
+        directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+    else:
+        directory = fetch_range(remote_url, cd_offset, cd_offset + cd_size - 1)
+
+    members = []
+    position = 0
+    for _ in range(count):
+        if position + ZIP_CENTRAL_HEADER.size > len(directory):
+            raise ValueError("central directory is truncated")
+        (signature, _, _, flags, method, _, _, crc, compressed_size, file_size,
+         name_length, extra_length, comment_length, _, _, _, offset) = ZIP_CENTRAL_HEADER.unpack_from(directory, position)
+        if signature != b'PK\x01\x02':
+            raise ValueError("corrupt central directory entry")
+        position += ZIP_CENTRAL_HEADER.size
+        name = directory[position:position + name_length].decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = directory[position + name_length:position + name_length + extra_length]
+        position += name_length + extra_length + comment_length
+        file_size, compressed_size, offset = _zip64_values(extra, file_size, compressed_size, offset)
+        members.append(ZipMember(name, method, crc, compressed_size, file_size, offset))
+    return sorted(members, key=lambda m: m.offset), cd_offset
+
+def _read_exact(stream, length):
+    data = bytearray()
+    while len(data) < length:
+        block = stream.read(min(length - len(data), CHUNK_SIZE))
+        if not block:
+            raise EOFError("archive data ended early")
+        data += block
+    return bytes(data)
+
+def zip_spans(members, cd_offset, selected=None, max_gap=0):
+    """
+    Groups members (sorted by offset) into [start, end, members] byte ranges
+    of up to about VERIFY_SPAN_BYTES, one Range request each. A member's
+    range ends where the next one (or the central directory) starts, so data
+    descriptors are included. With selected (a set of names) only those
+    members are kept; gaps of up to max_gap bytes are read through instead of
+    starting a new span.
+    """
+    ends = [m.offset for m in members[1:]] + [cd_offset]
+    spans = []
+    for member, end in zip(members, ends):
+        if selected is not None and member.name not in selected:
+            continue
+        if spans and member.offset - spans[-1][1] <= max_gap and end - spans[-1][0] <= VERIFY_SPAN_BYTES:
+            spans[-1][1] = end
+            spans[-1][2].append(member)
+        else:
+            spans.append([member.offset, end, [member]])
+    return spans
+
+def _entry_chunks(stream, member):
+    decompressor = zlib.decompressobj(-15) if member.method == zipfile.ZIP_DEFLATED else None
+    remaining = member.compressed_size
+    while remaining:
+        block = stream.read(min(remaining, CHUNK_SIZE))
+        if not block:
+            raise EOFError("archive data ended early")
+        remaining -= len(block)
+        yield decompressor.decompress(block) if decompressor else block
+    if decompressor:
+        yield decompressor.flush()
+
+def read_zip_entries(stream, start, members):
+    """
+    Yields (member, chunks) for members stored in order in stream, which
+    begins at archive offset start; bytes between them are skipped. chunks
+    yields the member's decompressed data and has to be consumed before the
+    next member is requested. Raises ValueError for a corrupt local header
+    and EOFError or zlib.error for truncated or corrupt data.
+    """
+    position = start
+    for member in members:
+        _read_exact(stream, member.offset - position)
+        header = _read_exact(stream, ZIP_LOCAL_HEADER.size)
+        signature, _, _, _, _, _, _, _, _, name_length, extra_length = ZIP_LOCAL_HEADER.unpack(header)
+        if signature != b'PK\x03\x04':
+            raise ValueError(f"{member.name}: local header not found at offset {member.offset}")
+        name = _read_exact(stream, name_length + extra_length)[:name_length]
+        if member.name not in (name.decode('utf-8', 'replace'), name.decode('cp437')):
+            raise ValueError(f"{member.name}: local header names {name!r}")
+        if member.method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"{member.name}: unsupported compression method {member.method}")
+        position = member.offset + ZIP_LOCAL_HEADER.size + name_length + extra_length + member.compressed_size
+        yield member, _entry_chunks(stream, member)
+
+def verify_span(remote_url, start, end, members, checksums):
+    """
+    Streams bytes start..end of a remote ZIP, which hold the given members
+    back to back, and checks every member's local header, CRC-32, size and
+    (where the manifest has one) content checksum. Runs on a worker thread;
+    returns (problems, uncompressed bytes checked).
+    """
+    problems = []
+    checked = 0
+    response = http_client.get(remote_url, headers={'Range': f"bytes={start}-{end}"}, stream=True)
+    with response:
+        if response.status_code != 206:
+            return [f"Range request for bytes {start}-{end} failed with status {response.status_code}"], 0
+        current = None
+        try:
+            for current, chunks in read_zip_entries(response.raw, start, members):
+                digest = new_checksum()
+                crc = size = 0
+                for data in chunks:
+                    crc = zlib.crc32(data, crc)
+                    digest.update(data)
+                    size += len(data)
+                checked += size
+                if size != current.size:
+                    problems.append(f"{current.name}: {size} bytes, expected {current.size}")
+                elif crc != current.crc:
+                    problems.append(f"{current.name}: CRC-32 mismatch")
+                elif checksums.get(current.name) and format_checksum(digest) != checksums[current.name]:
+                    problems.append(f"{current.name}: content does not match the manifest checksum")
+        except ValueError as e:
+            problems.append(str(e))
+        except (EOFError, zlib.error, struct.error) as e:
+            problems.append(f"{current.name if current else start}: {e}")
+    return problems, checked
+
+@traced()
+def verify_zip_deep(remote_url, size, manifest, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Validates every entry of a remote ZIP without downloading it to disk:
+    the central directory is read with Range requests, then the entries are
+    split into spans of consecutive entries that are streamed and checked in
+    parallel (see verify_span). Entries the manifest lists as archived but
+    the archive lacks are reported too. Returns (problems, entries, bytes).
+    """
+    try:
+        members, cd_offset = read_central_directory(remote_url, size)
+    except (ValueError, RuntimeError) as e:
+        return [f"cannot read the central directory: {e}"], 0, 0
+    checksums = {rel: info.get('checksum') for rel, info in (manifest or {}).get('files', {}).items()}
+    problems = []
+    if manifest:
+        names = {m.name for m in members}
+        missing = [rel for rel in manifest['changed'] if rel not in names]
+        problems += [f"{rel}: missing from the archive" for rel in missing]
+
+    checked = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(verify_span, remote_url, start, end - 1, span_members, checksums)
+                   for start, end, span_members in zip_spans(members, cd_offset) if end > start]
+        for future in as_completed(futures):
+            span_problems, span_bytes = future.result()
+            problems += span_problems
+            checked += span_bytes
+    return problems, len(members), checked
+
+@traced()
+def verify_tar_deep(remote_url, manifest):
+    """
+    tar.zst archives cannot be read at random offsets, so the archive is
+    streamed once through the decompressor (never to disk), checking each
+    file's size and checksum and the checksum of the archive as a whole.
+    Returns (problems, entries, bytes).
+    """
+    try:
+        require_format('tar.zst')
+    except RuntimeError as e:
+        return [str(e)], 0, 0
+    import zstandard
+    files = (manifest or {}).get('files', {})
+    problems = []
+    entries = checked = 0
+    with http_client.get(remote_url, stream=True) as response:
+        if response.status_code != 200:
+            return [f"download failed with status {response.status_code}"], 0, 0
+        raw = HashingStream(response.raw)
+        try:
+            with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(raw), mode='r|') as tar:
+                for member in tar:
+                    entries += 1
+                    if not member.isfile():
+                        continue
+                    digest = new_checksum()
+                    source = tar.extractfile(member)
+                    while block := source.read(CHUNK_SIZE):
+                        digest.update(block)
+                        checked += len(block)
+                    expected = files.get(member.name, {})
+                    if expected.get('size') is not None and member.size != expected['size']:
+                        problems.append(f"{member.name}: {member.size} bytes, expected {expected['size']}")
+                    elif expected.get('checksum') and format_checksum(digest) != expected['checksum']:
+                        problems.append(f"{member.name}: content does not match the manifest checksum")
+            # The archive checksum covers the whole file, including what the tar reader left unread
+            while raw.read(CHUNK_SIZE):
+                pass
+        except (tarfile.TarError, zstandard.ZstdError, EOFError) as e:
+            return problems + [f"corrupt archive: {e}"], entries, checked
+    if manifest and manifest.get('archive_checksum') and raw.checksum != manifest['archive_checksum']:
+        problems.append("archive does not match the checksum recorded at backup time")
+    return problems, entries, checked
+
+@traced()
+def verify_backup(name, deep=False, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Checks one archive of the backup folder against its manifest. The quick
+    check reads the archive's properties (one PROPFIND): size, the checksum
+    Nextcloud stored at upload and the ETag recorded in the manifest (a
+    changed ETag alone is only reported as a warning). deep also streams the
+    archive back and validates every entry, see verify_zip_deep. Returns True
+    if no problem was found.
+    """
+    catalog = get_catalog()
+    manifest = catalog.manifest(name) or load_manifest(manifest_name(name))
+    url = f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}"
+    entry = stat_remote(url)
+    if entry is None:
+        print(f"Error: {name}: archive not found")
+        return False
+    problems = [] if manifest else ["manifest not found, only the archive structure can be checked"]
+    expected_size = (manifest or {}).get('archive_size')
+    if expected_size is None:
+        expected_size = next((b['size'] for b in catalog.backups() if b['name'] == name), None)
+    problems += check_remote_archive(entry, expected_size, (manifest or {}).get('archive_checksum'))
+    if manifest and manifest.get('archive_etag') and entry.etag != manifest['archive_etag']:
+        print(f"Warning: {name}: ETag changed since the backup ({manifest['archive_etag']} -> {entry.etag})"
+              f"{'' if deep else ', run with --deep to check the content'}")
+
+    detail = ""
+    if deep:
+        start = time.monotonic()
+        if name.endswith('.zip'):
+            deep_problems, entries, checked = verify_zip_deep(url, entry.size, manifest, max_workers)
+        else:
+            deep_problems, entries, checked = verify_tar_deep(url, manifest)
+        problems += deep_problems
+        seconds = max(time.monotonic() - start, 1e-6)
+        detail = (f", {entries} entries ({checked / 1024 / 1024:.1f} MB) validated in {seconds:.1f}s "
+                  f"({entry.size / 1024 / 1024 / seconds:.2f} MB/s read)")
+    if problems:
+        print(f"Error: {name}: {len(problems)} problem(s){detail}")
+        for problem in problems[:20]:
+            print(f"   {problem}")
+        if len(problems) > 20:
+            print(f"   ... and {len(problems) - 20} more")
+        return False
+    print(f"{name}: OK{detail}")
+    return True
+
+def verify_backups(selection, deep=False, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Verifies 'latest' (the newest archive), 'all' catalogued archives or one
+    archive by name. Returns the names that failed.
+    """
+    archives = [b['name'] for b in get_catalog().backups(kinds=('full', 'delta', 'collective'))]
+    if selection == 'latest':
+        archives = archives[-1:]
+    elif selection != 'all':
+        archives = [selection]
+    if not archives:
+        print("No archives to verify")
+    return [name for name in archives if not verify_backup(name, deep, max_workers)]
+
+# --- RESTORE ---
+
+# Restored files up to this size are buffered and uploaded by the worker
+# pool; larger ones are piped from the archive reader into their PUT
+RESTORE_BUFFER_BYTES = 4 * CHUNK_SIZE
+# Seconds between two progress lines of a restore
+RESTORE_PROGRESS_INTERVAL = 5
+
+def in_subpath(rel_path, subpath):
+    return not subpath or rel_path == subpath or rel_path.startswith(subpath + '/')
+
+def already_restored(remote, info):
+    """
+    True if the file at the target matches the backed up one: same checksum,
+    or, where the server has none, same ETag and size (the untouched original).
+    """
+    if remote is None or remote.is_dir:
+        return False
+    match = checksum_matches(remote.checksum, info.get('checksum'))
+    if match is not None:
+        return match
+    return bool(info.get('etag')) and remote.etag == info['etag'] and remote.size == info['size']
+
+def list_existing(target_url, subpath, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    What already exists at the target below subpath, relative to target_url:
+    (set of folders, {relative path: Entry}).
+    """
+    root_url = f"{target_url}{quote(subpath)}" if subpath else target_url
+    root = stat_remote(root_url)
+    if root is None:
+        return set(), {}
+    if not root.is_dir:
+        return set(), {subpath: root}
+    dirs, files = list_tree(root_url.rstrip('/') + '/', max_workers)
+    prefix = f"{subpath}/" if subpath else ''
+    return {prefix + d for d in dirs} | ({subpath} if subpath else set()), {prefix + rel: e for rel, e in files}
+
+def ensure_target(target):
+    """
+    Creates the target folder (relative to the user's files) and its parents; returns its URL.
+    """
+    parts = [p for p in target.split('/') if p]
+    base = f"{NEXTCLOUD_URL}/remote.php/dav/files/{ANCHOR_USER}/"
+    target_url = f"{base}{quote('/'.join(parts))}/" if parts else base
+    if stat_remote(target_url) is None:
+        for i in range(1, len(parts) + 1):
+            if not ensure_collection(f"{base}{quote('/'.join(parts[:i]))}/"):
+                print(f"Error: Could not create the restore target {'/'.join(parts[:i])}")
+                sys.exit(1)
+    return target_url
+
+@traced()
+def create_directories(target_url, dirs, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    MKCOLs dirs level by level, so parents exist before their children while
+    all folders of one level are created concurrently. Returns how many failed.
+    """
+    levels = {}
+    for rel_dir in dirs:
+        levels.setdefault(rel_dir.count('/'), []).append(rel_dir)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for depth in sorted(levels):
+            created = pool.map(lambda d: ensure_collection(f"{target_url}{quote(d)}/"), levels[depth])
+            failed += sum(not ok for ok in created)
+    return failed
+
+class RestoreProgress:
+    """
+    Counters of a running restore, updated from many threads; prints a
+    progress line at most every RESTORE_PROGRESS_INTERVAL seconds.
+    """
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.failed = []
+        self.start = time.monotonic()
+        self._next_report = self.start + RESTORE_PROGRESS_INTERVAL
+        self._lock = threading.Lock()
+
+    def done(self, rel_path, size, ok):
+        with self._lock:
+            if ok:
+                self.files += 1
+                self.bytes += size
+            else:
+                self.failed.append(rel_path)
+            now = time.monotonic()
+            if now < self._next_report:
+                return
+            self._next_report = now + RESTORE_PROGRESS_INTERVAL
+        print(f"Restored {self.files}/{self.total_files} files, {self.rate()}")
+
+    def rate(self):
+        seconds = max(time.monotonic() - self.start, 1e-6)
+        return (f"{self.bytes / 1024 / 1024:.1f}/{self.total_bytes / 1024 / 1024:.1f} MB in {seconds:.1f}s "
+                f"({self.files / seconds:.1f} files/s, {self.bytes / 1024 / 1024 / seconds:.2f} MB/s)")
+
+class Restorer:
+    """
+    Uploads files to target_url while archive readers decompress them. Files
+    up to RESTORE_BUFFER_BYTES are buffered and PUT by a pool of max_workers
+    threads, with at most 2 * max_workers buffers in flight so memory stays
+    bounded; larger files are streamed from the calling reader into a PUT on
+    the pool.
+    The content is checked against the archive's CRC-32 and the manifest
+    checksum, which is also sent as OC-Checksum so a later restore can skip
+    the file; a file that fails the check is not left at the target.
+    """
+    def __init__(self, target_url, files, progress, max_workers=NC_COLLECTIVES_WORKERS):
+        self.target_url = target_url
+        self.files = files
+        self.progress = progress
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(2 * max_workers)
+
+    def _put(self, rel_path, data):
+        info = self.files[rel_path]
+        headers = {'OC-Checksum': info['checksum']} if info.get('checksum') else {}
+        try:
+            headers['X-OC-Mtime'] = str(int(parsedate_to_datetime(info['mtime']).timestamp()))
+        except (KeyError, TypeError, ValueError):
+            pass
+        try:
+            response = http_client.put(f"{self.target_url}{quote(rel_path)}", data=data, headers=headers)
+        except Exception as e:
+            print(f"Error: Restoring {rel_path} failed: {e}")
+            return False
+        if response.status_code not in [201, 204]:
+            print(f"Error: Restoring {rel_path} failed with status {response.status_code}")
+            return False
+        return True
+
+    def _mismatch(self, rel_path, crc, expected_crc, digest):
+        if expected_crc is not None and crc != expected_crc:
+            return "CRC-32 mismatch"
+        checksum = self.files[rel_path].get('checksum')
+        if checksum and format_checksum(digest) != checksum:
+            return "content does not match the manifest checksum"
+        return None
+
+    def _finished(self, rel_path, size, future):
+        self._slots.release()
+        self.progress.done(rel_path, size, future.result())
+
+    def restore(self, rel_path, chunks, size, expected_crc=None):
+        """
+        Restores one file from an iterable of its data chunks, which is
+        consumed completely before this returns.
+        """
+        state = {'crc': 0, 'size': 0, 'digest': new_checksum()}
+
+        def checked():
+            for data in chunks:
+                state['crc'] = zlib.crc32(data, state['crc'])
+                state['digest'].update(data)
+                state['size'] += len(data)
+                yield data
+
+        if size <= RESTORE_BUFFER_BYTES:
+            data = b''.join(checked())
+            problem = self._mismatch(rel_path, state['crc'], expected_crc, state['digest'])
+            if problem:
+                print(f"Error: {rel_path}: {problem}, not restored")
+                self.progress.done(rel_path, 0, False)
+                return
+            self._slots.acquire()
+            future = self._pool.submit(self._put, rel_path, data)
+            future.add_done_callback(lambda f: self._finished(rel_path, len(data), f))
+            return
+
+        # The reader keeps its archive download open, so the PUT runs on the pool and is fed through a pipe
+        pipe = ChunkedPipe()
+
+        def upload():
+            try:
+                return self._put(rel_path, iter(pipe))
+            finally:
+                pipe.reader_done.set()
+
+        future = self._pool.submit(upload)
+        writing = True
+        # A failed PUT stops reading early; the reader has to get past the file either way
+        for data in checked():
+            if writing:
+                try:
+                    pipe.write(data)
+                except BrokenPipeError:
+                    writing = False
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+        ok = future.result()
+        problem = self._mismatch(rel_path, state['crc'], expected_crc, state['digest'])
+        if problem:
+            print(f"Error: {rel_path}: {problem}, not restored")
+            if ok:
+                self._pool.submit(http_client.delete, f"{self.target_url}{quote(rel_path)}")
+            ok = False
+        self.progress.done(rel_path, state['size'], ok)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+def restore_zip_span(archive_url, start, end, members, restorer):
+    """
+    Streams one span of a ZIP (see zip_spans) and restores its members.
+    Runs on a reader thread; returns an error message or None.
+    """
+    response = http_client.get(archive_url, headers={'Range': f"bytes={start}-{end}"}, stream=True)
+    with response:
+        if response.status_code != 206:
+            return f"Range request for bytes {start}-{end} failed with status {response.status_code}"
+        current = None
+        try:
+            for current, chunks in read_zip_entries(response.raw, start, members):
+                restorer.restore(current.name, chunks, current.size, current.crc)
+        except ValueError as e:
+            return str(e)
+        except (EOFError, zlib.error, struct.error) as e:
+            return f"{current.name if current else start}: {e}"
+    return None
+
+@traced()
+def restore_from_zips(chain, wanted, restorer, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Restores the wanted files from a ZIP chain (oldest first). Each file is
+    taken from the newest archive holding it, found through the central
+    directories, and only the byte ranges of wanted entries are streamed,
+    several spans in parallel. Returns the wanted files no archive holds.
+    """
+    urls = [f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}" for name in chain]
+
+    def remote_size(url):
+        entry = stat_remote(url)
+        return entry.size if entry else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        sizes = list(pool.map(remote_size, urls))
+        missing = [name for name, size in zip(chain, sizes) if size is None]
+        if missing:
+            print(f"Error: Archive(s) of the chain not found: {', '.join(missing)}")
+            sys.exit(1)
+        try:
+            directories = list(pool.map(read_central_directory, urls, sizes))
+        except (ValueError, RuntimeError) as e:
+            print(f"Error: Cannot read the archive's central directory: {e}")
+            sys.exit(1)
+
+    remaining = set(wanted)
+    spans = []
+    for url, (members, cd_offset) in reversed(list(zip(urls, directories))):
+        selected = remaining & {m.name for m in members}
+        remaining -= selected
+        # Skipping up to a chunk of unwanted entries is cheaper than another request
+        spans += [(url, span) for span in zip_spans(members, cd_offset, selected, CHUNK_SIZE)]
+
+    readers = max(max_workers // 2, 1)
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        futures = [pool.submit(restore_zip_span, url, start, end - 1, span_members, restorer)
+                   for url, (start, end, span_members) in spans]
+        for future in as_completed(futures):
+            error = future.result()
+            if error:
+                print(f"Error: {error}")
+    return sorted(remaining)
+
+@traced()
+def restore_from_tar(name, wanted, restorer):
+    """
+    Restores the wanted files from a tar.zst archive, which is streamed once
+    through the decompressor. Returns the wanted files the archive lacks.
+    """
+    require_format('tar.zst')
+    import zstandard
+    remaining = set(wanted)
+    with http_client.get(f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{name}", stream=True) as response:
+        if response.status_code != 200:
+            print(f"Error: Download of {name} failed with status {response.status_code}")
+            sys.exit(1)
+        try:
+            with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(response.raw), mode='r|') as tar:
+                for member in tar:
+                    if member.isfile() and member.name in remaining:
+                        remaining.discard(member.name)
+                        source = tar.extractfile(member)
+                        restorer.restore(member.name, iter(lambda: source.read(CHUNK_SIZE), b''), member.size)
+        except (tarfile.TarError, zstandard.ZstdError, EOFError) as e:
+            print(f"Error: {name} is corrupt: {e}")
+    return sorted(remaining)
+
+def resolve_restore(archive, collective=None, subpath=None):
+    """
+    The archive, its manifest and the sub-path to restore. 'latest' is the
+    newest full or delta archive; with a collective, the newest by creation
+    time of its own archives and of the full and delta archives that hold its
+    folder (restored limited to that folder).
+    """
+    catalog = get_catalog()
+    subpath = (subpath or '').strip('/')
+    if archive == 'latest':
+        def holds_collective(backup):
+            manifest = catalog.manifest(backup['name']) or {}
+            if backup['kind'] == 'collective':
+                return manifest.get('collective') == collective
+            return collective in manifest.get('dirs', [collective])
+
+        if collective is None:
+            backups = catalog.backups(kinds=('full', 'delta'))
+        else:
+            backups = [b for b in catalog.backups(kinds=('full', 'delta', 'collective')) if holds_collective(b)]
+        if not backups:
+            print("Error: No archive to restore from")
+            sys.exit(1)
+        archive = max(backups, key=lambda b: (b['created'], b['name']))['name']
+    manifest = catalog.manifest(archive) or load_manifest(manifest_name(archive))
+    if manifest is None:
+        sys.exit(1)
+    if collective is not None and manifest.get('collective') is None:
+        subpath = '/'.join(p for p in (collective, subpath) if p)
+    return archive, manifest, subpath
+
+
+@traced('restore')
+def restore_backup(archive, target=None, collective=None, subpath=None, max_workers=NC_COLLECTIVES_WORKERS):
+    """
+    Restores an archive ('latest', a full, delta or collective backup) into
+    the folder target, relative to the user's files (default: where it was
+    backed up from), limited to one collective and/or a file or folder
+    subpath. The folders are created first, then the files are streamed
+    from the archive into concurrent PUTs. Files whose copy at the target
+    already matches are skipped, so an interrupted restore can simply be
+    run again. Returns True if every selected file is in place.
+    """
+    archive, manifest, subpath = resolve_restore(archive, collective, subpath)
+    if target is None:
+        target = NC_COLLECTIVES_FOLDER
+        if manifest.get('collective'):
+            target = f"{target}/{manifest['collective']}"
+    files = {rel: info for rel, info in manifest['files'].items() if in_subpath(rel, subpath)}
+    dirs = [d for d in manifest['dirs'] if in_subpath(d, subpath) or subpath.startswith(d + '/')]
+    if not files and not dirs:
+        print(f"Error: {archive} holds nothing below {subpath}")
+        return False
+    print(f"Restoring {len(files)} files in {len(dirs)} folders from {archive} to {target}"
+          f"{f' (only {subpath})' if subpath else ''}...")
+
+    target_url = ensure_target(target)
+    existing_dirs, existing_files = list_existing(target_url, subpath, max_workers)
+    wanted = {rel: info for rel, info in files.items() if not already_restored(existing_files.get(rel), info)}
+    skipped = len(files) - len(wanted)
+    if skipped:
+        print(f"{skipped} files already match the backup and are skipped")
+
+    start = time.monotonic()
+    missing_dirs = [d for d in dirs if d not in existing_dirs]
+    failed_dirs = create_directories(target_url, missing_dirs, max_workers)
+    print(f"Created {len(missing_dirs) - failed_dirs} folders in {time.monotonic() - start:.1f}s")
+    if failed_dirs:
+        print(f"Error: {failed_dirs} folders could not be created")
+
+    progress = RestoreProgress(len(wanted), sum(info['size'] or 0 for info in wanted.values()))
+    restorer = Restorer(target_url, wanted, progress, max_workers)
+    try:
+        if not wanted:
+            lacking = []
+        elif archive.endswith('.zip'):
+            lacking = restore_from_zips(manifest['chain'], wanted, restorer, max_workers)
+        else:
+            lacking = restore_from_tar(archive, wanted, restorer)
+    finally:
+        restorer.close()
+    for rel_path in lacking:
+        print(f"Error: {rel_path} is not contained in any archive of the chain")
+    print(f"Restored {progress.files} files, {progress.rate()}")
+    failed = len(progress.failed) + len(lacking)
+    if failed:
+        print(f"Error: {failed} files could not be restored, run the restore again to retry them")
+    return failed == 0 and failed_dirs == 0
 
 if __name__ == "__main__":
-    # 1. Download all files
-    print("Starting download...")
-    download_recursive(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}", LOCAL_TEMP_DIR)
+    parser = argparse.ArgumentParser(description="Backup Nextcloud collectives to a ZIP on Nextcloud.")
+    parser.add_argument("--workers", type=int, default=NC_COLLECTIVES_WORKERS,
+                        help="parallel WebDAV requests during download (1 = sequential walk)")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream files straight into the uploaded ZIP without a local temp directory")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only archive files changed since the last manifest (streamed delta archive)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="back up into the deduplicated content-addressed store instead of a ZIP")
+    parser.add_argument("--per-collective", action="store_true",
+                        help="back up each collective into its own archive, skipping unchanged ones")
+    parser.add_argument("--collective-parallel", type=int, default=NC_COLLECTIVES_PARALLEL,
+                        help="collectives backed up at the same time with --per-collective")
+    parser.add_argument("--rebuild", metavar="ARCHIVE",
+                        help="rebuild a full restore point for ARCHIVE (a zip from its delta chain, "
+                             "or a store snapshot_<ts>.json)")
+    parser.add_argument("--output", help="local path of the rebuilt archive (default: restore_<ARCHIVE>)")
+    parser.add_argument("--verify", nargs='?', const='latest', metavar="ARCHIVE",
+                        help="check an uploaded archive against its manifest: ARCHIVE, 'latest' (default) or 'all'")
+    parser.add_argument("--deep", action="store_true",
+                        help="with --verify, stream the archive back and validate every entry")
+    parser.add_argument("--restore", nargs='?', const='latest', metavar="ARCHIVE",
+                        help="restore ARCHIVE or 'latest' (default) into Nextcloud")
+    parser.add_argument("--target", help="folder to restore into, relative to the user's files "
+                                         "(default: the backed up collectives folder)")
+    parser.add_argument("--collective", help="with --restore, only restore this collective")
+    parser.add_argument("--path", help="with --restore, only restore this file or folder of the archive "
+                                       "(relative to the collective with --collective)")
+    parser.add_argument("--chunk-size", type=int, default=NC_COLLECTIVES_UPLOAD_CHUNK_MB, metavar="MB",
+                        help="chunk size for resumable uploads of the ZIP")
+    parser.add_argument("--format", choices=list(ARCHIVE_FORMATS), default=NC_COLLECTIVES_ARCHIVE_FORMAT,
+                        help="archive format of the temp directory mode")
+    parser.add_argument("--level", type=int,
+                        default=int(NC_COLLECTIVES_COMPRESSION_LEVEL) if NC_COLLECTIVES_COMPRESSION_LEVEL else None,
+                        help="compression level (zip 0-9, zstd 1-22)")
+    parser.add_argument("--compress-workers", type=int, default=NC_COLLECTIVES_COMPRESSION_WORKERS,
+                        help="threads used to compress the archive")
+    parser.add_argument("--upload-parallel", type=int, default=NC_COLLECTIVES_UPLOAD_PARALLEL,
+                        help="chunks uploaded in parallel")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted download from its checkpoint journal")
+    parser.add_argument("--list", action="store_true", help="list the backups recorded in the catalog")
+    parser.add_argument("--rebuild-catalog", action="store_true",
+                        help="re-import the catalog from the backup folder")
+    parser.add_argument("--trace", metavar="FILE", default=NC_TRACE_FILE,
+                        help="write JSONL spans of all phases and HTTP requests and print a latency summary")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+    workers = max(args.workers, 1)
+    # Streaming modes hold up to `workers` open downloads next to their uploads
+    http_client.set_max_connections(max(NC_HTTP_MAX_CONNECTIONS, 2 * workers + 2))
+    atexit.register(http_client.print_stats)
+    policy = parse_retention_policy(NC_COLLECTIVES_RETENTION, NC_COLLECTIVES_BACKUP_COUNT)
+
+    if args.rebuild_catalog:
+        if os.path.exists(LOCAL_CATALOG):
+            os.remove(LOCAL_CATALOG)
+        _catalog = BackupCatalog(LOCAL_CATALOG)
+        import_backup_folder(workers)
 
-    # 2. Create ZIP archive
-    print("Creating ZIP archive...")
-    shutil.make_archive(ZIP_FILENAME.replace('.zip', ''), 'zip', LOCAL_TEMP_DIR)
+    if args.list:
+        print_catalog()
+        sys.exit(0)
+
+    if args.verify:
+        failed = verify_backups(args.verify, args.deep, workers)
+        sys.exit(1 if failed else 0)
+
+    if args.restore:
+        ok = restore_backup(args.restore, args.target, args.collective, args.path, workers)
+        sys.exit(0 if ok else 1)
+
+    if args.rebuild:
+        if args.rebuild.startswith('snapshot_'):
+            ok = rebuild_snapshot(args.rebuild, args.output or f"restore_{args.rebuild[:-len('.json')]}.zip")
+        else:
+            ok = rebuild_restore_point(args.rebuild, args.output or f"restore_{args.rebuild}")
+        sys.exit(0 if ok else 1)
+
+    if args.dedup:
+        dedup_backup(workers)
+        if policy:
+            collect_garbage(policy, workers)
+        print("Backup process finished.")
+        sys.exit(0)
+
+    if args.per_collective:
+        failed = per_collective_backup(max(args.collective_parallel, 1), workers)
+        cleanup_old_backups(policy, workers)
+        if failed:
+            print(f"Error: {len(failed)} collective(s) failed: {', '.join(failed)}")
+            sys.exit(1)
+        print("Backup process finished.")
+        sys.exit(0)
+
+    if args.incremental:
+        try:
+            written = incremental_backup(workers)
+        except BackupError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if written:
+            cleanup_old_backups(policy, workers)
+        print("Backup process finished.")
+        sys.exit(0)
 
-    # 3. Upload ZIP to Nextcloud
     target_url = f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{ZIP_FILENAME}"
-    upload_zip(ZIP_FILENAME, target_url)
+    if args.stream:
+        print("Listing remote files...")
+        dirs, files = list_tree(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}", workers)
+        print(f"Found {len(files)} files in {len(dirs)} folders")
+        try:
+            stats = stream_backup(dirs, files, target_url, workers)
+        except BackupError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        manifest = build_manifest(ZIP_FILENAME, dirs, dict(files), [ZIP_FILENAME], checksums=stats['checksums'],
+                                  archive=stats)
+        upload_manifest(manifest)
+        register_backup(manifest, stats['archive_bytes'])
+        cleanup_old_backups(policy, workers)
+        print("Backup process finished.")
+        sys.exit(0)
+
+    # 0. Finish uploads an interrupted run left behind
+    try:
+        require_format(args.format)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    archive_name = ARCHIVE_BASENAME + ARCHIVE_FORMATS[args.format]
+    target_url = f"{NEXTCLOUD_URL}{REMOTE_TARGET_FOLDER}{archive_name}"
+    resume_pending_uploads()
+
+    # 1. Download all files (workers=1 walks the tree sequentially). A leftover
+    #    temp directory is only trusted together with its journal and --resume.
+    if args.resume and os.path.exists(LOCAL_JOURNAL):
+        removed = remove_partial_files(LOCAL_TEMP_DIR)
+        print(f"Resuming download from {LOCAL_JOURNAL} ({removed} partial files discarded)...")
+    else:
+        if os.path.exists(LOCAL_TEMP_DIR):
+            print("Removing temp directory left by an earlier run...")
+            shutil.rmtree(LOCAL_TEMP_DIR)
+        print("Starting download...")
+    journal = BackupJournal(LOCAL_JOURNAL, resume=args.resume)
+    stats = download_concurrent(f"{NEXTCLOUD_URL}{REMOTE_SOURCE_PATH}", LOCAL_TEMP_DIR, workers, journal)
+    journal.close()
+    print_transfer_stats(stats)
+    if stats['failed']:
+        print("Error: The download is incomplete, run again with --resume to fetch the missing files")
+        sys.exit(1)
+
+    # 2. Create the archive
+    print(f"Creating {args.format} archive...")
+    with tracer.span('archive', format=args.format):
+        checksums, archive_checksum = create_archive(LOCAL_TEMP_DIR, archive_name, args.format, args.level,
+                                                     max(args.compress_workers, 1))
+
+    # 3. Upload the archive and its manifest to Nextcloud; the manifest is kept
+    #    locally until then so resume_pending_uploads can finish the job after a crash
+    manifest = build_manifest(archive_name, stats['dirs'], stats['entries'], [archive_name], checksums=checksums,
+                              archive={'archive_bytes': os.path.getsize(archive_name), 'archive_checksum': archive_checksum})
+    with open(manifest_name(archive_name), 'w') as f:
+        json.dump(manifest, f)
+    etag = upload_zip(archive_name, target_url, args.chunk_size, max(args.upload_parallel, 1), archive_checksum)
+    manifest['archive_etag'] = verify_upload(target_url, manifest['archive_size'], archive_checksum, etag)
+    upload_manifest(manifest)
+    register_backup(manifest, os.path.getsize(archive_name))
 
     # 4. Cleanup old backups
-    cleanup_old_backups()
+    cleanup_old_backups(policy, workers)
 
     # 5. Cleanup local files
     print("Cleaning up local temporary files...")
-    shutil.rmtree(LOCAL_TEMP_DIR)
-    os.remove(ZIP_FILENAME)
+    with tracer.span('local_cleanup'):
+        shutil.rmtree(LOCAL_TEMP_DIR)
+        os.remove(LOCAL_JOURNAL)
+        os.remove(archive_name)
+        os.remove(manifest_name(archive_name))
 
     print("Backup process finished.")
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Resource kinds setup_working_group.py records; circle members and shares use name to tell rows apart
+RESOURCE_KINDS = ('group', 'folder', 'collective', 'circle_member', 'calendar', 'talk_room')
+
+
+class GroupStateStore:
+    """
+    Small SQLite record of the resources provisioned for each working group:
+    one row per resource with its server-side ID (folder_id, collective_id,
+    member_id, calendar id, room token, ...) and its last-known settings.
+    Every write is its own transaction, so a run that fails halfway still
+    leaves the IDs of the steps that completed, and later runs can look the
+    resources up instead of listing them on the server.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Steps record from worker threads, so the connection is shared under a lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS resources (
+                                   group_name TEXT NOT NULL,
+                                   kind TEXT NOT NULL,
+                                   name TEXT NOT NULL DEFAULT '',
+                                   resource_id TEXT,
+                                   settings TEXT,
+                                   updated TEXT NOT NULL,
+                                   PRIMARY KEY (group_name, kind, name))""")
+
+    @staticmethod
+    def _row(group_name, kind, name, resource_id, settings):
+        if kind not in RESOURCE_KINDS:
+            raise ValueError(f"Unknown resource kind {kind}")
+        return (group_name, kind, name, None if resource_id is None else str(resource_id),
+                json.dumps(settings or {}, sort_keys=True), datetime.now(timezone.utc).isoformat())
+
+    def record(self, group_name, kind, resource_id, settings=None, name=''):
+        """
+        Stores (or replaces) one resource of a group.
+        """
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)",
+                            self._row(group_name, kind, name, resource_id, settings))
+
+    def update_settings(self, group_name, kind, settings, name=''):
+        """
+        Merges settings into a recorded resource; does nothing if it is not recorded.
+        """
+        with self.lock, self.db:
+            row = self.db.execute("SELECT resource_id, settings FROM resources "
+                                  "WHERE group_name = ? AND kind = ? AND name = ?",
+                                  (group_name, kind, name)).fetchone()
+            if row:
+                self.db.execute("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)",
+                                self._row(group_name, kind, name, row[0], {**json.loads(row[1]), **settings}))
+
+    def replace_group(self, group_name, resources):
+        """
+        Replaces everything recorded for a group in one transaction;
+        resources are (kind, resource_id, settings, name) tuples.
+        """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM resources WHERE group_name = ?", (group_name,))
+            self.db.executemany("INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?)",
+                                [self._row(group_name, kind, name, resource_id, settings)
+                                 for kind, resource_id, settings, name in resources])
+
+    def forget(self, group_name, kind=None, name=None):
+        """
+        Removes the rows of a group, optionally only one kind (and name).
+        """
+        query, args = "DELETE FROM resources WHERE group_name = ?", [group_name]
+        if kind is not None:
+            query, args = query + " AND kind = ?", args + [kind]
+        if name is not None:
+            query, args = query + " AND name = ?", args + [name]
+        with self.lock, self.db:
+            self.db.execute(query, args)
+
+    def get(self, group_name, kind, name=''):
+        """
+        One resource as a dict with id, settings and updated, or None.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT resource_id, settings, updated FROM resources "
+                                  "WHERE group_name = ? AND kind = ? AND name = ?",
+                                  (group_name, kind, name)).fetchone()
+        if not row:
+            return None
+        return {'id': row[0], 'settings': json.loads(row[1]), 'updated': row[2]}
+
+    def resources(self, group_name=None):
+        """
+        Recorded resources as dicts, ordered by group and kind.
+        """
+        query = "SELECT group_name, kind, name, resource_id, settings, updated FROM resources"
+        args = ()
+        if group_name is not None:
+            query, args = query + " WHERE group_name = ?", (group_name,)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY group_name, kind, name", args).fetchall()
+        return [{'group': group, 'kind': kind, 'name': name, 'id': resource_id,
+                 'settings': json.loads(settings), 'updated': updated}
+                for group, kind, name, resource_id, settings, updated in rows]
+
+    def groups(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute(
+                "SELECT DISTINCT group_name FROM resources ORDER BY group_name")]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,1031 @@
+"""
+Offline stand-in for the Nextcloud endpoints used by the scripts in this repo:
+WebDAV (files, chunked uploads, group folders, PROPPATCH ACLs), CalDAV
+calendars and sharing, and the OCS APIs for groups, users, group folders,
+shares, circles, collectives, Talk rooms and serverinfo.
+
+It keeps its state in memory (uploaded file bodies are spooled to a temp
+directory), generates a collectives tree of configurable size, and can add
+latency and throttle with 429 + Retry-After. GET /__mock/stats returns
+request counts per endpoint, GET /__mock/requests the last requests as
+[method, path, depth], POST /__mock/reset clears both.
+
+    python mock_nextcloud.py --port 8080 --collectives 10 --files 10000 --latency 5
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+DAV_PREFIX = '/remote.php/dav/'
+NS = {'d': 'DAV:', 'oc': 'http://owncloud.org/ns', 'nc': 'http://nextcloud.org/ns',
+      'cal': 'urn:ietf:params:xml:ns:caldav'}
+BASE_MTIME = 1700000000
+# Requests kept for GET /__mock/requests
+REQUEST_LOG_SIZE = 10000
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt "
+         "ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation.\n")
+
+
+class Node:
+    __slots__ = ('is_dir', 'size', 'etag', 'mtime', 'data', 'path', 'seed', 'fileid', 'acl', 'checksum', 'children')
+
+    def __init__(self, fileid, is_dir=False, size=0, mtime=None, seed=None):
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime or time.time()
+        self.etag = f"{fileid:x}{int(self.mtime * 1000):x}"
+        self.data = None
+        self.path = None
+        self.seed = seed
+        self.fileid = fileid
+        self.acl = []
+        self.checksum = None
+        self.children = set() if is_dir else None
+
+
+def generated_content(seed, size):
+    """
+    Deterministic content of a generated file: markdown pages are text,
+    attachments (odd seeds divisible by 5) are random bytes.
+    """
+    if seed % 10 == 5:
+        return random.Random(seed).randbytes(size)
+    text = (f"# Page {seed}\n\n" + LOREM * (size // len(LOREM) + 1)).encode()
+    return text[:size]
+
+
+class MockState:
+    """
+    Everything the server knows. All mutations hold self.lock.
+    """
+    def __init__(self, user, spool_dir):
+        self.user = user
+        self.spool_dir = spool_dir
+        self.lock = threading.RLock()
+        self.ids = count(1000)
+        self.nodes = {}
+        self.users = {user}
+        self.groups = {}
+        self.groupfolders = {}
+        self.shares = {}
+        self.circles = {}
+        self.collectives = {}
+        self.rooms = {}
+        self.calendar_shares = {}
+        self.stats = {}
+        self.requests = deque(maxlen=REQUEST_LOG_SIZE)
+        self.mkdirs(f"files/{user}")
+        self.mkdirs(f"uploads/{user}")
+        self.mkdirs(f"calendars/{user}")
+
+    # --- tree ---
+
+    def touch(self, path):
+        """
+        Gives path and all its parent folders a new ETag, like Nextcloud's ETag propagation.
+        """
+        while path:
+            node = self.nodes.get(path)
+            if node is not None:
+                node.mtime = time.time()
+                node.etag = f"{node.fileid:x}{next(self.ids):x}"
+            path = path.rpartition('/')[0]
+
+    def mkdirs(self, path, mtime=None):
+        parts = path.split('/')
+        for i in range(1, len(parts) + 1):
+            sub = '/'.join(parts[:i])
+            if sub not in self.nodes:
+                self.nodes[sub] = Node(next(self.ids), is_dir=True, mtime=mtime)
+                if i > 1:
+                    self.nodes['/'.join(parts[:i - 1])].children.add(parts[i - 1])
+        return self.nodes[path]
+
+    def add_file(self, path, size=0, seed=None, mtime=None):
+        parent, _, name = path.rpartition('/')
+        self.mkdirs(parent, mtime)
+        node = Node(next(self.ids), size=size, mtime=mtime, seed=seed)
+        self.nodes[path] = node
+        self.nodes[parent].children.add(name)
+        return node
+
+    def remove(self, path):
+        node = self.nodes.pop(path, None)
+        if node is None:
+            return False
+        if node.is_dir:
+            for child in list(node.children):
+                self.remove(f"{path}/{child}")
+        elif node.path:
+            os.remove(node.path)
+        parent, _, name = path.rpartition('/')
+        if parent in self.nodes:
+            self.nodes[parent].children.discard(name)
+            self.touch(parent)
+        return True
+
+    def walk(self, path, depth):
+        """
+        Yields (path, node) for path and its descendants up to depth (None = infinity).
+        """
+        node = self.nodes[path]
+        yield path, node
+        if node.is_dir and depth != 0:
+            for child in sorted(node.children):
+                yield from self.walk(f"{path}/{child}", None if depth is None else depth - 1)
+
+    def read(self, node):
+        if node.path:
+            with open(node.path, 'rb') as f:
+                return f.read()
+        if node.data is not None:
+            return node.data
+        return generated_content(node.seed or 0, node.size) if node.seed is not None else b''
+
+    def spool_path(self):
+        return os.path.join(self.spool_dir, f"{next(self.ids)}.bin")
+
+    def generate_tree(self, folder, collectives, files, file_size, files_per_dir=50):
+        """
+        Spreads `files` pages over `collectives` collectives, files_per_dir per folder.
+        """
+        for c in range(collectives):
+            name = f"WG_{c:03d}"
+            self.mkdirs(f"files/{self.user}/{folder}/{name}", BASE_MTIME)
+        for i in range(files):
+            collective = f"WG_{i % collectives:03d}" if collectives else ''
+            per_collective = i // max(collectives, 1)
+            subdir = f"section_{per_collective // files_per_dir:04d}"
+            ext = 'png' if i % 10 == 5 else 'md'
+            path = f"files/{self.user}/{folder}/{collective}/{subdir}/page_{i:06d}.{ext}".replace('//', '/')
+            self.add_file(path, size=file_size, seed=i, mtime=BASE_MTIME + i)
+
+    # --- stats ---
+
+    def count_request(self, name, method=None, path=None, depth=None):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            if method is not None:
+                self.requests.append((method, path, depth))
+
+
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def dav_href(path, is_dir):
+    return DAV_PREFIX + quote(path) + ('/' if is_dir and path else '')
+
+
+def ocs(data, version=2, statuscode=None, message='OK'):
+    ok = statuscode is None
+    return {'ocs': {'meta': {'status': 'ok' if ok else 'failure',
+                             'statuscode': (200 if version == 2 else 100) if ok else statuscode,
+                             'message': message},
+                    'data': data}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockNextcloud/1.0'
+    # Headers and body go out as separate writes; avoid Nagle + delayed ACK stalls
+    disable_nagle_algorithm = True
+    state = None
+    config = None
+    bucket = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    # --- request plumbing ---
+
+    def read_body(self, sink=None):
+        """
+        Reads a Content-Length or chunked body; with a sink it is written there
+        and the size returned, otherwise the bytes are returned.
+        """
+        parts = []
+        size = 0
+
+        def emit(block):
+            nonlocal size
+            size += len(block)
+            if sink is not None:
+                sink.write(block)
+            else:
+                parts.append(block)
+
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                length = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if length == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                remaining = length
+                while remaining:
+                    block = self.rfile.read(min(remaining, 1 << 20))
+                    emit(block)
+                    remaining -= len(block)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                block = self.rfile.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                emit(block)
+                remaining -= len(block)
+        return size if sink is not None else b''.join(parts)
+
+    def send(self, status, body=b'', content_type='text/plain', headers=None):
+        if isinstance(body, (dict, list)):
+            body, content_type = json.dumps(body).encode(), 'application/json'
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def form(self, body):
+        if 'json' in self.headers.get('Content-Type', ''):
+            return json.loads(body or b'{}')
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    def handle_any(self):
+        url = urlsplit(self.path)
+        self.url_path = unquote(url.path)
+        body = None
+        if self.config.latency:
+            time.sleep((self.config.latency + random.uniform(0, self.config.jitter)) / 1000)
+        if self.url_path.startswith('/__mock/'):
+            self.read_body()
+            return self.mock_control()
+        if self.bucket is not None and not self.bucket.take():
+            self.read_body()
+            self.state.count_request('throttled')
+            return self.send(429, 'Too many requests', headers={'Retry-After': '1'})
+        if not self.headers.get('Authorization'):
+            self.read_body()
+            return self.send(401, 'Unauthorized', headers={'WWW-Authenticate': 'Basic realm="Nextcloud"'})
+        for method, pattern, handler, name in ROUTES:
+            if method != self.command:
+                continue
+            match = re.fullmatch(pattern, self.url_path)
+            if match:
+                self.state.count_request(f"{method} {name}", method, self.url_path, self.headers.get('Depth'))
+                # File uploads are streamed to the spool by dav_put itself
+                if handler is not Handler.dav_put:
+                    body = self.read_body()
+                return handler(self, body, *match.groups())
+        self.read_body()
+        self.state.count_request(f"{self.command} unknown")
+        self.send(404, f"No mock route for {self.command} {self.url_path}")
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_any
+
+    def __getattr__(self, name):
+        # PROPFIND, MKCOL, MOVE, ... arrive as do_<METHOD>
+        if name.startswith('do_'):
+            return self.handle_any
+        raise AttributeError(name)
+
+    def mock_control(self):
+        if self.url_path == '/__mock/stats':
+            with self.state.lock:
+                return self.send(200, {'requests': dict(self.state.stats), 'nodes': len(self.state.nodes),
+                                       'groups': len(self.state.groups)})
+        if self.url_path == '/__mock/requests':
+            with self.state.lock:
+                return self.send(200, {'requests': list(self.state.requests)})
+        if self.url_path == '/__mock/reset':
+            with self.state.lock:
+                self.state.stats.clear()
+                self.state.requests.clear()
+            return self.send(200, {})
+        self.send(404)
+
+    # --- WebDAV ---
+
+    def dav_path(self, raw):
+        """
+        Maps a DAV URL path to a tree key; group folders appear below the user's files.
+        Returns None for another user's space.
+        """
+        path = raw.strip('/')
+        space, _, rest = path.partition('/')
+        user, _, sub = rest.partition('/')
+        if user and user != self.state.user:
+            return None
+        if space == 'groupfolders':
+            space = 'files'
+        return '/'.join(p for p in (space, user, sub) if p)
+
+    def dav_propfind(self, body, raw):
+        path = self.dav_path(raw)
+        depth = self.headers.get('Depth', 'infinity')
+        if path is None:
+            return self.send(403, 'Forbidden')
+        if depth == 'infinity' and not self.config.depth_infinity:
+            return self.send(403, 'Depth: infinity is not allowed')
+        requested = set()
+        if body:
+            try:
+                prop = ET.fromstring(body).find('d:prop', NS)
+                requested = {child.tag for child in prop} if prop is not None else set()
+            except ET.ParseError:
+                return self.send(400, 'Bad XML')
+        with self.state.lock:
+            if path not in self.state.nodes:
+                return self.send(404, 'Not found')
+            items = list(self.state.walk(path, None if depth == 'infinity' else int(depth)))
+            parts = ['<?xml version="1.0"?>\n<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns" '
+                     'xmlns:nc="http://nextcloud.org/ns">']
+            for item_path, node in items:
+                parts.append(self.propfind_response(item_path, node, requested))
+        parts.append('</d:multistatus>')
+        self.send(207, ''.join(parts), 'application/xml; charset=utf-8')
+
+    def propfind_response(self, path, node, requested):
+        def wanted(tag):
+            return not requested or tag in requested
+
+        props = []
+        if wanted('{DAV:}resourcetype'):
+            kind = '<d:collection/>' if node.is_dir else ''
+            if node.is_dir and path.startswith('calendars/') and path.count('/') == 2:
+                kind += '<cal:calendar xmlns:cal="urn:ietf:params:xml:ns:caldav"/>'
+            props.append(f"<d:resourcetype>{kind}</d:resourcetype>")
+        if not node.is_dir and wanted('{DAV:}getcontentlength'):
+            props.append(f"<d:getcontentlength>{node.size}</d:getcontentlength>")
+        if wanted('{DAV:}getetag'):
+            props.append(f"<d:getetag>&quot;{node.etag}&quot;</d:getetag>")
+        if wanted('{DAV:}getlastmodified'):
+            props.append(f"<d:getlastmodified>{formatdate(node.mtime, usegmt=True)}</d:getlastmodified>")
+        if '{http://owncloud.org/ns}fileid' in requested:
+            props.append(f"<oc:fileid>{node.fileid}</oc:fileid>")
+        if '{http://owncloud.org/ns}size' in requested:
+            props.append(f"<oc:size>{node.size}</oc:size>")
+        if '{http://owncloud.org/ns}checksums' in requested and node.checksum:
+            props.append(f"<oc:checksums><oc:checksum>{node.checksum}</oc:checksum></oc:checksums>")
+        if '{http://nextcloud.org/ns}acl-list' in requested:
+            acls = ''.join(
+                f"<nc:acl><nc:acl-mapping-type>{a['type']}</nc:acl-mapping-type>"
+                f"<nc:acl-mapping-id>{a['id']}</nc:acl-mapping-id><nc:acl-mask>{a['mask']}</nc:acl-mask>"
+                f"<nc:acl-permissions>{a['permissions']}</nc:acl-permissions></nc:acl>" for a in node.acl)
+            props.append(f"<nc:acl-list>{acls}</nc:acl-list>")
+        if '{http://owncloud.org/ns}invite' in requested and path.startswith('calendars/') and path.count('/') == 2:
+            sharees = ''.join(
+                f"<oc:user><d:href>{href}</d:href><oc:invite-accepted/><oc:access>"
+                f"{'<oc:read-write/>' if writable else '<oc:read/>'}</oc:access></oc:user>"
+                for href, writable in self.state.calendar_shares.get(path.rpartition('/')[2], {}).items())
+            props.append(f"<oc:invite>{sharees}</oc:invite>")
+        return (f"<d:response><d:href>{dav_href(path, node.is_dir)}</d:href><d:propstat><d:prop>{''.join(props)}"
+                f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>")
+
+    def dav_get(self, _, raw):
+        path = self.dav_path(raw)
+        with self.state.lock:
+            node = self.state.nodes.get(path) if path else None
+            if node is None or node.is_dir:
+                return self.send(404 if path else 403, 'Not found')
+        data = self.state.read(node)
+        headers = {'ETag': f'"{node.etag}"', 'Last-Modified': formatdate(node.mtime, usegmt=True),
+                   'Accept-Ranges': 'bytes'}
+        if node.checksum:
+            headers['OC-Checksum'] = node.checksum
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and data:
+            start, end = match.groups()
+            if start:
+                start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            else:
+                start, end = max(len(data) - int(end), 0), len(data) - 1
+            if start >= len(data):
+                return self.send(416, '', headers={'Content-Range': f"bytes */{len(data)}"})
+            headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+            return self.send(206, data[start:end + 1], 'application/octet-stream', headers)
+        self.send(200, data, 'application/octet-stream', headers)
+
+    def dav_put(self, _, raw):
+        path = self.dav_path(raw)
+        if path is None:
+            self.read_body()
+            return self.send(403, 'Forbidden')
+        parent = path.rpartition('/')[0]
+        with self.state.lock:
+            parent_node = self.state.nodes.get(parent)
+        if parent_node is None or not parent_node.is_dir:
+            self.read_body()
+            return self.send(409, 'Parent folder does not exist')
+        spool = self.state.spool_path()
+        with open(spool, 'wb') as f:
+            size = self.read_body(f)
+        with self.state.lock:
+            existing = self.state.nodes.get(path)
+            if existing is not None and existing.is_dir:
+                os.remove(spool)
+                return self.send(409, 'Is a folder')
+            if existing is not None:
+                self.state.remove(path)
+            node = self.state.add_file(path, size=size)
+            node.path = spool
+            node.checksum = self.headers.get('OC-Checksum')
+            self.state.touch(path)
+        self.send(204 if existing else 201, '', headers={'ETag': f'"{node.etag}"', 'OC-ETag': f'"{node.etag}"'})
+
+    def dav_delete(self, _, raw):
+        path = self.dav_path(raw)
+        with self.state.lock:
+            if path is None:
+                return self.send(403, 'Forbidden')
+            if not self.state.remove(path):
+                return self.send(404, 'Not found')
+        self.send(204)
+
+    def dav_mkcol(self, _, raw):
+        path = self.dav_path(raw)
+        with self.state.lock:
+            if path is None:
+                return self.send(403, 'Forbidden')
+            if path in self.state.nodes:
+                return self.send(405, 'The resource you tried to create already exists')
+            parent = self.state.nodes.get(path.rpartition('/')[0])
+            if parent is None:
+                return self.send(409, 'Parent node does not exist')
+            self.state.mkdirs(path)
+            self.state.touch(path)
+        self.send(201)
+
+    def dav_move(self, _, raw):
+        source = self.dav_path(raw)
+        destination = self.dav_path(unquote(urlsplit(self.headers.get('Destination', '')).path)
+                                    .replace(DAV_PREFIX, '/', 1))
+        if source is None or destination is None:
+            return self.send(403, 'Forbidden')
+        with self.state.lock:
+            # Chunked uploads are assembled by moving the virtual <upload dir>/.file
+            node = self.state.nodes.get(source.rpartition('/')[0] if source.endswith('/.file') else source)
+            if node is None:
+                return self.send(404, 'Not found')
+            if destination.rpartition('/')[0] not in self.state.nodes:
+                return self.send(409, 'Destination parent does not exist')
+            if source.endswith('/.file'):
+                return self.assemble_chunks(source.rpartition('/')[0], destination)
+            existed = self.state.nodes.get(destination) is not None
+            if existed:
+                self.state.remove(destination)
+            items = list(self.state.walk(source, None))
+            for item_path, item in items:
+                new_path = destination + item_path[len(source):]
+                self.state.nodes[new_path] = item
+            parent, _, name = destination.rpartition('/')
+            self.state.nodes[parent].children.add(name)
+            for item_path, _ in items:
+                del self.state.nodes[item_path]
+            source_parent, _, source_name = source.rpartition('/')
+            self.state.nodes[source_parent].children.discard(source_name)
+            self.state.touch(source_parent)
+            self.state.touch(destination)
+        self.send(204 if existed else 201)
+
+    def assemble_chunks(self, upload_dir, destination):
+        """
+        Chunking v2: concatenates the numbered chunks of upload_dir into destination.
+        Called with the state lock held.
+        """
+        chunks = sorted(n for n in self.state.nodes[upload_dir].children if n != '.file')
+        spool = self.state.spool_path()
+        with open(spool, 'wb') as out:
+            for name in chunks:
+                out.write(self.state.read(self.state.nodes[f"{upload_dir}/{name}"]))
+        size = os.path.getsize(spool)
+        expected = self.headers.get('OC-Total-Length')
+        if expected and int(expected) != size:
+            os.remove(spool)
+            return self.send(400, f"Expected {expected} bytes, assembled {size}")
+        existed = self.state.nodes.get(destination) is not None
+        if existed:
+            self.state.remove(destination)
+        node = self.state.add_file(destination, size=size)
+        node.path = spool
+        node.checksum = self.headers.get('OC-Checksum')
+        self.state.touch(destination)
+        self.state.remove(upload_dir)
+        self.send(204 if existed else 201, '', headers={'ETag': f'"{node.etag}"', 'OC-ETag': f'"{node.etag}"'})
+
+    def dav_proppatch(self, body, raw):
+        path = self.dav_path(raw)
+        try:
+            root = ET.fromstring(body)
+        except ET.ParseError:
+            return self.send(400, 'Bad XML')
+        with self.state.lock:
+            node = self.state.nodes.get(path) if path else None
+            if node is None:
+                return self.send(404, 'Not found')
+            acl_list = root.find('.//nc:acl-list', NS)
+            if acl_list is not None:
+                node.acl = [{'type': acl.findtext('nc:acl-mapping-type', '', NS),
+                             'id': acl.findtext('nc:acl-mapping-id', '', NS),
+                             'mask': int(acl.findtext('nc:acl-mask', '0', NS)),
+                             'permissions': int(acl.findtext('nc:acl-permissions', '0', NS))}
+                            for acl in acl_list.findall('nc:acl', NS)]
+        self.send(207, f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:"><d:response>'
+                       f'<d:href>{dav_href(path, node.is_dir)}</d:href><d:propstat><d:prop/>'
+                       f'<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response></d:multistatus>',
+                  'application/xml; charset=utf-8')
+
+    # --- CalDAV ---
+
+    def mkcalendar(self, body, user, calendar):
+        with self.state.lock:
+            if user != self.state.user:
+                return self.send(403, 'Forbidden')
+            path = f"calendars/{user}/{calendar}"
+            if path in self.state.nodes:
+                return self.send(405, 'The resource you tried to create already exists')
+            self.state.mkdirs(path)
+        self.send(201)
+
+    def calendar_share(self, body, user, calendar):
+        with self.state.lock:
+            if f"calendars/{user}/{calendar}" not in self.state.nodes:
+                return self.send(404, 'Calendar not found')
+            root = ET.fromstring(body)
+            for entry in root.findall('oc:set', NS):
+                href = entry.findtext('d:href', '', NS)
+                writable = entry.find('oc:read-write', NS) is not None
+                shares = self.state.calendar_shares.setdefault(calendar, {})
+                shares[href] = shares.get(href, False) or writable
+            for entry in root.findall('oc:remove', NS):
+                self.state.calendar_shares.get(calendar, {}).pop(entry.findtext('d:href', '', NS), None)
+        self.send(200)
+
+    def calendar_delete(self, body, user, calendar):
+        with self.state.lock:
+            if not self.state.remove(f"calendars/{user}/{calendar}"):
+                return self.send(404, 'Not found')
+            self.state.calendar_shares.pop(calendar, None)
+        self.send(204)
+
+    # --- OCS: users and groups ---
+
+    def groups_list(self, body, version):
+        search = parse_qs(urlsplit(self.path).query).get('search', [''])[0]
+        with self.state.lock:
+            groups = sorted(g for g in self.state.groups if search in g)
+        self.send(200, ocs({'groups': groups}, int(version)))
+
+    def group_create(self, body, version):
+        group = self.form(body).get('groupid', '')
+        with self.state.lock:
+            if group in self.state.groups:
+                return self.send(200 if version == '1' else 400, ocs([], int(version), 102, 'group exists'))
+            self.state.groups[group] = set()
+        self.send(200, ocs([], int(version)))
+
+    def group_delete(self, body, version, group):
+        with self.state.lock:
+            if self.state.groups.pop(group, None) is None:
+                return self.send(200 if version == '1' else 404, ocs([], int(version), 101, 'not found'))
+        self.send(200, ocs([], int(version)))
+
+    def group_members(self, body, version, group):
+        with self.state.lock:
+            if group not in self.state.groups:
+                return self.send(200 if version == '1' else 404, ocs([], int(version), 404, 'not found'))
+            users = sorted(self.state.groups[group])
+        self.send(200, ocs({'users': users}, int(version)))
+
+    def users_list(self, body, version):
+        with self.state.lock:
+            users = sorted(self.state.users)
+        self.send(200, ocs({'users': users}, int(version)))
+
+    def user_groups(self, body, version, user):
+        with self.state.lock:
+            groups = sorted(g for g, members in self.state.groups.items() if user in members)
+        self.send(200, ocs({'groups': groups}, int(version)))
+
+    def user_group_add(self, body, version, user):
+        group = self.form(body).get('groupid', '')
+        with self.state.lock:
+            if group not in self.state.groups:
+                return self.send(200 if version == '1' else 400, ocs([], int(version), 102, 'group does not exist'))
+            if user not in self.state.users:
+                return self.send(200 if version == '1' else 400, ocs([], int(version), 103, 'user does not exist'))
+            self.state.groups[group].add(user)
+        self.send(200, ocs([], int(version)))
+
+    def user_group_remove(self, body, version, user):
+        group = self.form(body).get('groupid', '') or parse_qs(urlsplit(self.path).query).get('groupid', [''])[0]
+        with self.state.lock:
+            if group not in self.state.groups:
+                return self.send(200 if version == '1' else 400, ocs([], int(version), 102, 'group does not exist'))
+            self.state.groups[group].discard(user)
+        self.send(200, ocs([], int(version)))
+
+    # --- group folders ---
+
+    def gf_list(self, body):
+        with self.state.lock:
+            folders = {str(fid): {'id': fid, 'mount_point': f['mount_point'], 'groups': dict(f['groups']),
+                                  'quota': f['quota'], 'size': 0, 'acl': f['acl']}
+                       for fid, f in self.state.groupfolders.items()}
+        self.send(200, ocs(folders, 1))
+
+    def gf_create(self, body):
+        mount_point = self.form(body).get('mountpoint', '')
+        with self.state.lock:
+            fid = len(self.state.groupfolders) + 1
+            while fid in self.state.groupfolders:
+                fid += 1
+            self.state.groupfolders[fid] = {'mount_point': mount_point, 'groups': {}, 'quota': -3, 'acl': False}
+            self.state.mkdirs(f"files/{self.state.user}/{mount_point}")
+        self.send(200, ocs({'id': fid}, 1))
+
+    def gf_folder(self, fid):
+        folder = self.state.groupfolders.get(int(fid))
+        if folder is None:
+            self.send(404, ocs([], 1, 404, 'folder not found'))
+        return folder
+
+    def gf_get(self, body, fid):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                self.send(200, ocs({'id': int(fid), **folder}, 1))
+
+    def gf_delete(self, body, fid):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is None:
+                return
+            del self.state.groupfolders[int(fid)]
+            self.state.remove(f"files/{self.state.user}/{folder['mount_point']}")
+        self.send(200, ocs({'success': True}, 1))
+
+    def gf_quota(self, body, fid):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                folder['quota'] = int(self.form(body).get('quota', -3))
+                self.send(200, ocs({'success': True}, 1))
+
+    def gf_acl(self, body, fid):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                folder['acl'] = self.form(body).get('acl') in ('1', 1, True)
+                self.send(200, ocs({'success': True}, 1))
+
+    def gf_group_add(self, body, fid):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                folder['groups'].setdefault(self.form(body).get('group', ''), 31)
+                self.send(200, ocs({'success': True}, 1))
+
+    def gf_group_permissions(self, body, fid, group):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                folder['groups'][group] = int(self.form(body).get('permissions', 31))
+                self.send(200, ocs({'success': True}, 1))
+
+    def gf_group_remove(self, body, fid, group):
+        with self.state.lock:
+            folder = self.gf_folder(fid)
+            if folder is not None:
+                folder['groups'].pop(group, None)
+                self.send(200, ocs({'success': True}, 1))
+
+    # --- shares ---
+
+    def shares_list(self, body):
+        query = parse_qs(urlsplit(self.path).query)
+        path = query.get('path', [None])[0]
+        # subfiles=true lists the shares of the folder's children instead of the folder itself
+        subfiles = query.get('subfiles', ['false'])[0] == 'true'
+        with self.state.lock:
+            shares = [s for s in self.state.shares.values()
+                      if path is None or (s['path'].strip('/').rpartition('/')[0] if subfiles
+                                          else s['path'].strip('/')) == path.strip('/')]
+        self.send(200, ocs(shares))
+
+    def share_create(self, body):
+        form = self.form(body)
+        path = form.get('path', '').strip('/')
+        with self.state.lock:
+            if f"files/{self.state.user}/{path}" not in self.state.nodes:
+                return self.send(404, ocs([], 2, 404, 'Wrong path, file/folder does not exist'))
+            share_id = next(self.state.ids)
+            share = {'id': str(share_id), 'share_type': int(form.get('shareType', 0)), 'path': f"/{path}",
+                     'share_with': form.get('shareWith'), 'permissions': int(form.get('permissions', 31))}
+            self.state.shares[str(share_id)] = share
+        self.send(200, ocs(share))
+
+    def share_update(self, body, share_id):
+        with self.state.lock:
+            share = self.state.shares.get(share_id)
+            if share is None:
+                return self.send(404, ocs([], 2, 404, 'Wrong share ID, share does not exist'))
+            if 'permissions' in (form := self.form(body)):
+                share['permissions'] = int(form['permissions'])
+        self.send(200, ocs(share))
+
+    def share_delete(self, body, share_id):
+        with self.state.lock:
+            if self.state.shares.pop(share_id, None) is None:
+                return self.send(404, ocs([], 2, 404, 'Wrong share ID, share does not exist'))
+        self.send(200, ocs([]))
+
+    # --- circles and collectives ---
+
+    def circle_members(self, body, circle_id):
+        with self.state.lock:
+            circle = self.state.circles.get(circle_id)
+            if circle is None:
+                return self.send(404, ocs([], 2, 404, 'Circle not found'))
+            self.send(200, ocs(list(circle['members'].values())))
+
+    def circle_member_add(self, body, circle_id):
+        form = self.form(body)
+        with self.state.lock:
+            circle = self.state.circles.get(circle_id)
+            if circle is None:
+                return self.send(404, ocs([], 2, 404, 'Circle not found'))
+            member_id = f"m{next(self.state.ids)}"
+            circle['members'][member_id] = {'id': member_id, 'userId': form.get('userId'),
+                                            'userType': int(form.get('type', 1)), 'level': 1}
+            self.send(200, ocs(circle['members'][member_id]))
+
+    def circle_member_level(self, body, circle_id, member_id):
+        with self.state.lock:
+            member = self.state.circles.get(circle_id, {}).get('members', {}).get(member_id)
+            if member is None:
+                return self.send(404, ocs([], 2, 404, 'Member not found'))
+            member['level'] = int(self.form(body).get('level', 1))
+            self.send(200, ocs(member))
+
+    def circle_member_remove(self, body, circle_id, member_id):
+        with self.state.lock:
+            if self.state.circles.get(circle_id, {}).get('members', {}).pop(member_id, None) is None:
+                return self.send(404, ocs([], 2, 404, 'Member not found'))
+        self.send(200, ocs([]))
+
+    def circle_delete(self, body, circle_id):
+        with self.state.lock:
+            if self.state.circles.pop(circle_id, None) is None:
+                return self.send(404, ocs([], 2, 404, 'Circle not found'))
+        self.send(200, ocs([]))
+
+    def collectives_list(self, body):
+        with self.state.lock:
+            collectives = [dict(c) for c in self.state.collectives.values() if not c['trashed']]
+        self.send(200, ocs({'collectives': collectives}))
+
+    def collective_create(self, body):
+        form = self.form(body)
+        name = form.get('name', '')
+        with self.state.lock:
+            if any(c['name'] == name for c in self.state.collectives.values()):
+                return self.send(400, ocs([], 2, 400, 'A collective with this name already exists'))
+            collective_id = next(self.state.ids)
+            circle_id = hashlib.sha1(f"circle{collective_id}".encode()).hexdigest()[:31]
+            self.state.circles[circle_id] = {'name': name, 'members': {}}
+            collective = {'id': collective_id, 'circleId': circle_id, 'name': name, 'emoji': form.get('emoji'),
+                          'editPermissionLevel': 1, 'trashed': False}
+            self.state.collectives[collective_id] = collective
+            readme = self.state.add_file(f"files/{self.state.user}/{self.config.collectives_folder}/{name}/Readme.md")
+            readme.data = f"# {name}\n".encode()
+            readme.size = len(readme.data)
+            self.state.touch(f"files/{self.state.user}/{self.config.collectives_folder}/{name}/Readme.md")
+        self.send(200, ocs({'collective': collective}))
+
+    def collective_edit_level(self, body, collective_id):
+        with self.state.lock:
+            collective = self.state.collectives.get(int(collective_id))
+            if collective is None:
+                return self.send(404, ocs([], 2, 404, 'Collective not found'))
+            collective['editPermissionLevel'] = int(self.form(body).get('level', 1))
+        self.send(200, ocs({'collective': collective}))
+
+    def collective_trash(self, body, collective_id):
+        with self.state.lock:
+            collective = self.state.collectives.get(int(collective_id))
+            if collective is None:
+                return self.send(404, ocs([], 2, 404, 'Collective not found'))
+            collective['trashed'] = True
+        self.send(200, ocs({'collective': collective}))
+
+    def collective_purge(self, body, collective_id):
+        """
+        Deletes a trashed collective; circle and folder go with it.
+        """
+        with self.state.lock:
+            collective = self.state.collectives.get(int(collective_id))
+            if collective is None or not collective['trashed']:
+                return self.send(404, ocs([], 2, 404, 'Collective not found in trash'))
+            del self.state.collectives[int(collective_id)]
+            self.state.circles.pop(collective['circleId'], None)
+            self.state.remove(f"files/{self.state.user}/{self.config.collectives_folder}/{collective['name']}")
+        self.send(200, ocs({'collective': collective}))
+
+    # --- Talk ---
+
+    def rooms_list(self, body):
+        with self.state.lock:
+            self.send(200, ocs(list(self.state.rooms.values())))
+
+    def room_create(self, body):
+        form = self.form(body)
+        with self.state.lock:
+            token = hashlib.sha1(str(next(self.state.ids)).encode()).hexdigest()[:8]
+            room = {'token': token, 'type': form.get('roomType'), 'name': form.get('roomName'),
+                    'displayName': form.get('roomName')}
+            self.state.rooms[token] = room
+        self.send(201, ocs(room))
+
+    def room_get(self, body, token):
+        with self.state.lock:
+            room = self.state.rooms.get(token)
+            if room is None:
+                return self.send(404, ocs([], 2, 404, 'Room not found'))
+            self.send(200, ocs(room))
+
+    def room_delete(self, body, token):
+        with self.state.lock:
+            if self.state.rooms.pop(token, None) is None:
+                return self.send(404, ocs([], 2, 404, 'Room not found'))
+        self.send(200, ocs([]))
+
+    # --- serverinfo ---
+
+    def serverinfo(self, body):
+        with self.state.lock:
+            files = sum(1 for n in self.state.nodes.values() if not n.is_dir)
+            used = sum(n.size for n in self.state.nodes.values() if not n.is_dir)
+            users, groups, shares = len(self.state.users), len(self.state.groups), len(self.state.shares)
+        now = time.time()
+        load = [round(0.5 + 0.3 * abs((now / 60 + i) % 2 - 1), 2) for i in range(3)]
+        self.send(200, ocs({
+            'nextcloud': {
+                'system': {'version': '29.0.0.19', 'freespace': 500 * 1024 ** 3 - used, 'cpuload': load,
+                           'mem_total': 16 * 1024 ** 2, 'mem_free': int(8 * 1024 ** 2 + (now % 600) * 1000),
+                           'swap_total': 4 * 1024 ** 2, 'swap_free': 4 * 1024 ** 2},
+                'storage': {'num_users': users, 'num_files': files, 'num_storages': users + 1,
+                            'num_storages_local': 1, 'num_storages_home': users, 'num_storages_other': 0},
+                'shares': {'num_shares': shares, 'num_shares_groups': shares, 'num_shares_link': 0},
+            },
+            'server': {'webserver': 'mock', 'php': {'version': '8.2.0', 'memory_limit': 536870912},
+                       'database': {'type': 'sqlite', 'version': '3', 'size': 1024 * 1024 + files * 100}},
+            'activeUsers': {'last5minutes': 1, 'last1hour': 1, 'last24hours': users},
+        }))
+
+
+ROUTES = [
+    ('PROPFIND', r'/remote\.php/dav/(.*)', Handler.dav_propfind, 'dav'),
+    ('GET', r'/remote\.php/dav/(.*)', Handler.dav_get, 'dav'),
+    ('HEAD', r'/remote\.php/dav/(.*)', Handler.dav_get, 'dav'),
+    ('PUT', r'/remote\.php/dav/(.*)', Handler.dav_put, 'dav'),
+    ('DELETE', r'/remote\.php/dav/calendars/([^/]+)/([^/]+)/?', Handler.calendar_delete, 'caldav'),
+    ('DELETE', r'/remote\.php/dav/(.*)', Handler.dav_delete, 'dav'),
+    ('MKCOL', r'/remote\.php/dav/(.*)', Handler.dav_mkcol, 'dav'),
+    ('MOVE', r'/remote\.php/dav/(.*)', Handler.dav_move, 'dav'),
+    ('PROPPATCH', r'/remote\.php/dav/(.*)', Handler.dav_proppatch, 'dav'),
+    ('MKCALENDAR', r'/remote\.php/dav/calendars/([^/]+)/([^/]+)/?', Handler.mkcalendar, 'caldav'),
+    ('POST', r'/remote\.php/dav/calendars/([^/]+)/([^/]+)/?', Handler.calendar_share, 'caldav'),
+    ('GET', r'/ocs/v([12])\.php/cloud/groups', Handler.groups_list, 'ocs groups'),
+    ('POST', r'/ocs/v([12])\.php/cloud/groups', Handler.group_create, 'ocs groups'),
+    ('GET', r'/ocs/v([12])\.php/cloud/groups/([^/]+)/users', Handler.group_members, 'ocs groups'),
+    ('DELETE', r'/ocs/v([12])\.php/cloud/groups/([^/]+)', Handler.group_delete, 'ocs groups'),
+    ('GET', r'/ocs/v([12])\.php/cloud/users', Handler.users_list, 'ocs users'),
+    ('GET', r'/ocs/v([12])\.php/cloud/users/([^/]+)/groups', Handler.user_groups, 'ocs users'),
+    ('POST', r'/ocs/v([12])\.php/cloud/users/([^/]+)/groups', Handler.user_group_add, 'ocs users'),
+    ('DELETE', r'/ocs/v([12])\.php/cloud/users/([^/]+)/groups', Handler.user_group_remove, 'ocs users'),
+    ('GET', r'/apps/groupfolders/folders', Handler.gf_list, 'groupfolders'),
+    ('POST', r'/apps/groupfolders/folders', Handler.gf_create, 'groupfolders'),
+    ('GET', r'/apps/groupfolders/folders/(\d+)', Handler.gf_get, 'groupfolders'),
+    ('DELETE', r'/apps/groupfolders/folders/(\d+)', Handler.gf_delete, 'groupfolders'),
+    ('POST', r'/apps/groupfolders/folders/(\d+)/quota', Handler.gf_quota, 'groupfolders'),
+    ('POST', r'/apps/groupfolders/folders/(\d+)/acl', Handler.gf_acl, 'groupfolders'),
+    ('POST', r'/apps/groupfolders/folders/(\d+)/groups', Handler.gf_group_add, 'groupfolders'),
+    ('POST', r'/apps/groupfolders/folders/(\d+)/groups/([^/]+)', Handler.gf_group_permissions, 'groupfolders'),
+    ('DELETE', r'/apps/groupfolders/folders/(\d+)/groups/([^/]+)', Handler.gf_group_remove, 'groupfolders'),
+    ('GET', r'/ocs/v2\.php/apps/files_sharing/api/v1/shares', Handler.shares_list, 'shares'),
+    ('POST', r'/ocs/v2\.php/apps/files_sharing/api/v1/shares', Handler.share_create, 'shares'),
+    ('PUT', r'/ocs/v2\.php/apps/files_sharing/api/v1/shares/(\d+)', Handler.share_update, 'shares'),
+    ('DELETE', r'/ocs/v2\.php/apps/files_sharing/api/v1/shares/(\d+)', Handler.share_delete, 'shares'),
+    ('GET', r'/ocs/v2\.php/apps/circles/circles/([^/]+)/members', Handler.circle_members, 'circles'),
+    ('POST', r'/ocs/v2\.php/apps/circles/circles/([^/]+)/members', Handler.circle_member_add, 'circles'),
+    ('PUT', r'/ocs/v2\.php/apps/circles/circles/([^/]+)/members/([^/]+)/level', Handler.circle_member_level,
+     'circles'),
+    ('DELETE', r'/ocs/v2\.php/apps/circles/circles/([^/]+)/members/([^/]+)', Handler.circle_member_remove,
+     'circles'),
+    ('DELETE', r'/ocs/v2\.php/apps/circles/circles/([^/]+)', Handler.circle_delete, 'circles'),
+    ('GET', r'/ocs/v2\.php/apps/collectives/api/v1\.0/collectives', Handler.collectives_list, 'collectives'),
+    ('POST', r'/ocs/v2\.php/apps/collectives/api/v1\.0/collectives', Handler.collective_create, 'collectives'),
+    ('PUT', r'/ocs/v2\.php/apps/collectives/api/v1\.0/collectives/(\d+)/editLevel', Handler.collective_edit_level,
+     'collectives'),
+    ('DELETE', r'/ocs/v2\.php/apps/collectives/api/v1\.0/collectives/(\d+)', Handler.collective_trash,
+     'collectives'),
+    ('DELETE', r'/ocs/v2\.php/apps/collectives/api/v1\.0/collectives/trash/(\d+)', Handler.collective_purge,
+     'collectives'),
+    ('GET', r'/ocs/v2\.php/apps/spreed/api/v4/room', Handler.rooms_list, 'spreed'),
+    ('POST', r'/ocs/v2\.php/apps/spreed/api/v4/room', Handler.room_create, 'spreed'),
+    ('GET', r'/ocs/v2\.php/apps/spreed/api/v4/room/([^/]+)', Handler.room_get, 'spreed'),
+    ('DELETE', r'/ocs/v2\.php/apps/spreed/api/v4/room/([^/]+)', Handler.room_delete, 'spreed'),
+    ('GET', r'/ocs/v2\.php/apps/serverinfo/api/v1/info', Handler.serverinfo, 'serverinfo'),
+]
+
+
+def build_server(config):
+    """
+    Creates the server with a fresh state; the caller runs serve_forever().
+    """
+    spool_dir = tempfile.mkdtemp(prefix='mock_nextcloud_')
+    state = MockState(config.user, spool_dir)
+    state.mkdirs(f"files/{config.user}/{config.collectives_folder}", BASE_MTIME)
+    state.mkdirs(f"files/{config.user}/{config.backup_folder}", BASE_MTIME)
+    if config.stats_folder:
+        state.mkdirs(f"files/{config.user}/{config.stats_folder}", BASE_MTIME)
+    state.generate_tree(config.collectives_folder, config.collectives, config.files, config.file_size)
+    state.users.update(f"user{i:04d}" for i in range(config.users))
+    handler = type('ConfiguredHandler', (Handler,), {
+        'state': state, 'config': config,
+        'bucket': TokenBucket(config.throttle) if config.throttle else None,
+    })
+    server = ThreadingHTTPServer((config.host, config.port), handler)
+    server.daemon_threads = True
+    server.spool_dir = spool_dir
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline mock of the Nextcloud APIs used by this repo.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--user", default="anchor_user", help="the only user allowed in DAV paths")
+    parser.add_argument("--users", type=int, default=100, help="extra users user0000.. for group memberships")
+    parser.add_argument("--collectives-folder", default="Collectives")
+    parser.add_argument("--backup-folder", default="Backup/Collectives")
+    parser.add_argument("--stats-folder", default="Stats")
+    parser.add_argument("--collectives", type=int, default=10, help="collectives in the generated tree")
+    parser.add_argument("--files", type=int, default=1000, help="files in the generated tree")
+    parser.add_argument("--file-size", type=int, default=2048, help="bytes per generated file")
+    parser.add_argument("--latency", type=float, default=0, help="added latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency up to this many ms")
+    parser.add_argument("--throttle", type=float, default=0,
+                        help="requests per second before answering 429 (0 = never)")
+    parser.add_argument("--no-depth-infinity", dest="depth_infinity", action="store_false",
+                        help="reject PROPFIND with Depth: infinity like a default Nextcloud")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    config = parse_args()
+    server = build_server(config)
+    print(f"Mock Nextcloud on http://{config.host}:{config.port} (user {config.user}, {config.files} files)",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutil.rmtree(server.spool_dir, ignore_errors=True)
@@ -0,0 +1,252 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import tracer
+
+# Connections kept open per host; callers block for a free one beyond that
+NC_HTTP_MAX_CONNECTIONS = int(os.getenv("NC_HTTP_MAX_CONNECTIONS", "16"))
+# Seconds to wait for the server to accept or answer a request
+NC_HTTP_TIMEOUT = float(os.getenv("NC_HTTP_TIMEOUT", "60"))
+NC_HTTP_RETRIES = int(os.getenv("NC_HTTP_RETRIES", "5"))
+# Upper bound of requests per second; 0 = unpaced until the server throttles
+NC_HTTP_RATE = float(os.getenv("NC_HTTP_RATE", "0"))
+# Longest Retry-After honoured in seconds; a longer one fails the request instead of stalling every thread
+NC_HTTP_MAX_RETRY_AFTER = float(os.getenv("NC_HTTP_MAX_RETRY_AFTER", "120"))
+
+RETRY_STATUS = {429, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+# Safe to resend after a connection error or a gateway error
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'PROPFIND', 'PROPPATCH', 'REPORT'}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+
+class AdaptiveRateLimiter:
+    """
+    Paces requests across all threads (AIMD). The rate is halved whenever the
+    server throttles (429/503) and recovers additively on success, up to
+    max_rate. Without a max_rate requests are unpaced until the first
+    throttle, which starts pacing at half the rate observed so far.
+    A Retry-After pauses every caller, not just the one that was throttled.
+    """
+    def __init__(self, max_rate=0, min_rate=0.5):
+        self.max_rate = max_rate if max_rate > 0 else float('inf')
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = self.max_rate
+        self._next = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._observed = 0.0
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._observed = self._window_count / (now - self._window_start)
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            start = max(self._next, now)
+            if self.rate != float('inf'):
+                self._next = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self):
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.rate + 1 / self.rate, self.max_rate)
+
+    def throttle(self, pause=None):
+        with self._lock:
+            now = time.monotonic()
+            # Parallel requests see the same overload; count it as one event per second
+            if now - self._last_decrease >= 1:
+                self._last_decrease = now
+                current = self.rate
+                if current == float('inf'):
+                    current = max(self._observed, self._window_count, self.min_rate)
+                self.rate = max(current / 2, self.min_rate)
+            if pause:
+                self._next = max(self._next, now + pause)
+
+
+def retry_after_seconds(response):
+    """
+    Seconds requested by a Retry-After header (delta or HTTP date), or None.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with jitter: half the delay is fixed, half random.
+    """
+    delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def ocs_data(resp, what):
+    """
+    The data of an OCS JSON response; raises RuntimeError naming what was
+    read if the request failed.
+    """
+    if resp.status_code != 200:
+        raise RuntimeError(f"Could not read {what}: {resp.status_code} {resp.text[:200]}")
+    return resp.json()['ocs']['data']
+
+
+class NextcloudClient:
+    """
+    Shared HTTP client of the scripts: one keep-alive connection pool (capped
+    per host), default timeouts, retries with backoff for throttling, gateway
+    and connection errors, and an adaptive rate limiter. Safe to use from
+    many threads. Paths starting with '/' are resolved against base_url.
+    """
+    def __init__(self, base_url, user, password, max_connections=NC_HTTP_MAX_CONNECTIONS,
+                 timeout=NC_HTTP_TIMEOUT, retries=NC_HTTP_RETRIES, rate=NC_HTTP_RATE,
+                 max_retry_after=NC_HTTP_MAX_RETRY_AFTER):
+        self.base_url = base_url.rstrip('/') if base_url else base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.max_retry_after = max_retry_after
+        self._warned_retry_after = False
+        self.limiter = AdaptiveRateLimiter(rate)
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+        # Nextcloud session cookies would serialize parallel requests on the PHP session lock
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.set_max_connections(max_connections)
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def set_max_connections(self, max_connections):
+        """
+        Caps the open connections per host. Threads that would exceed the cap
+        wait for a free connection, so it must cover every response a caller
+        keeps open at the same time (e.g. streamed downloads).
+        """
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def set_rate(self, rate):
+        """
+        Replaces the rate limiter; rate is the upper bound of requests per
+        second (0 = unpaced until the server throttles).
+        """
+        self.limiter = AdaptiveRateLimiter(rate)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def request(self, method, url, **kwargs):
+        """
+        Like requests.request. Bodies that cannot be replayed (iterators,
+        generators) are sent once; file objects are rewound before a retry.
+        Raises the last requests exception once all retries are used up.
+        A Retry-After above max_retry_after is not waited for: the throttled
+        response is returned and every caller pauses at most max_retry_after.
+        """
+        if url.startswith('/'):
+            url = self.base_url + url
+        kwargs.setdefault('timeout', self.timeout)
+        method = method.upper()
+        data = kwargs.get('data')
+        rewind = data.tell() if hasattr(data, 'seek') and hasattr(data, 'tell') else None
+        replayable = data is None or isinstance(data, (bytes, str, dict, list, tuple)) or rewind is not None
+        retries = self.retries if replayable else 0
+        idempotent = method in IDEMPOTENT_METHODS
+        sent = len(data) if isinstance(data, (bytes, str)) else 0
+        if rewind is not None and hasattr(data, 'fileno'):
+            sent = os.fstat(data.fileno()).st_size - rewind
+
+        attempt = 0
+        while True:
+            if attempt and rewind is not None:
+                data.seek(rewind)
+            self.limiter.acquire()
+            self._count('requests')
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                tracer.http(method, url, None, (time.perf_counter() - start) * 1000, sent, 0, attempt,
+                            type(e).__name__)
+                if attempt >= retries or not idempotent:
+                    self._count('errors')
+                    raise
+                self._count('retries')
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            status = response.status_code
+            tracer.http(method, url, status, (time.perf_counter() - start) * 1000, sent,
+                        int(response.headers.get('Content-Length') or 0), attempt)
+            delay = retry_after_seconds(response) if status in RETRY_STATUS else None
+            if delay is not None and delay > self.max_retry_after:
+                self._warn_retry_after(url, delay)
+            if status in THROTTLE_STATUS:
+                self._count('throttled')
+                self.limiter.throttle(None if delay is None else min(delay, self.max_retry_after))
+            elif status < 500:
+                self.limiter.success()
+            # A throttled request was not processed, so it can be resent whatever the method
+            if (status in RETRY_STATUS and attempt < retries and (idempotent or status in THROTTLE_STATUS)
+                    and (delay is None or delay <= self.max_retry_after)):
+                response.close()
+                self._count('retries')
+                time.sleep(backoff_delay(attempt) if delay is None else delay)
+                attempt += 1
+                continue
+            return response
+
+    def _warn_retry_after(self, url, delay):
+        with self._stats_lock:
+            if self._warned_retry_after:
+                return
+            self._warned_retry_after = True
+        print(f"Warning: the server asked to retry {url} after {delay:.0f}s, more than NC_HTTP_MAX_RETRY_AFTER "
+              f"({self.max_retry_after:.0f}s); giving up on such requests")
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def print_stats(self):
+        s = self.stats
+        rate = 'unpaced' if self.limiter.rate == float('inf') else f"paced at {self.limiter.rate:.1f}/s"
+        print(f"HTTP: {s['requests']} requests, {s['retries']} retries, {s['throttled']} throttled, "
+              f"{s['errors']} failed ({rate})")
@@ -1,34 +1,271 @@
-import requests
+import argparse
 import datetime
+import glob
 import json
 import os
+import signal
+import sys
+import threading
+import time
+from nextcloud_client import NextcloudClient
+from stats_snapshot import DEFAULT_KEYFRAME_INTERVAL, SNAPSHOT_EXTENSION, encode_samples
+from tracing import tracer
 
 NC_URL = os.getenv("NC_URL")
 NC_USER = os.getenv("NC_ANCHOR_USER")
 NC_APP_PW = os.getenv("NC_ANCHOR_APP_PW")
 
 DEST_FOLDER = os.getenv("NC_STATS_DIR")
+# Collector mode (--collect): seconds between samples and how many samples go into one uploaded file
+NC_STATS_INTERVAL = float(os.getenv("NC_STATS_INTERVAL", "60"))
+# hour, day or a number of seconds
+NC_STATS_BATCH = os.getenv("NC_STATS_BATCH", "hour")
+# Local directory that holds samples until their batch is uploaded
+NC_STATS_SPOOL = os.getenv("NC_STATS_SPOOL", "./stats_spool")
+# Batches are uploaded as delta-encoded snapshots (see stats_snapshot.py) or as plain JSON lines
+NC_STATS_FORMAT = os.getenv("NC_STATS_FORMAT", "snapshot")
+# Samples between two full keyframes of a snapshot
+NC_STATS_KEYFRAME_INTERVAL = int(os.getenv("NC_STATS_KEYFRAME_INTERVAL", str(DEFAULT_KEYFRAME_INTERVAL)))
 
 api_url = f"{NC_URL}/ocs/v2.php/apps/serverinfo/api/v1/info?format=json"
 headers = {"OCS-APIRequest": "true"}
+http_client = NextcloudClient(NC_URL, NC_USER, NC_APP_PW)
 
-try:
-    response = requests.get(api_url, auth=(NC_USER, NC_APP_PW), headers=headers)
-    response.raise_for_status()
-    raw_json = response.text  
-except Exception as e:
-    print(f"Fehler beim Abrufen der API: {e}")
-    exit(1)
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+BATCH_PREFIX = "stats_batch_"
+# Microseconds keep the names of a batch sealed at shutdown and the next run's first batch apart
+BATCH_TIME_FORMAT = f"{TIMESTAMP_FORMAT}.%f"
+# A batch still receiving samples; sealed batches drop the suffix and wait for upload
+OPEN_SUFFIX = ".part"
+# Sealed batches that cannot be encoded are renamed with this suffix and skipped
+REJECTED_SUFFIX = ".rejected"
 
-timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-filename = f"stats_raw_{timestamp}.json"
 
-webdav_url = f"{NC_URL}/remote.php/dav/files/{NC_USER}/{DEST_FOLDER}/{filename}"
+def fetch_serverinfo():
+    with tracer.span('fetch_serverinfo'):
+        response = http_client.get(api_url, headers=headers)
+        response.raise_for_status()
+        return response.text
 
-try:
-    upload_res = requests.put(webdav_url, data=raw_json, auth=(NC_USER, NC_APP_PW))
-    upload_res.raise_for_status()
-    print(f"Success! Upload finished: {filename}")
-except Exception as e:
-    print(f"Error during upload: {e}")
 
+def upload_stats(filename, data):
+    webdav_url = f"{NC_URL}/remote.php/dav/files/{NC_USER}/{DEST_FOLDER}/{filename}"
+    with tracer.span('upload_stats', file=filename):
+        upload_res = http_client.put(webdav_url, data=data)
+        upload_res.raise_for_status()
+
+
+def save_once():
+    """
+    One sample, uploaded as its own stats_raw_<timestamp>.json (the cron mode).
+    """
+    try:
+        raw_json = fetch_serverinfo()
+    except Exception as e:
+        print(f"Fehler beim Abrufen der API: {e}")
+        sys.exit(1)
+
+    timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    filename = f"stats_raw_{timestamp}.json"
+    try:
+        upload_stats(filename, raw_json)
+        print(f"Success! Upload finished: {filename}")
+    except Exception as e:
+        print(f"Error during upload: {e}")
+
+
+def encode_batch(data, keyframe_interval=NC_STATS_KEYFRAME_INTERVAL):
+    """
+    Converts the JSON lines of a spooled batch into snapshot bytes.
+    """
+    records = [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+    # The clock may have been set back between samples; snapshots need them in time order
+    samples = sorted(((datetime.datetime.fromisoformat(r['time']).timestamp(), r['serverinfo']) for r in records),
+                     key=lambda sample: sample[0])
+    return encode_samples(samples, keyframe_interval)
+
+
+def batch_key(when, batch=NC_STATS_BATCH):
+    """
+    The batch a sample taken at when (a local datetime) belongs to.
+    """
+    if batch == 'hour':
+        return when.strftime("%Y-%m-%d %H")
+    if batch == 'day':
+        return when.strftime("%Y-%m-%d")
+    return int(when.timestamp() // float(batch))
+
+
+class StatsSpool:
+    """
+    Local buffer of the collector. Samples are appended as JSON lines to the
+    open batch file stats_batch_<first sample time>.jsonl.part and synced to
+    disk one by one. When a sample belongs to the next batch the file is
+    sealed (renamed without .part) and every sealed batch is uploaded, oldest
+    first; a batch is deleted only after its upload succeeded, so a failed
+    upload or a restart delivers it later (at least once). Batch names are
+    unique, so a resent batch replaces its earlier copy instead of adding one.
+    A sample torn by a crash while it was written is dropped when its batch
+    is reopened or sealed at the next start, and a batch that still cannot be
+    encoded is moved aside (.rejected) so it does not block the later ones.
+    """
+    def __init__(self, path, batch=NC_STATS_BATCH, upload_format=NC_STATS_FORMAT):
+        self.path = path
+        self.batch = batch
+        self.upload_format = upload_format
+        os.makedirs(path, exist_ok=True)
+        self.open_file = None
+        self.open_key = None
+        for part in sorted(glob.glob(os.path.join(path, f"{BATCH_PREFIX}*.jsonl{OPEN_SUFFIX}"))):
+            self._drop_torn_line(part)
+            # Continue the batch of a previous run if it is still current, seal older ones
+            key = batch_key(self._started(part), batch)
+            if self.open_file is None and key == batch_key(datetime.datetime.now(), batch):
+                self.open_file, self.open_key = part, key
+            else:
+                self._seal(part)
+
+    @staticmethod
+    def _started(path):
+        name = os.path.basename(path)[len(BATCH_PREFIX):].split('.jsonl')[0]
+        return datetime.datetime.strptime(name, BATCH_TIME_FORMAT)
+
+    @staticmethod
+    def _drop_torn_line(part):
+        """
+        Cuts off the last line of an open batch if it is not a whole JSON
+        sample, so appending continues after the last complete one.
+        """
+        with open(part, 'rb+') as f:
+            data = f.read()
+            start = data.rstrip(b'\n').rfind(b'\n') + 1
+            last = data[start:]
+            if not last.strip():
+                return
+            try:
+                json.loads(last)
+            except ValueError:
+                f.truncate(start)
+                print(f"Warning: dropped a torn sample of {len(last)} bytes at the end of {os.path.basename(part)}")
+                return
+            if not last.endswith(b'\n'):
+                f.write(b'\n')
+
+    def _seal(self, part):
+        os.replace(part, part[:-len(OPEN_SUFFIX)])
+
+    def add(self, when, raw_json):
+        """
+        Appends one sample; seals the open batch first if when starts a new one.
+        """
+        key = batch_key(when, self.batch)
+        if self.open_file is not None and key != self.open_key:
+            self.seal()
+        if self.open_file is None:
+            self.open_file = os.path.join(self.path, f"{BATCH_PREFIX}{when.strftime(BATCH_TIME_FORMAT)}.jsonl{OPEN_SUFFIX}")
+            self.open_key = key
+        record = json.dumps({'time': when.astimezone().isoformat(), 'serverinfo': json.loads(raw_json)},
+                            separators=(',', ':'))
+        with open(self.open_file, 'a', encoding='utf-8') as f:
+            f.write(record + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def seal(self):
+        if self.open_file is not None:
+            self._seal(self.open_file)
+            self.open_file = self.open_key = None
+
+    def sealed(self):
+        return sorted(glob.glob(os.path.join(self.path, f"{BATCH_PREFIX}*.jsonl")))
+
+    def upload_sealed(self):
+        """
+        Uploads the sealed batches, oldest first, and stops at the first
+        failure of encoding or uploading; batches with invalid samples are
+        moved aside instead. Returns the number of batches uploaded.
+        """
+        uploaded = 0
+        for path in self.sealed():
+            with open(path, 'rb') as f:
+                data = f.read()
+            samples = data.count(b'\n')
+            filename = os.path.basename(path)
+            try:
+                if self.upload_format == 'snapshot':
+                    size = len(data)
+                    try:
+                        data = encode_batch(data)
+                    except (ValueError, KeyError, TypeError) as e:
+                        os.replace(path, path + REJECTED_SUFFIX)
+                        print(f"Error: {filename} cannot be encoded, moved aside as {filename}{REJECTED_SUFFIX}: {e}")
+                        continue
+                    filename = filename[:-len('.jsonl')] + SNAPSHOT_EXTENSION
+                    print(f"Encoded {samples} samples: {size / 1024:.1f} KB -> {len(data) / 1024:.1f} KB")
+                upload_stats(filename, data)
+            except Exception as e:
+                print(f"Error during upload of {filename}, kept in the spool: {e}")
+                break
+            os.remove(path)
+            uploaded += 1
+            print(f"Success! Upload finished: {filename} ({samples} samples)")
+        return uploaded
+
+
+def collect(interval=NC_STATS_INTERVAL, batch=NC_STATS_BATCH, spool_path=NC_STATS_SPOOL, stop=None,
+            upload_format=NC_STATS_FORMAT):
+    """
+    Collector mode: samples serverinfo every interval seconds over the shared
+    keep-alive connection and uploads the samples in batches through a
+    StatsSpool. Runs until stop (a threading.Event) is set, then seals and
+    uploads the open batch.
+    """
+    stop = stop or threading.Event()
+    spool = StatsSpool(spool_path, batch, upload_format)
+    print(f"Collecting serverinfo every {interval:g}s, uploading per {batch} to {DEST_FOLDER}")
+    spool.upload_sealed()
+    next_sample = time.monotonic()
+    while not stop.is_set():
+        when = datetime.datetime.now()
+        try:
+            raw_json = fetch_serverinfo()
+        except Exception as e:
+            print(f"Fehler beim Abrufen der API: {e}")
+        else:
+            spool.add(when, raw_json)
+        if spool.sealed():
+            spool.upload_sealed()
+        # Keep the schedule instead of drifting by the time a sample takes, without a burst after a stall
+        next_sample = max(next_sample + interval, time.monotonic())
+        stop.wait(max(next_sample - time.monotonic(), 0))
+    spool.seal()
+    spool.upload_sealed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save Nextcloud serverinfo statistics to NC_STATS_DIR.")
+    parser.add_argument("--collect", action="store_true",
+                        help="keep running and upload the samples in batches instead of one file per sample")
+    parser.add_argument("--interval", type=float, default=NC_STATS_INTERVAL, help="seconds between samples")
+    parser.add_argument("--batch", default=NC_STATS_BATCH,
+                        help="samples per uploaded file: hour, day or a number of seconds")
+    parser.add_argument("--spool", default=NC_STATS_SPOOL, help="local directory for not yet uploaded samples")
+    parser.add_argument("--format", choices=['snapshot', 'jsonl'], default=NC_STATS_FORMAT,
+                        help="file format of the uploaded batches")
+    args = parser.parse_args()
+
+    if not args.collect:
+        save_once()
+        sys.exit(0)
+
+    if args.batch not in ('hour', 'day'):
+        try:
+            if float(args.batch) <= 0:
+                raise ValueError
+        except ValueError:
+            print(f"Invalid batch {args.batch}: use hour, day or a number of seconds")
+            sys.exit(1)
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    collect(args.interval, args.batch, args.spool, stop_event, args.format)
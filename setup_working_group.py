@@ -1,11 +1,21 @@
-import requests
-import caldav
 import os
+import re
 import sys
-import time
+import csv
 import json
-from requests.auth import HTTPBasicAuth
-from webdav3.client import Client
+import time
+import argparse
+import threading
+import contextvars
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+from nextcloud_client import NC_HTTP_MAX_CONNECTIONS, NextcloudClient, ocs_data
+from group_state import GroupStateStore
+from step_graph import StepGraph, poll_until
+from tracing import NC_TRACE_FILE, traced, tracer
 
 
 
@@ -21,26 +31,39 @@ RAW_SUBFOLDERS = os.getenv("NC_SUBFOLDERS")
 SUBFOLDERS = [s.strip() for s in RAW_SUBFOLDERS.split(',')]
 PUB_FOLDER_PREFIX = os.getenv("NC_PUB_FOLDER_PREFIX")
 PRIV_FOLDER_PREFIX = os.getenv("NC_PRIV_FOLDER_PREFIX")
+# Groups provisioned at the same time in batch mode (--manifest)
+NC_SETUP_PARALLEL = int(os.getenv("NC_SETUP_PARALLEL", "4"))
+# Local database of the IDs of everything provisioned per group
+NC_SETUP_STATE_DB = os.getenv("NC_SETUP_STATE_DB", "working_groups.db")
 
-SLEEP_TIME = 0.1
 # ---------------------
 
 
-# Using the Anchor User for all API calls
-auth = HTTPBasicAuth(ANCHOR_USER, ANCHOR_APP_PW)
+# Using the Anchor User for all API calls. The client's rate limiter paces
+# requests and backs off when the server throttles (see nextcloud_client.py)
+http_client = NextcloudClient(NEXTCLOUD_URL, ANCHOR_USER, ANCHOR_APP_PW)
 ocs_headers = {"OCS-APIRequest": "true",               
                "Accept": "application/json"}
 
+_state_store = None
+_state_store_lock = threading.Lock()
 
+def get_state_store():
+    """
+    The local GroupStateStore, opened on first use.
+    """
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = GroupStateStore(NC_SETUP_STATE_DB)
+        return _state_store
 
 
-def sleep():
-    print(f"💤Sleeping a bit...")
-    time.sleep(SLEEP_TIME)
 
 
+@traced()
 def grant_read_access(group_folder, subfolder):
-    resp = requests.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares",auth=auth, headers=ocs_headers, 
+    resp = http_client.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares",headers=ocs_headers, 
                      data={"path": f"{group_folder}/{subfolder}",
                          "shareType": 1,
                          "shareWith": f"{ALL_MEMBERS_GROUP}",
@@ -52,8 +75,9 @@ def grant_read_access(group_folder, subfolder):
     
     return True
 
+@traced()
 def grant_write_access(group_name, group_folder, subfolder):   
-    resp = requests.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares",auth=auth, headers=ocs_headers, 
+    resp = http_client.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares",headers=ocs_headers, 
                      data={"path": f"{group_folder}/{subfolder}",
                         "shareType": 1,
                          "shareWith": f"{group_name}",
@@ -63,65 +87,127 @@ def grant_write_access(group_name, group_folder, subfolder):
         return False
     return True
 
-def grant_acl_access(group_name, group_folder, subfolder, mask, permisisons):
-    headers = {'Content-Type': 'application/xml'} | ocs_headers
-    xml_body=f"""<?xml version="1.0"?>
-        <d:propertyupdate  xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns" xmlns:nc="http://nextcloud.org/ns" xmlns:ocs="http://open-collaboration-services.org/ns">
-          <d:set>
-           <d:prop>
-              <nc:acl-list> 
-              <nc:acl>
-              <nc:acl-mapping-type>group</nc:acl-mapping-type>
-              <nc:acl-mapping-id>{group_name}</nc:acl-mapping-id>
-              <nc:acl-mask>{mask}</nc:acl-mask>
-              <nc:acl-permissions>{permisisons}</nc:acl-permissions></nc:acl></nc:acl-list>
-              </d:prop>
-          </d:set>
-        </d:propertyupdate>"""
-    response = requests.request(
-        "PROPPATCH",
-        f"{NEXTCLOUD_URL}/remote.php/dav/files/anchor_user/{group_folder}/{subfolder}",
-        auth=auth,
-        data=xml_body,
-        headers=headers
-    )
-    
-    if response.status_code in [200, 207]:
-        print("✅ACL erfolgreich gesetzt!")
-    else:
-        print(f"❌ Fehler: {response.status_code} {response.text}")        
+DAV = '{DAV:}'
+OC = '{http://owncloud.org/ns}'
+NC = '{http://nextcloud.org/ns}'
+CALDAV = '{urn:ietf:params:xml:ns:caldav}'
+
+
+def propfind_props(url, depth, props):
+    """
+    PROPFINDs props (XML elements) on url and returns (name, <d:prop>) per
+    response, the requested resource itself first with name ''. Returns
+    None if url does not exist.
+    """
+    body = ('<?xml version="1.0"?><d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns" '
+            f'xmlns:nc="http://nextcloud.org/ns"><d:prop>{props}</d:prop></d:propfind>')
+    resp = http_client.request("PROPFIND", url, data=body,
+                               headers={"Depth": str(depth), 'Content-Type': 'application/xml'})
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 207:
+        raise RuntimeError(f"PROPFIND {url} failed: {resp.status_code} {resp.text[:200]}")
+    results = []
+    for index, response in enumerate(ET.fromstring(resp.content).iter(f'{DAV}response')):
+        name = unquote(response.findtext(f'{DAV}href', '')).rstrip('/').rpartition('/')[2]
+        prop = next((ps.find(f'{DAV}prop') for ps in response.iter(f'{DAV}propstat')
+                     if ' 200 ' in (ps.findtext(f'{DAV}status') or '')), None)
+        results.append(('' if index == 0 else name, prop if prop is not None else ET.Element(f'{DAV}prop')))
+    return results
+
+
+def acl_entries(prop):
+    """
+    The nc:acl-list of a <d:prop> as a set of (type, id, mask, permissions).
+    """
+    return {(acl.findtext(f'{NC}acl-mapping-type'), acl.findtext(f'{NC}acl-mapping-id'),
+             int(acl.findtext(f'{NC}acl-mask') or 0), int(acl.findtext(f'{NC}acl-permissions') or 0))
+            for acl in prop.iter(f'{NC}acl')}
+
+
+def group_acl(group_name, mask, permissions):
+    """
+    ACL entry for a group: mask selects the permission bits the entry
+    decides, permissions holds their values (1 read, 2 update, 4 create,
+    8 delete, 16 share).
+    """
+    return ('group', group_name, mask, permissions)
+
+
+def folder_dav_url(group_folder, subfolder=""):
+    return f"{NEXTCLOUD_URL}/remote.php/dav/files/{ANCHOR_USER}/{group_folder}/{subfolder}"
+
+
+@traced()
+def write_acl(group_folder, subfolder, entries):
+    """
+    Replaces the whole ACL list of group_folder/subfolder ('' = the root)
+    with entries, in one PROPPATCH.
+    """
+    acls = ''.join(f"<nc:acl><nc:acl-mapping-type>{kind}</nc:acl-mapping-type>"
+                   f"<nc:acl-mapping-id>{escape(mapping_id)}</nc:acl-mapping-id>"
+                   f"<nc:acl-mask>{mask}</nc:acl-mask><nc:acl-permissions>{permissions}</nc:acl-permissions></nc:acl>"
+                   for kind, mapping_id, mask, permissions in entries)
+    xml_body = ('<?xml version="1.0"?><d:propertyupdate xmlns:d="DAV:" xmlns:nc="http://nextcloud.org/ns">'
+                f'<d:set><d:prop><nc:acl-list>{acls}</nc:acl-list></d:prop></d:set></d:propertyupdate>')
+    response = http_client.request("PROPPATCH", folder_dav_url(group_folder, subfolder), data=xml_body,
+                                   headers={'Content-Type': 'application/xml'})
+    # A 207 can still carry a failed propstat (e.g. 403 without ACL management rights)
+    statuses = [] if response.status_code != 207 else [
+        ps.findtext(f'{DAV}status') or '' for ps in ET.fromstring(response.content).iter(f'{DAV}propstat')]
+    if response.status_code not in [200, 207] or any(' 200 ' not in status for status in statuses):
+        print(f"❌ Failed to set ACL on {group_folder}/{subfolder}: {response.status_code} {response.text[:200]}")
         return False
     return True
 
-def create_group_folder(group_name):
+
+@traced()
+def read_acls(group_folder):
     """
-    Configures advanced permissions:
-    - Main folder: Readable by everyone, writable by AK group.
-    - Public subfolder: Inherits read access for everyone.
-    - Internal subfolder: Hidden from everyone except the AK group.
+    The ACL entries of the group folder root ('') and of each subfolder, read
+    with a single PROPFIND of nc:acl-list. Returns None if the folder is missing.
     """
-    print(f"Creating group folder...")
-    folder_name = f"{group_name}"
-    folder_req = requests.post(
-        f"{NEXTCLOUD_URL}/apps/groupfolders/folders",
-        auth=auth, headers=ocs_headers, data={"mountpoint": folder_name}
-    )
+    responses = propfind_props(folder_dav_url(group_folder), 1, "<nc:acl-list/>")
+    if responses is None:
+        return None
+    return {name: acl_entries(prop) for name, prop in responses}
 
-    if folder_req.status_code != 200:
-        print("❌ Error: Could not create group folder.")
-        print(f"❌ API Error: Status {folder_req.status_code}")
-        print(f"❌ Response: {folder_req.text}") 
+
+@traced()
+def apply_folder_acls(group_folder, acls, verify=True):
+    """
+    Sets the full ACL lists of several folders in one group folder; acls maps
+    a subfolder name ('' = the root) to its entries. The PROPPATCHes of all
+    folders are sent concurrently, then one PROPFIND verifies the result
+    (skipped with verify=False for temporary ACLs that are replaced later).
+    """
+    graph = StepGraph()
+    for subfolder, entries in acls.items():
+        graph.add(subfolder or "/", lambda subfolder=subfolder, entries=entries:
+                  write_acl(group_folder, subfolder, entries))
+    if not graph.run():
+        return False
+    if not verify:
+        return True
+    try:
+        actual = read_acls(group_folder) or {}
+    except (RuntimeError, ET.ParseError) as e:
+        print(f"❌ Could not read back the ACLs of {group_folder}: {e}")
+        return False
+    wrong = [subfolder or "/" for subfolder, entries in acls.items() if actual.get(subfolder) != set(entries)]
+    if wrong:
+        print(f"❌ ACLs of {group_folder} differ after writing: {', '.join(wrong)}")
         return False
+    print(f"✅ ACLs of {len(acls)} folder(s) in {group_folder} set and verified")
+    return True
 
-    folder_id = folder_req.json()['ocs']['data']['id']
-    print(f"   -> Folder ID: {folder_id}")
-    sleep()
-    # Set Quota
-    quota_bytes = QUOTA_GB * 1024 * 1024 * 1024
-    print(f"   -> Setting quota to {QUOTA_GB} GB in bytes {quota_bytes}...")
-    resp = requests.post(
+
+@traced()
+def set_folder_quota(folder_id, quota_gb):
+    quota_bytes = quota_gb * 1024 * 1024 * 1024
+    print(f"   -> Setting quota to {quota_gb} GB in bytes {quota_bytes}...")
+    resp = http_client.post(
         f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/quota",
-        auth=auth,
         headers=ocs_headers,
         data={"quota": quota_bytes},
         timeout=10
@@ -129,138 +215,201 @@ def create_group_folder(group_name):
     if resp.status_code != 200:
         print(f"❌ Failed to create quota: {resp.text}")
         return False
-    sleep()
-    # 1. Enable ACL support
-    resp = requests.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/acl",
-              auth=auth, headers=ocs_headers, data={"acl": "1"})
+    return True
+
+@traced()
+def enable_folder_acl(folder_id):
+    resp = http_client.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/acl",
+              headers=ocs_headers, data={"acl": "1"})
     if resp.status_code != 200:
         print(f"❌ Failed to enable acl: {resp.text}")
         return False
+    return True
+
+@traced()
+def add_group_to_folder(folder_id, group_name):
     # Set Permissions (31 = All permissions, 1 = Read only)
-    # give anchor_user permission to the groupfolder!!
-    #   
-    print("Add Admin group to groupfolder")   
-    resp = requests.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups",
-                  auth=auth, headers=ocs_headers, data={"group": ADMIN_GROUP})
+    print(f"Add group {group_name} to groupfolder")
+    resp = http_client.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups",
+                  headers=ocs_headers, data={"group": group_name})
     if resp.status_code != 200:
-        print(f"❌ Failed to create premisson to group admin on groupfolder: {resp.text} code: {resp.status_code}")
+        print(f"❌ Failed to add group {group_name} to groupfolder: {resp.text} code: {resp.status_code}")
         return False
-    resp = requests.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups/{ADMIN_GROUP}",
-                  auth=auth, headers=ocs_headers, data={"permissions": 31})
+    resp = http_client.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups/{group_name}",
+                  headers=ocs_headers, data={"permissions": 31})
     if resp.status_code != 200:
         print(f"❌ Failed to set premisson on groupfolder: {resp.text} code: {resp.status_code}")
         return False
-    print("✅ Successfully added Admin group to groupfolder")   
-    # Set Permissions (31 = All permissions, 1 = Read only)
-    # give group permission to the groupfolder!!
-    #      
-    print(f"Add group {group_name} to groupfolder")   
-    resp = requests.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups",
-                  auth=auth, headers=ocs_headers, data={"group": group_name})
-    if resp.status_code != 200:
-        print(f"❌ Failed to create premisson to group admin on groupfolder: {resp.text} code: {resp.status_code}")
-        return False
-    
-    resp = requests.post(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups/{group_name}",
-                  auth=auth, headers=ocs_headers, data={"permissions": 31}) 
+    print(f"✅ Successfully added group {group_name} to groupfolder")
+    return True
+
+@traced()
+def remove_group_from_folder(folder_id, group_name):
+    print(f"Remove group {group_name} from groupfolder")
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups/{group_name}",
+                  headers=ocs_headers)
     if resp.status_code != 200:
-        print(f"❌ Failed to set premisson on groupfolder: {resp.text} code: {resp.status_code}")
+        print(f"❌ Failed to remove group {group_name} from groupfolder: {resp.text} code: {resp.status_code}")
         return False
-    print(f"✅ Successfully added group {group_name} to groupfolder")   
+    print(f"✅ Successfully removed group {group_name} from groupfolder")
+    return True
 
-    if not grant_acl_access(group_name, group_name, "", "30" ,"31"): #write on root for group       
-        print(f"❌ Failed to grant write for group on root")
+@traced()
+def wait_for_folder(folder_url):
+    """
+    Polls the group folder's WebDAV mount until the anchor user can see it;
+    the mount only appears once the anchor user's groups have been applied.
+    """
+    return poll_until(
+        lambda: http_client.request("PROPFIND", folder_url, headers={"Depth": "0"}).status_code == 207,
+        f"the group folder mount {folder_url}")
+
+def subfolder_name_for(group_name, sub):
+    if sub != PUBLIC_SUBFOLDER:
+        return f"{PRIV_FOLDER_PREFIX}_{group_name}_{sub}"
+    return f"{PUB_FOLDER_PREFIX}_{group_name}_{sub}"
+
+@traced()
+def create_subfolder(folder_url, subfolder_name):
+    print(f"   -> Creating subfolder: {subfolder_name}")
+    resp = http_client.request("PROPFIND", f"{folder_url}/{subfolder_name}", headers={"Depth": "0"})
+    if resp.status_code == 207:
+        print(f"Folder '{subfolder_name}' already exists.")
+        return True
+    resp = http_client.request("MKCOL", f"{folder_url}/{subfolder_name}")
+    if resp.status_code != 201:
+        print(f"❌ Failed to create folder '{subfolder_name}': {resp.status_code} {resp.text}")
         return False
-    else:
-        print(f"✅ Grant write for group on root")
-
-    
-    # Create subfolder structure via WebDAV
+    print(f"Successfully created folder: '{subfolder_name}'")
+    return True
 
-    options = {
-        'webdav_hostname': f"{NEXTCLOUD_URL}/remote.php/dav/groupfolders/{ANCHOR_USER}/{folder_name}",
-        'webdav_login': ANCHOR_USER,
-        'webdav_password': ANCHOR_APP_PW,
-    }
+@traced()
+def share_subfolder(group_name, folder_name, sub):
+    """
+    Shares a subfolder with the group, and the public one also read-only with
+    all members; both shares are sent concurrently.
+    """
+    subfolder_name = subfolder_name_for(group_name, sub)
 
-    client = Client(options)
-    for sub in SUBFOLDERS:
-        if sub != PUBLIC_SUBFOLDER:            
-            subfolder_name = f"{PRIV_FOLDER_PREFIX}_{group_name}_{sub}"
-        else:
-            subfolder_name = f"{PUB_FOLDER_PREFIX}_{group_name}_{sub}"
-        print(f"   -> Creating subfolder: {subfolder_name}")
-        if client.check(subfolder_name):
-            print(f"Folder '{subfolder_name}' already exists.")
-        else:
-            client.mkdir(subfolder_name)
-            print(f"Successfully created folder: '{subfolder_name}'")
-        sleep()
-        
-        if not grant_acl_access(group_name, group_name, subfolder_name, "30", "31"): #write on folder for group
-            print(f"❌ Failed to grant write for group to subfolder {subfolder_name}")
-            return False
-        else:
-            print(f"✅ Grant write access for group to subfolder {subfolder_name}")
-        
-        if not grant_write_access(group_name, folder_name,subfolder_name):
-            print(f"❌ Failed to grant write for group to subfolder {subfolder_name}")
-            return False
-        else:
-            print(f"✅ Grant write access for group to subfolder {subfolder_name}")
-        if sub == PUBLIC_SUBFOLDER:            
-            if not grant_read_access(folder_name,subfolder_name):
-                print(f"❌ Failed to grant read access all to sub_folder {subfolder_name}")
+    def step(func, ok_message, failed_message):
+        def run():
+            if not func():
+                print(f"❌ {failed_message}")
                 return False
-            else:
-                print(f"✅ Grant read access for all to subfolder {subfolder_name}")
-        sleep()
+            print(f"✅ {ok_message}")
+            return True
+        return run
+
+    graph = StepGraph()
+    graph.add("write share", step(lambda: grant_write_access(group_name, folder_name, subfolder_name),
+                                  f"Grant write access for group to subfolder {subfolder_name}",
+                                  f"Failed to grant write for group to subfolder {subfolder_name}"))
+    if sub == PUBLIC_SUBFOLDER:
+        graph.add("read share", step(lambda: grant_read_access(folder_name, subfolder_name),
+                                     f"Grant read access for all to subfolder {subfolder_name}",
+                                     f"Failed to grant read access all to sub_folder {subfolder_name}"))
+    return graph.run().ok
+
+@traced()
+def create_group_folder(group_name, quota_gb=QUOTA_GB, subfolders=SUBFOLDERS):
+    """
+    Configures advanced permissions:
+    - Main folder: Readable by everyone, writable by AK group.
+    - Public subfolder: Inherits read access for everyone.
+    - Internal subfolder: Hidden from everyone except the AK group.
+    quota_gb and subfolders default to NC_QUOTA_GB and NC_SUBFOLDERS.
+    Once the folder exists, quota, ACL support and group permissions are set
+    concurrently, all subfolders are created and shared in parallel, and the
+    final ACLs of root and subfolders are written in one batch.
+    """
+    print(f"Creating group folder...")
+    folder_name = f"{group_name}"
+    folder_req = http_client.post(
+        f"{NEXTCLOUD_URL}/apps/groupfolders/folders",
+        headers=ocs_headers, data={"mountpoint": folder_name}
+    )
 
-    if not grant_acl_access(group_name, group_name, "", "30" ,"0"): #deny on root for group       
-        print(f"❌ Failed to grant read for group on root")
-        return False
-    else:
-        print(f"✅ Grant read for group on root")
-	
-    print("Remove Admin group from groupfolder")   
-    resp = requests.delete(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}/groups/{ADMIN_GROUP}",
-                  auth=auth, headers=ocs_headers)
-    if resp.status_code != 200:
-        print(f"❌ Failed to remove admin group from groupfolder: {resp.text} code: {resp.status_code}")
+    if folder_req.status_code != 200:
+        print("❌ Error: Could not create group folder.")
+        print(f"❌ API Error: Status {folder_req.status_code}")
+        print(f"❌ Response: {folder_req.text}") 
         return False
-    print(f"✅ Successfully removed admin group from groupfolder")   
-
-
 
+    folder_id = folder_req.json()['ocs']['data']['id']
+    print(f"   -> Folder ID: {folder_id}")
+    get_state_store().record(group_name, 'folder', folder_id, {'mount_point': folder_name})
+    folder_url = f"{NEXTCLOUD_URL}/remote.php/dav/groupfolders/{ANCHOR_USER}/{folder_name}"
+
+    write = [group_acl(group_name, 30, 31)]
+    read_only = [group_acl(group_name, 30, 0)]
+    names = [subfolder_name_for(group_name, sub) for sub in subfolders]
+
+    graph = StepGraph()
+    graph.add("quota", lambda: set_folder_quota(folder_id, quota_gb))
+    graph.add("acl", lambda: enable_folder_acl(folder_id))
+    # give anchor_user permission to the groupfolder via the admin group, removed again at the end
+    graph.add("admin group", lambda: add_group_to_folder(folder_id, ADMIN_GROUP))
+    graph.add("group", lambda: add_group_to_folder(folder_id, group_name))
+    graph.add("mounted", lambda: wait_for_folder(folder_url), after=["admin group", "group"])
+    # the group may write the root while the subfolders are created
+    graph.add("root write", lambda: apply_folder_acls(folder_name, {"": write}, verify=False), after=["acl", "mounted"])
+    # Create subfolder structure via WebDAV
+    created = [graph.add(f"subfolder {sub}", lambda name=name: create_subfolder(folder_url, name), after=["root write"])
+               for sub, name in zip(subfolders, names)]
+    shared = [graph.add(f"shares {sub}", lambda sub=sub: share_subfolder(group_name, folder_name, sub),
+                        after=[f"subfolder {sub}"])
+              for sub in subfolders]
+    # write on every subfolder, read-only on the root for the group
+    graph.add("acls", lambda: apply_folder_acls(folder_name, {"": read_only, **{name: write for name in names}}),
+              after=created)
+    graph.add("remove admin group", lambda: remove_group_from_folder(folder_id, ADMIN_GROUP), after=["acls", *shared])
+    result = graph.run()
+    if not result:
+        print(f"❌ Group folder steps failed: {', '.join(result.failed)}")
+        return False
+    get_state_store().update_settings(group_name, 'folder', {'quota_gb': quota_gb, 'subfolders': sorted(names),
+                                                             'acl': True})
     return True
-        
-
 
 
+@traced()
 def create_and_share_calendar(calendar_name, share_with_group):
     """
     Creates a new calendar via WebDAV and shares it with a group.
     """
     #Create Calendar via CalDAV
     print(f"Creating calendar in anchor account...")
-    try:
-        client = caldav.DAVClient(f"{NEXTCLOUD_URL}/remote.php/dav", username=ANCHOR_USER, password=ANCHOR_APP_PW)
-        principal = client.principal()
-        cal_id=f"cal_{calendar_name.lower()}"
-        new_cal = principal.make_calendar(name=f"{calendar_name}", cal_id=cal_id)
-        print(f"✅ Calendar created: {new_cal.url}")
-    except Exception as e:
-        print(f"⚠️ Calendar info: {e} (It might already exist)")
-        return False
-    
-    if not share_calendar_with_group(cal_id, group_name, True):
+    cal_id=f"cal_{calendar_name.lower()}"
+    cal_url = f"{NEXTCLOUD_URL}/remote.php/dav/calendars/{ANCHOR_USER}/{cal_id}/"
+    mkcalendar_xml = f"""<?xml version="1.0" encoding="utf-8" ?>
+    <c:mkcalendar xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+      <d:set>
+        <d:prop>
+          <d:displayname>{escape(calendar_name)}</d:displayname>
+        </d:prop>
+      </d:set>
+    </c:mkcalendar>"""
+    resp = http_client.request("MKCALENDAR", cal_url, data=mkcalendar_xml.encode('utf-8'),
+                               headers={'Content-Type': 'application/xml'})
+    if resp.status_code != 201:
+        print(f"⚠️ Calendar info: {resp.status_code} {resp.text} (It might already exist)")
         return False
-    if not share_calendar_with_group(cal_id, ALL_MEMBERS_GROUP, False):
+    print(f"✅ Calendar created: {cal_url}")
+    get_state_store().record(share_with_group, 'calendar', cal_id, {'display_name': calendar_name})
+
+    # Both shares only need the calendar, so they are sent concurrently
+    graph = StepGraph()
+    graph.add("group share", lambda: share_calendar_with_group(cal_id, share_with_group, True))
+    graph.add("all members share", lambda: share_calendar_with_group(cal_id, ALL_MEMBERS_GROUP, False))
+    if not graph.run():
         return False
+    get_state_store().update_settings(share_with_group, 'calendar',
+                                      {'shares': {share_with_group: True, ALL_MEMBERS_GROUP: False}})
     return True
 
 
 
+@traced()
 def share_calendar_with_group(calendar_id, group_name, write_access):
     cal_url = f"{NEXTCLOUD_URL}/remote.php/dav/calendars/{ANCHOR_USER}/{calendar_id}/"
 
@@ -274,8 +423,8 @@ def share_calendar_with_group(calendar_id, group_name, write_access):
       </O:set>
     </O:share>"""
    
-    resp = requests.post(
-        cal_url, auth=auth, data=share_xml,
+    resp = http_client.post(
+        cal_url, data=share_xml,
         headers={'Content-Type': 'text/xml'}
     )
 
@@ -297,8 +446,8 @@ def share_calendar_with_group(calendar_id, group_name, write_access):
       </x4:set>
     </x4:share>"""
    
-    resp = requests.post(
-        cal_url, auth=auth, data=share_xml,
+    resp = http_client.post(
+        cal_url, data=share_xml,
         headers={'Content-Type': 'text/xml'}
     )
 
@@ -311,14 +460,15 @@ def share_calendar_with_group(calendar_id, group_name, write_access):
     return True
 
 
+@traced()
 def create_circle_and_collective(group_name):
     # Note: Circles are the permission layer for Collectives
     # circles are automatically created by collective 
     #print(f"Creating Circle for {group_name}...")
     #circle_name=f"Circle_{group_name}"
-    #circle_resp = requests.post(
+    #circle_resp = http_client.post(
     #    f"{NEXTCLOUD_URL}/ocs/v2.php/apps/circles/circles",
-    #    auth=auth,
+    #    
     #    headers=ocs_headers,
     #    data={
     #        "name": circle_name,
@@ -343,9 +493,8 @@ def create_circle_and_collective(group_name):
     #sleep()
     # Create the Collective
     print(f"Creating Collective '{group_name}'...")
-    resp = requests.post(
+    resp = http_client.post(
         f"{NEXTCLOUD_URL}/ocs/v2.php/apps/collectives/api/v1.0/collectives",
-        auth=auth,
         headers=ocs_headers,
         data={
             "name": group_name,            
@@ -363,14 +512,28 @@ def create_circle_and_collective(group_name):
     circle_id = resp.json()['ocs']['data']['collective']['circleId']
     print(f"✅ Collective created: {collective_id}")
     print(f"✅ Circle created: {circle_id}")
+    get_state_store().record(group_name, 'collective', collective_id, {'circle_id': circle_id})
     
-    sleep()
+    # Edit level and both circle memberships only need the collective
+    graph = StepGraph()
+    graph.add("edit level", lambda: set_collective_edit_level(collective_id, 4))
+    # contributor right to group
+    graph.add("group member", lambda: add_group_to_circle(circle_id, group_name, 4, owner=group_name))
+    # Member right to all
+    graph.add("all members", lambda: add_group_to_circle(circle_id, ALL_MEMBERS_GROUP, 1, owner=group_name))
+    if not graph.run():
+        return False
+    get_state_store().update_settings(group_name, 'collective', {'edit_level': 4})
+    return True
+
+
+@traced()
+def set_collective_edit_level(collective_id, level):
     print(f"set collective to allow only moderators and administrators to edit")
-    resp = requests.put(
+    resp = http_client.put(
         f"{NEXTCLOUD_URL}/ocs/v2.php/apps/collectives/api/v1.0/collectives/{collective_id}/editLevel",
-        auth=auth,
         headers=ocs_headers,
-        data={"level": 4})
+        data={"level": level})
     
 
     if resp.status_code == 200:
@@ -378,27 +541,20 @@ def create_circle_and_collective(group_name):
     else:
         print(f"❌ Failed set edit right to moderators and administrators on collective: {resp.text}")
         return False
-
-    sleep()
-    # contributor right to group
-    if not add_group_to_circle(circle_id,group_name, 4):
-        return False
-    # Member right to all
-    if not add_group_to_circle(circle_id,ALL_MEMBERS_GROUP, 1):
-        return False
-
-
     return True
 
 
-def add_group_to_circle(circle_id, group_name, level):
+@traced()
+def add_group_to_circle(circle_id, group_name, level, owner=None):
+    """
+    With owner (the working group of the circle), the member is recorded in the state store.
+    """
      # Add the Group to the Circle
     print(f"   -> Adding group '{group_name}' to Circle...")
     payload = json.dumps({"userId": group_name,"type":2})
     headers = ocs_headers | {"content-type":"application/json"}    
-    resp = requests.post(
+    resp = http_client.post(
         f"{NEXTCLOUD_URL}/ocs/v2.php/apps/circles/circles/{circle_id}/members",
-        auth=auth,
         headers=headers,
         data=payload
     )
@@ -407,7 +563,6 @@ def add_group_to_circle(circle_id, group_name, level):
     else:
         print(f"❌ Failed to add group to Cricle: {resp.text}")
         return False
-    sleep()
     member_id= resp.json()['ocs']['data']['id']
     print(f"member_id: {member_id}")
     
@@ -415,18 +570,20 @@ def add_group_to_circle(circle_id, group_name, level):
     
     if level == 1:
         print(f"✅ new groups already on level 1 no need to change the level for the group")
-        return True
-    set_grant_level_of_member(circle_id, member_id, level)
-    
+    elif not set_grant_level_of_member(circle_id, member_id, level):
+        return False
+    if owner:
+        get_state_store().record(owner, 'circle_member', member_id, {'circle_id': circle_id, 'level': level},
+                                 name=group_name)
     return True
 
+@traced()
 def set_grant_level_of_member(circle_id, member_id, level):
     # Grant level to member
     print(f"Granting level {level} to member {member_id} of circle {circle_id}")
     headers = ocs_headers | {"content-type":"application/json"} 
-    resp = requests.put(
+    resp = http_client.put(
         f"{NEXTCLOUD_URL}/ocs/v2.php/apps/circles/circles/{circle_id}/members/{member_id}/level",
-        auth=auth,
         headers=headers,
         data=json.dumps({"level": level})
     )
@@ -437,26 +594,32 @@ def set_grant_level_of_member(circle_id, member_id, level):
         return False
     return True
 
+@traced()
 def create_group(group_name):
     # 1. Create the User Group
     print(f"Creating group '{group_name}'...")
-    response = requests.post(
+    response = http_client.post(
         f"{NEXTCLOUD_URL}/ocs/v1.php/cloud/groups",
-        auth=auth, headers=ocs_headers, data={"groupid": group_name}
+        headers=ocs_headers, data={"groupid": group_name}
     )
 
     if response.status_code == 200:
         print(f"✅ Group created: {group_name}")
+        get_state_store().record(group_name, 'group', group_name)
     else:
         print("❌ Error: Could not create group folder.")
         print(f"❌ API Error: Status {response.status_code}")
         return False
-    sleep()
     # 2. Add Anchor User to the new group (Safety net)
+    return add_anchor_to_group(group_name)
+
+
+@traced()
+def add_anchor_to_group(group_name):
     print(f"Adding anchor user to '{group_name}'...")
-    response = requests.post(
+    response = http_client.post(
         f"{NEXTCLOUD_URL}/ocs/v1.php/cloud/users/{ANCHOR_USER}/groups",
-        auth=auth, headers=ocs_headers, data={"groupid": group_name}
+        headers=ocs_headers, data={"groupid": group_name}
     )
     if response.status_code == 200:
         print(f"✅ Added anchor_user to the group")
@@ -467,10 +630,11 @@ def create_group(group_name):
     return True
 
 
+@traced()
 def create_talk_room(group_name):
     print(f"Creating Talk room for group '{group_name}'...")
     headers = ocs_headers | {"content-type":"application/json"}    
-    resp = requests.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/spreed/api/v4/room",auth=auth, headers=headers, 
+    resp = http_client.post(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/spreed/api/v4/room",headers=headers, 
                      data=json.dumps({"roomType": 2, 
                                       "roomName": group_name,
                                       "listable":1,
@@ -481,60 +645,1024 @@ def create_talk_room(group_name):
     else:
         print(f"❌ Failed to create Talk room for group: {resp.text}")
         return False
+    token = resp.json()['ocs']['data']['token']
+    get_state_store().record(group_name, 'talk_room', token, {'name': group_name})
     return True    
 
 
 
 
 
-def run_group_setup(group_name):
+@traced()
+def run_group_setup(group_name, quota_gb=QUOTA_GB, subfolders=SUBFOLDERS, report=None):
     """
     Automates the creation of a Nextcloud group, group folder with subfolders,
     and a shared calendar owned by the anchor user.
+    Everything after the group itself only depends on the group, so folder,
+    collective, calendar and Talk room are created concurrently.
+    If a report dict is given, the steps that failed are stored in report['failed_step'].
     """
     if len(group_name) < 3:
         print(f"\n💥 Group name too short.")
+        if report is not None:
+            report['failed_step'] = "name"
         return
 
     print(f"🚀 Starting automation for: {group_name}")
-    result = create_group(group_name)    
-    
-    if not result:
-        print("❌ Stopping setup due to group creation failure.")
+    graph = StepGraph()
+    graph.add("group", lambda: create_group(group_name))
+    graph.add("folder", lambda: create_group_folder(group_name, quota_gb, subfolders), after=["group"])
+    graph.add("collective", lambda: create_circle_and_collective(group_name), after=["group"])
+    graph.add("calendar", lambda: create_and_share_calendar(group_name, group_name), after=["group"])
+    graph.add("talk room", lambda: create_talk_room(group_name), after=["group"])
+    result = graph.run()
+    for step in result.failed:
+        print(f"❌ Setup failed due to {step} creation failure.")
+    if result.skipped:
+        print(f"❌ Skipped: {', '.join(result.skipped)}")
+    if report is not None and result.failed:
+        report['failed_step'] = ', '.join(result.failed)
+    return result.ok
+
+
+# --- BATCH MODE ---
+
+class GroupOutput:
+    """
+    Replaces sys.stdout while steps and groups run concurrently: every
+    thread's output is buffered up to the end of the line and written with
+    the prefix of the group being worked on, so lines never mix. The prefix is a context variable, so the step threads of a
+    group (see step_graph.py) inherit it.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.prefix = contextvars.ContextVar('output_prefix', default='')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', '') + text
+        *lines, self.local.buffer = buffer.split('\n')
+        if lines:
+            prefix = self.prefix.get()
+            with self.lock:
+                self.stream.write(''.join(f"{prefix}{line}\n" for line in lines))
+        return len(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', ''):
+            self.write('\n')
+        self.stream.flush()
+
+
+def line_buffered_output():
+    """
+    Installs GroupOutput as sys.stdout, unless it already is, and returns it.
+    """
+    if not isinstance(sys.stdout, GroupOutput):
+        sys.stdout = GroupOutput(sys.stdout)
+    return sys.stdout
+
+
+def parse_subfolders(value):
+    """
+    Subfolders of a manifest entry: a list, or a string separated by commas or semicolons.
+    """
+    if isinstance(value, str):
+        value = re.split(r'[,;]', value)
+    return [str(s).strip() for s in value if str(s).strip()]
+
+
+def load_group_manifest(path):
+    """
+    Reads the groups to provision from a CSV or YAML manifest. CSV needs a
+    header with a name column; quota_gb and subfolders columns are optional
+    and fall back to NC_QUOTA_GB and NC_SUBFOLDERS when empty:
+
+        name,quota_gb,subfolders
+        AK_Strategy,20,
+        AK_Events,,"Oeffentlich;Internal;Fotos"
+
+    YAML (needs PyYAML) is a list of entries with the same keys, optionally
+    under a top-level 'groups' key. Returns a list of dicts with name,
+    quota_gb and subfolders; raises ValueError for invalid manifests.
+    """
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("YAML manifests need the PyYAML package (pip install pyyaml)")
+        with open(path, encoding='utf-8') as f:
+            rows = yaml.safe_load(f) or []
+        if isinstance(rows, dict):
+            rows = rows.get('groups') or []
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+
+    groups = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        if isinstance(row, str):
+            row = {'name': row}
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise ValueError(f"Entry {number} has no name")
+        if name in seen:
+            raise ValueError(f"Group {name} is listed twice")
+        seen.add(name)
+        quota = row.get('quota_gb')
+        subfolders = row.get('subfolders')
+        try:
+            quota_gb = int(quota) if quota not in (None, '') else QUOTA_GB
+        except ValueError:
+            raise ValueError(f"Group {name}: invalid quota_gb {quota!r}")
+        groups.append({
+            'name': name,
+            'quota_gb': quota_gb,
+            'subfolders': parse_subfolders(subfolders) if subfolders else SUBFOLDERS,
+        })
+    return groups
+
+
+def provision_groups(groups, parallel=NC_SETUP_PARALLEL):
+    """
+    Runs run_group_setup for every manifest entry, up to `parallel` groups at
+    a time. A failing group does not stop the others. Returns one result dict
+    (name, ok, seconds, failed_step, error) per group, in manifest order.
+    """
+    output = line_buffered_output()
+
+    def provision(group):
+        token = output.prefix.set(f"[{group['name']}] ")
+        result = {'name': group['name'], 'ok': False, 'failed_step': None, 'error': None}
+        start = time.monotonic()
+        try:
+            result['ok'] = bool(run_group_setup(group['name'], group['quota_gb'], group['subfolders'], result))
+        except Exception as e:
+            print(f"💥 {type(e).__name__}: {e}")
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['seconds'] = round(time.monotonic() - start, 3)
+        output.flush()
+        output.prefix.reset(token)
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(min(parallel, len(groups)), 1)) as pool:
+        futures = {pool.submit(provision, group): group['name'] for group in groups}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return [results[group['name']] for group in groups]
+
+
+def print_report(results, seconds, path=None):
+    """
+    Prints one line per group and the overall throughput; with path, the
+    results are also written there as JSON.
+    """
+    print(f"\n{'group':<30} {'result':<8} {'seconds':>8}  failed step")
+    for r in results:
+        reason = r['failed_step'] or r['error'] or ''
+        print(f"{r['name'][:30]:<30} {'ok' if r['ok'] else 'FAILED':<8} {r['seconds']:>8.1f}  {reason}")
+    succeeded = sum(r['ok'] for r in results)
+    rate = len(results) / seconds * 60 if seconds else 0
+    print(f"\n{succeeded} of {len(results)} groups provisioned in {seconds:.1f}s ({rate:.1f} groups/min)")
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'seconds': round(seconds, 3), 'succeeded': succeeded, 'groups': results}, f, indent=1)
+        print(f"Report written to {path}")
+
+
+# --- RECONCILE ---
+
+PLAN_SYMBOLS = {'create': '+', 'update': '~', 'delete': '-', 'archive': '>'}
+
+
+class PlanStep(namedtuple('PlanStep', ['group', 'name', 'action', 'description', 'run', 'after'])):
+    """
+    One operation of a reconcile or teardown plan; action is create, update,
+    delete or archive, and after names the steps of the same group it has to
+    wait for.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return f"{self.group}: {self.name}"
+
+
+def folder_group_permissions(folder):
+    """
+    Group -> permissions of a group folder; newer groupfolders versions
+    return a dict per group instead of the bare permissions.
+    """
+    groups = folder.get('groups') or {}
+    return {group: int(value['permissions'] if isinstance(value, dict) else value)
+            for group, value in groups.items()}
+
+
+def run_concurrently(calls):
+    """
+    Runs a dict of name -> function concurrently and returns name -> result;
+    the first exception is raised once all calls are done.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(calls), 1)) as pool:
+        futures = {name: pool.submit(contextvars.copy_context().run, call) for name, call in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+@traced()
+def fetch_server_state():
+    """
+    Reads everything reconciling needs that is not specific to one group in
+    six concurrent bulk calls: all groups, the anchor user's groups, all group
+    folders, collectives and Talk rooms, and the anchor's calendars together
+    with their sharees.
+    """
+    def groups():
+        return set(ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v1.php/cloud/groups", headers=ocs_headers),
+                            "groups")['groups'])
+
+    def anchor_groups():
+        return set(ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v1.php/cloud/users/{ANCHOR_USER}/groups",
+                                            headers=ocs_headers), "anchor user groups")['groups'])
+
+    def folders():
+        data = ocs_data(http_client.get(f"{NEXTCLOUD_URL}/apps/groupfolders/folders", headers=ocs_headers),
+                        "group folders")
+        return {f['mount_point']: f for f in (data.values() if isinstance(data, dict) else data)}
+
+    def collectives():
+        data = ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/collectives/api/v1.0/collectives",
+                                        headers=ocs_headers), "collectives")
+        return {c['name']: c for c in data['collectives']}
+
+    def rooms():
+        data = ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/spreed/api/v4/room", headers=ocs_headers),
+                        "Talk rooms")
+        return {r['name']: r for r in data}
+
+    def calendars():
+        # calendar id -> {sharee href: writable}
+        responses = propfind_props(f"{NEXTCLOUD_URL}/remote.php/dav/calendars/{ANCHOR_USER}/", 1,
+                                   "<d:resourcetype/><oc:invite/>")
+        return {name: {user.findtext(f'{DAV}href'): user.find(f'{OC}access/{OC}read-write') is not None
+                       for user in prop.iter(f'{OC}user')}
+                for name, prop in responses or []
+                if name and prop.find(f'{DAV}resourcetype/{CALDAV}calendar') is not None}
+
+    return run_concurrently({'groups': groups, 'anchor_groups': anchor_groups, 'folders': folders,
+                             'collectives': collectives, 'rooms': rooms, 'calendars': calendars})
+
+
+@traced()
+def fetch_recorded_state(group_name):
+    """
+    The fetch_server_state entries of one group, found by the IDs in the state
+    store with one direct lookup per recorded resource instead of the bulk
+    listings: the group's members (which also tell whether the anchor user is
+    one), the group folder, the circle members of the collective, the calendar
+    with its sharees and the Talk room. Returns (server, members), members in
+    the form of fetch_group_state, or None if nothing is recorded for the group
+    or a recorded resource is gone; the caller then falls back to the bulk scan.
+    """
+    rows = {(row['kind'], row['name']): row for row in get_state_store().resources(group_name)}
+    if not rows:
+        return None
+
+    def found(resp, what):
+        return None if resp.status_code == 404 else ocs_data(resp, what)
+
+    calls = {'group': lambda: found(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/groups/{group_name}/users",
+                                                    headers=ocs_headers), "group members")}
+    folder = rows.get(('folder', ''))
+    if folder is not None:
+        calls['folder'] = lambda: found(http_client.get(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder['id']}",
+                                                        headers=ocs_headers), "group folder")
+    collective = rows.get(('collective', ''))
+    if collective is not None:
+        calls['collective'] = lambda: found(http_client.get(
+            f"{NEXTCLOUD_URL}/ocs/v2.php/apps/circles/circles/{collective['settings']['circle_id']}/members",
+            headers=ocs_headers), "circle members")
+    calendar = rows.get(('calendar', ''))
+    if calendar is not None:
+        calls['calendar'] = lambda: propfind_props(
+            f"{NEXTCLOUD_URL}/remote.php/dav/calendars/{ANCHOR_USER}/{calendar['id']}/", 0, "<oc:invite/>")
+    room = rows.get(('talk_room', ''))
+    if room is not None:
+        calls['talk room'] = lambda: found(http_client.get(
+            f"{NEXTCLOUD_URL}/ocs/v2.php/apps/spreed/api/v4/room/{room['id']}", headers=ocs_headers), "Talk room")
+    results = run_concurrently(calls)
+    stale = [name for name, result in results.items() if result is None and (name != 'group' or ('group', '') in rows)]
+    if stale or (folder is not None and results['folder'].get('mount_point') != group_name):
+        print(f"⚠️ Recorded {', '.join(stale) or 'folder'} of {group_name} no longer exists")
+        return None
+
+    server = {'groups': set(), 'anchor_groups': set(), 'folders': {}, 'collectives': {}, 'rooms': {}, 'calendars': {}}
+    if results['group'] is not None:
+        server['groups'].add(group_name)
+        if ANCHOR_USER in results['group']['users']:
+            server['anchor_groups'].add(group_name)
+    if folder is not None:
+        server['folders'][group_name] = results['folder']
+    members = None
+    if collective is not None:
+        server['collectives'][group_name] = {'id': collective['id'], 'name': group_name,
+                                             'circleId': collective['settings']['circle_id'],
+                                             'editPermissionLevel': collective['settings'].get('edit_level')}
+        members = {member['userId']: member for member in results['collective'] if member.get('userType') == 2}
+    if calendar is not None:
+        prop = results['calendar'][0][1]
+        server['calendars'][calendar['id']] = {user.findtext(f'{DAV}href'): user.find(f'{OC}access/{OC}read-write')
+                                               is not None for user in prop.iter(f'{OC}user')}
+    if room is not None:
+        server['rooms'][group_name] = results['talk room']
+    return server, members
+
+
+def resolve_server_state(group_names, parallel=NC_SETUP_PARALLEL):
+    """
+    fetch_server_state for the given groups only: groups with rows in the state
+    store are looked up by their recorded IDs (fetch_recorded_state), and the
+    six bulk listings are only read if a group is not recorded or its rows are
+    stale. Returns (server, members), members mapping the groups looked up
+    directly to their circle members.
+    """
+    with ThreadPoolExecutor(max_workers=max(min(parallel, len(group_names)), 1)) as pool:
+        recorded = dict(zip(group_names, pool.map(
+            lambda name: contextvars.copy_context().run(fetch_recorded_state, name), group_names)))
+    unresolved = [name for name, found in recorded.items() if found is None]
+    if unresolved:
+        print(f"Reading the server state in bulk for {len(unresolved)} unrecorded or stale group(s)...")
+        server = fetch_server_state()
+    else:
+        server = {'groups': set(), 'anchor_groups': set(), 'folders': {}, 'collectives': {}, 'rooms': {},
+                  'calendars': {}}
+    members = {}
+    for name, found in recorded.items():
+        if found is None:
+            continue
+        group_server, members[name] = found
+        for key, value in group_server.items():
+            server[key].update(value)
+    return server, members
+
+
+@traced()
+def fetch_group_state(group_name, server, members=None):
+    """
+    Reads the per-group state concurrently: one PROPFIND with the ACLs of the
+    group folder and all its subfolders, one call for the shares below it and
+    one for the circle members unless they are given. Returns a dict with acls
+    (folder name -> ACL entries, '' = root), shares ((folder name, sharee) ->
+    share) and members (group -> circle member).
+    """
+    calls = {}
+    if group_name in server['folders']:
+        calls['acls'] = lambda: read_acls(group_name) or {}
+        calls['shares'] = lambda: {
+            (share['path'].rstrip('/').rpartition('/')[2], share['share_with']): share
+            for share in list_folder_shares(group_name)}
+    if group_name in server['collectives'] and members is None:
+        circle_id = server['collectives'][group_name]['circleId']
+        calls['members'] = lambda: {
+            member['userId']: member
+            for member in ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/circles/circles/{circle_id}/members",
+                                                   headers=ocs_headers), "circle members")
+            if member.get('userType') == 2}
+    state = {'acls': {}, 'shares': {}, 'members': members or {}}
+    state.update(run_concurrently(calls))
+    return state
+
+
+def list_folder_shares(group_folder):
+    """
+    All shares of the files and folders directly below a group folder, in one call.
+    """
+    return ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares",
+                                    headers=ocs_headers, params={"path": f"/{group_folder}", "subfiles": "true"}),
+                    "shares")
+
+
+@traced()
+def update_share_permissions(share_id, permissions):
+    resp = http_client.put(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares/{share_id}",
+                           headers=ocs_headers, data={"permissions": permissions})
+    if resp.status_code != 200:
+        print(f"❌ Failed to update share {share_id}: {resp.text}")
         return False
+    print(f"✅ Share {share_id} set to permissions {permissions}")
+    return True
 
-    result = create_group_folder(group_name)
 
-    if not result:
-        print("❌ Stopping setup due to folder creation failure.")
+def plan_group(group_name, quota_gb, subfolders, server, state):
+    """
+    Compares one group's desired structure with the fetched state and returns
+    the PlanSteps that create what is missing and fix what drifted.
+    """
+    steps = []
+
+    def add(name, action, description, run, after=()):
+        steps.append(PlanStep(group_name, name, action, description, run,
+                              tuple(f"{group_name}: {a}" for a in after if a)))
+        return name
+
+    base = []
+    if group_name not in server['groups']:
+        base = [add("group", 'create', f"group {group_name}", lambda: create_group(group_name))]
+    elif group_name not in server['anchor_groups']:
+        base = [add("anchor", 'update', f"add {ANCHOR_USER} to group {group_name}",
+                    lambda: add_anchor_to_group(group_name))]
+
+    folder = server['folders'].get(group_name)
+    if folder is None:
+        add("folder", 'create', f"group folder {group_name} with {len(subfolders)} subfolders",
+            lambda: create_group_folder(group_name, quota_gb, subfolders), base)
+    else:
+        plan_folder(add, base, group_name, folder, quota_gb, subfolders, state)
+
+    collective = server['collectives'].get(group_name)
+    if collective is None:
+        add("collective", 'create', f"collective {group_name} with its circle members",
+            lambda: create_circle_and_collective(group_name), base)
+    else:
+        collective_id, circle_id = collective['id'], collective['circleId']
+        if collective.get('editPermissionLevel') != 4:
+            add("edit level", 'update', "only moderators and administrators may edit the collective",
+                lambda: set_collective_edit_level(collective_id, 4), base)
+        for member_group, level in ((group_name, 4), (ALL_MEMBERS_GROUP, 1)):
+            member = state['members'].get(member_group)
+            if member is None:
+                add(f"member {member_group}", 'create', f"circle member {member_group} at level {level}",
+                    lambda g=member_group, l=level: add_group_to_circle(circle_id, g, l, owner=group_name), base)
+            elif member['level'] != level:
+                add(f"member {member_group}", 'update',
+                    f"circle level of {member_group} from {member['level']} to {level}",
+                    lambda m=member['id'], l=level: set_grant_level_of_member(circle_id, m, l), base)
+
+    cal_id = f"cal_{group_name.lower()}"
+    calendar_shares = server['calendars'].get(cal_id)
+    if calendar_shares is None:
+        add("calendar", 'create', f"calendar {cal_id} shared with {group_name} and {ALL_MEMBERS_GROUP}",
+            lambda: create_and_share_calendar(group_name, group_name), base)
+    else:
+        for share_group, write in ((group_name, True), (ALL_MEMBERS_GROUP, False)):
+            href = f"principal:principals/groups/{share_group}"
+            if href not in calendar_shares or (write and not calendar_shares[href]):
+                add(f"calendar share {share_group}", 'create' if href not in calendar_shares else 'update',
+                    f"{'read-write' if write else 'read'} calendar share for {share_group}",
+                    lambda g=share_group, w=write: share_calendar_with_group(cal_id, g, w), base)
+
+    if group_name not in server['rooms']:
+        add("talk room", 'create', f"Talk room {group_name}", lambda: create_talk_room(group_name), base)
+    return steps
+
+
+def plan_folder(add, base, group_name, folder, quota_gb, subfolders, state):
+    """
+    Plans the drift fixes of an existing group folder. ACL changes and new
+    subfolders run while the admin group has access, like in create_group_folder,
+    and all ACL changes are written in one apply_folder_acls batch.
+    """
+    folder_id = folder['id']
+    folder_url = f"{NEXTCLOUD_URL}/remote.php/dav/groupfolders/{ANCHOR_USER}/{group_name}"
+    permissions = folder_group_permissions(folder)
+    acls = state['acls']
+
+    if int(folder.get('quota', -3)) != quota_gb * 1024 * 1024 * 1024:
+        add("quota", 'update', f"quota to {quota_gb} GB", lambda: set_folder_quota(folder_id, quota_gb), base)
+    enable_acl = None
+    if not folder.get('acl'):
+        enable_acl = add("acl", 'update', "enable ACL support", lambda: enable_folder_acl(folder_id), base)
+    folder_group = None
+    if permissions.get(group_name) != 31:
+        folder_group = add("folder group", 'update', f"full access for {group_name} to the group folder",
+                           lambda: add_group_to_folder(folder_id, group_name), base)
+
+    write = [group_acl(group_name, 30, 31)]
+    read_only = [group_acl(group_name, 30, 0)]
+    names = {sub: subfolder_name_for(group_name, sub) for sub in subfolders}
+    missing = [sub for sub in subfolders if names[sub] not in acls]
+    drifted = [sub for sub in subfolders if names[sub] in acls and acls[names[sub]] != set(write)]
+    needs_access = missing or drifted or acls.get('') != set(read_only)
+
+    access = None
+    if needs_access and ADMIN_GROUP not in permissions:
+        access = add("admin group", 'update', f"temporary access for {ADMIN_GROUP} to the group folder",
+                     lambda: add_group_to_folder(folder_id, ADMIN_GROUP), base)
+    acl_after = [*base, access, enable_acl, folder_group]
+    acl_steps = []
+    if missing:
+        root_write = add("root write", 'update', f"allow {group_name} to write the root while subfolders are created",
+                         lambda: apply_folder_acls(group_name, {"": write}, verify=False), acl_after)
+        acl_steps += [add(f"subfolder {sub}", 'create', f"subfolder {names[sub]}",
+                          lambda name=names[sub]: create_subfolder(folder_url, name), [root_write])
+                      for sub in missing]
+    if needs_access:
+        changed = [names[sub] for sub in missing + drifted]
+        description = f"ACLs: root read-only for {group_name}" + (
+            f", write on {', '.join(changed)}" if changed else "")
+        acl_steps.append(add("acls", 'update', description,
+                             lambda: apply_folder_acls(group_name, {"": read_only, **{name: write for name in changed}}),
+                             acl_after + acl_steps))
+    if needs_access or ADMIN_GROUP in permissions:
+        add("remove admin group", 'delete', f"access of {ADMIN_GROUP} to the group folder",
+            lambda: remove_group_from_folder(folder_id, ADMIN_GROUP), [*base, access, *acl_steps])
+
+    for sub in subfolders:
+        after = [*base, f"subfolder {sub}" if sub in missing else None]
+        wanted = [(group_name, 31, lambda name=names[sub]: grant_write_access(group_name, group_name, name))]
+        if sub == PUBLIC_SUBFOLDER:
+            wanted.append((ALL_MEMBERS_GROUP, 17, lambda name=names[sub]: grant_read_access(group_name, name)))
+        for sharee, share_permissions, create in wanted:
+            share = state['shares'].get((names[sub], sharee))
+            if share is None:
+                add(f"share {sub} {sharee}", 'create', f"share of {names[sub]} with {sharee}", create, after)
+            elif int(share['permissions']) != share_permissions:
+                add(f"share {sub} {sharee}", 'update',
+                    f"share of {names[sub]} with {sharee} from permissions {share['permissions']} to {share_permissions}",
+                    lambda share_id=share['id'], p=share_permissions: update_share_permissions(share_id, p), base)
+
+
+def observed_resources(group_name, server, state):
+    """
+    The state store rows (kind, resource_id, settings, name) of one group as
+    found by fetch_server_state and fetch_group_state.
+    """
+    resources = []
+    if group_name in server['groups']:
+        resources.append(('group', group_name, {'anchor_member': group_name in server['anchor_groups']}, ''))
+    folder = server['folders'].get(group_name)
+    if folder is not None:
+        quota = int(folder.get('quota', -3))
+        resources.append(('folder', folder['id'], {
+            'mount_point': group_name, 'quota_gb': quota // (1024 * 1024 * 1024) if quota >= 0 else None,
+            'acl': bool(folder.get('acl')), 'groups': folder_group_permissions(folder),
+            'subfolders': sorted(name for name in state['acls'] if name)}, ''))
+    collective = server['collectives'].get(group_name)
+    if collective is not None:
+        resources.append(('collective', collective['id'], {'circle_id': collective['circleId'],
+                                                            'edit_level': collective.get('editPermissionLevel')}, ''))
+        for member_group, member in state['members'].items():
+            resources.append(('circle_member', member['id'], {'circle_id': collective['circleId'],
+                                                              'level': member['level']}, member_group))
+    cal_id = f"cal_{group_name.lower()}"
+    if cal_id in server['calendars']:
+        shares = {href.rpartition('/')[2]: writable for href, writable in server['calendars'][cal_id].items()}
+        resources.append(('calendar', cal_id, {'display_name': group_name, 'shares': shares}, ''))
+    room = server['rooms'].get(group_name)
+    if room is not None:
+        resources.append(('talk_room', room['token'], {'name': group_name}, ''))
+    return resources
+
+
+def fetch_states(groups, parallel=NC_SETUP_PARALLEL, recorded=True):
+    """
+    Reads the server and per-group state of all groups and stores what was
+    found in the state store, replacing each group's rows. With recorded, the
+    server state comes from resolve_server_state, otherwise everything is read
+    in bulk. Returns (server, states), states in the order of groups.
+    """
+    if recorded:
+        server, members = resolve_server_state([g['name'] for g in groups], parallel)
+    else:
+        server, members = fetch_server_state(), {}
+    with ThreadPoolExecutor(max_workers=max(min(parallel, len(groups)), 1)) as pool:
+        states = list(pool.map(lambda g: contextvars.copy_context().run(fetch_group_state, g['name'], server,
+                                                                        members.get(g['name'])), groups))
+    store = get_state_store()
+    for group, state in zip(groups, states):
+        store.replace_group(group['name'], observed_resources(group['name'], server, state))
+    return server, states
+
+
+def print_state(group_names=None):
+    """
+    Prints the recorded resources of the given groups (default: all).
+    """
+    store = get_state_store()
+    names = group_names or store.groups()
+    print(f"{'group':<24} {'kind':<14} {'name':<16} {'id':<34} settings")
+    for group_name in names:
+        rows = store.resources(group_name)
+        if not rows:
+            print(f"{group_name[:24]:<24} (nothing recorded)")
+        for row in rows:
+            print(f"{row['group'][:24]:<24} {row['kind']:<14} {row['name'][:16]:<16} {str(row['id'])[:34]:<34} "
+                  f"{json.dumps(row['settings'], sort_keys=True)}")
+
+
+def print_plan(groups, steps, unchanged="up to date"):
+    by_group = {}
+    for step in steps:
+        by_group.setdefault(step.group, []).append(step)
+    for group in groups:
+        group_steps = by_group.get(group['name'])
+        if not group_steps:
+            print(f"✅ {group['name']}: {unchanged}")
+            continue
+        print(f"📋 {group['name']}: {len(group_steps)} change(s)")
+        for step in group_steps:
+            print(f"   {PLAN_SYMBOLS[step.action]} {step.description}")
+
+
+@traced()
+def reconcile_groups(groups, apply=False, parallel=NC_SETUP_PARALLEL):
+    """
+    Plan/apply mode: fetches the current state (resolve_server_state, which
+    looks recorded groups up by their IDs and only reads the rest in bulk, plus
+    fetch_group_state per group), diffs it against the desired structure of
+    every group and prints the plan. With apply, only the planned steps are
+    run, as one StepGraph across all groups; the steps record what they create
+    in the state store. Returns True if everything is (now) in the desired state.
+    """
+    invalid = [g['name'] for g in groups if len(g['name']) < 3]
+    if invalid:
+        print(f"💥 Group name too short: {', '.join(invalid)}")
+        return False
+    print(f"Reading the current state of {len(groups)} group(s)...")
+    try:
+        server, states = fetch_states(groups, parallel)
+    except (RuntimeError, ValueError, KeyError, ET.ParseError) as e:
+        print(f"💥 Could not read the current state: {e}")
         return False
 
-    result = create_circle_and_collective(group_name)
+    steps = []
+    for group, state in zip(groups, states):
+        steps += plan_group(group['name'], group['quota_gb'], group['subfolders'], server, state)
+    print_plan(groups, steps)
+    if not steps or not apply:
+        return True
 
-    if not result:
-        print("❌ Stopping setup due to collective creation failure.")
+    print(f"\n🚀 Applying {len(steps)} change(s)...")
+    result = apply_plan(steps, parallel)
+    print(f"{len(result.values)} of {len(steps)} change(s) applied in {result.seconds:.1f}s")
+    return result.ok
+
+
+def apply_plan(steps, parallel=NC_SETUP_PARALLEL):
+    """
+    Runs PlanSteps as one StepGraph, each step's output prefixed with its
+    group, and lists the failed and skipped steps. Returns the StepResult.
+    """
+    output = line_buffered_output()
+
+    def prefixed(step):
+        def run():
+            token = output.prefix.set(f"[{step.group}] ")
+            try:
+                return step.run()
+            finally:
+                output.flush()
+                output.prefix.reset(token)
+        return run
+
+    graph = StepGraph()
+    for step in steps:
+        graph.add(step.key, prefixed(step), step.after)
+    result = graph.run(max_workers=4 * max(parallel, 1))
+    for key in result.failed:
+        print(f"❌ Failed: {key}")
+    for key in result.skipped:
+        print(f"⚠️ Skipped: {key}")
+    return result
+
+
+# --- TEARDOWN ---
+
+# Archives of removed groups go below the collectives backup folder
+TEARDOWN_ARCHIVE_FOLDER = "working_groups/"
+
+_archiver = None
+
+
+def load_archiver():
+    """
+    Archiving reuses the streaming ZIP writer of collectives_backup.py, which
+    is only imported when needed since it requires the backup configuration.
+    """
+    global _archiver
+    if _archiver is None:
+        import collectives_backup
+        _archiver = collectives_backup
+    return _archiver
+
+
+@traced()
+def archive_tree(group_name, kind, source_url):
+    """
+    Streams a folder tree into working_groups/<group>/<kind>_<timestamp>.zip
+    in the backup folder without storing anything locally. The folders above
+    the group's are created once per run by teardown_groups.
+    """
+    backup = load_archiver()
+    group_folder = f"{NEXTCLOUD_URL}{backup.REMOTE_TARGET_FOLDER}{TEARDOWN_ARCHIVE_FOLDER}" \
+                   f"{backup.collective_slug(group_name)}/"
+    if not backup.ensure_collection(group_folder):
+        print(f"❌ Failed to create archive folder {group_folder}")
+        return False
+    try:
+        dirs, files = backup.list_tree(source_url, backup.NC_COLLECTIVES_WORKERS)
+        backup.stream_backup(dirs, files, f"{group_folder}{kind}_{backup.TIMESTAMP}.zip",
+                             backup.NC_COLLECTIVES_WORKERS)
+    except (backup.BackupError, RuntimeError) as e:
+        # stream_backup has already removed the partial archive
+        print(f"❌ Failed to archive the {kind} of {group_name}: {e}")
         return False
+    print(f"✅ Archived the {kind} of {group_name} ({len(files)} files)")
+    return True
 
-    result = create_and_share_calendar(group_name,group_name)
 
-    if not result:
-        print("❌ Stopping setup due to calendar creation failure.")
+def deleted(resp, what, ok_statuses=(200,)):
+    """
+    Checks a delete response; a resource that is already gone counts as deleted.
+    """
+    if resp.status_code == 404:
+        print(f"✅ {what} was already removed")
+        return True
+    if resp.status_code not in ok_statuses:
+        print(f"❌ Failed to delete {what}: {resp.status_code} {resp.text[:200]}")
         return False
-    
-    result = create_talk_room(group_name)
-    if not result:
-        print("❌ Stopping setup due to talk romm creation failure.")
+    print(f"✅ Deleted {what}")
+    return True
+
+
+@traced()
+def delete_share(share_id):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/files_sharing/api/v1/shares/{share_id}",
+                              headers=ocs_headers)
+    return deleted(resp, f"share {share_id}")
+
+
+@traced()
+def delete_group_folder(group_name, folder_id):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/apps/groupfolders/folders/{folder_id}", headers=ocs_headers)
+    if not deleted(resp, f"group folder {folder_id}"):
         return False
+    get_state_store().forget(group_name, 'folder')
     return True
 
 
+@traced()
+def delete_collective(group_name, collective_id):
+    # A collective is moved to the trash first; deleting it from there with circle=1 removes its circle too
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/collectives/api/v1.0/collectives/{collective_id}",
+                              headers=ocs_headers)
+    if resp.status_code != 200:
+        return deleted(resp, f"collective {collective_id}")
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/collectives/api/v1.0/collectives/trash/{collective_id}",
+                              headers=ocs_headers, params={"circle": 1})
+    if not deleted(resp, f"collective {collective_id} and its circle"):
+        return False
+    get_state_store().forget(group_name, 'collective')
+    get_state_store().forget(group_name, 'circle_member')
+    return True
+
+
+@traced()
+def delete_calendar(group_name, calendar_id):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/remote.php/dav/calendars/{ANCHOR_USER}/{calendar_id}/")
+    if not deleted(resp, f"calendar {calendar_id}", (200, 204)):
+        return False
+    get_state_store().forget(group_name, 'calendar')
+    return True
+
+
+@traced()
+def delete_talk_room(group_name, token):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/apps/spreed/api/v4/room/{token}", headers=ocs_headers)
+    if not deleted(resp, f"Talk room {token}"):
+        return False
+    get_state_store().forget(group_name, 'talk_room')
+    return True
+
+
+@traced()
+def delete_group(group_name):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/groups/{group_name}", headers=ocs_headers)
+    if not deleted(resp, f"group {group_name}"):
+        return False
+    get_state_store().forget(group_name)
+    return True
+
+
+def plan_teardown(group_name, server, shares, archive=False):
+    """
+    The PlanSteps that remove one group, from the bulk-fetched state. Shares
+    go before their folder, archives before what they copy, and the group
+    itself last since everything else refers to it.
+    """
+    steps = []
+
+    def add(name, action, description, run, after=()):
+        steps.append(PlanStep(group_name, name, action, description, run,
+                              tuple(f"{group_name}: {a}" for a in after if a)))
+        return name
+
+    folder = server['folders'].get(group_name)
+    collective = server['collectives'].get(group_name)
+    cal_id = f"cal_{group_name.lower()}"
+    room = server['rooms'].get(group_name)
+    archive_folder = archive_collective = None
+    if archive and folder is not None:
+        archive_folder = add("archive folder", 'archive', f"archive group folder {group_name}",
+                             lambda: archive_tree(group_name, 'folder', folder_dav_url(group_name)))
+    if archive and collective is not None:
+        archive_collective = add("archive collective", 'archive', f"archive collective {group_name}",
+                                 lambda: archive_tree(group_name, 'collective',
+                                                      f"{NEXTCLOUD_URL}/remote.php/dav/files/{ANCHOR_USER}/"
+                                                      f"{os.getenv('NC_COLLECTIVES_FOLDER')}/{group_name}/"))
+    removed = []
+    if folder is not None:
+        share_steps = [add(f"share {share['id']}", 'delete',
+                           f"share of {share['path'].lstrip('/')} with {share['share_with']}",
+                           lambda share_id=share['id']: delete_share(share_id), [archive_folder])
+                       for share in shares]
+        removed.append(add("folder", 'delete', f"group folder {folder['id']} ({group_name})",
+                           lambda: delete_group_folder(group_name, folder['id']), [archive_folder] + share_steps))
+    if collective is not None:
+        removed.append(add("collective", 'delete', f"collective {collective['id']} with circle {collective['circleId']}",
+                           lambda: delete_collective(group_name, collective['id']), [archive_collective]))
+    if cal_id in server['calendars']:
+        removed.append(add("calendar", 'delete', f"calendar {cal_id}", lambda: delete_calendar(group_name, cal_id)))
+    if room is not None:
+        removed.append(add("room", 'delete', f"Talk room {room['token']}",
+                           lambda: delete_talk_room(group_name, room['token'])))
+    if group_name in server['groups']:
+        add("group", 'delete', f"group {group_name}", lambda: delete_group(group_name), removed)
+    return steps
+
+
+def print_teardown_timings(timings):
+    """
+    Prints the time spent per resource type; timings maps a type to the
+    durations of its steps.
+    """
+    print(f"\n{'resource':<12} {'count':>6} {'total s':>8} {'max s':>7}")
+    for kind, seconds in sorted(timings.items(), key=lambda item: -sum(item[1])):
+        print(f"{kind:<12} {len(seconds):>6} {sum(seconds):>8.2f} {max(seconds):>7.2f}")
+
+
+@traced()
+def teardown_groups(group_names, archive=False, dry_run=False, parallel=NC_SETUP_PARALLEL):
+    """
+    Counterpart of run_group_setup for many groups at once: finds all their
+    resources by their recorded IDs, in bulk only for unrecorded or stale
+    groups (resolve_server_state), plus one share listing per group folder,
+    prints the plan and, unless dry_run, removes everything as one StepGraph so
+    independent deletions run concurrently. Returns True if all
+    groups were removed completely.
+    """
+    protected = [name for name in group_names if len(name) < 3 or name in (ALL_MEMBERS_GROUP, ADMIN_GROUP)]
+    if protected:
+        print(f"💥 Refusing to remove {', '.join(protected)}")
+        return False
+    print(f"Reading the resources of {len(group_names)} group(s)...")
+    try:
+        server, _ = resolve_server_state(group_names, parallel)
+        with_folder = [name for name in group_names if name in server['folders']]
+        with ThreadPoolExecutor(max_workers=max(min(parallel, len(with_folder)), 1)) as pool:
+            shares = dict(zip(with_folder, pool.map(
+                lambda name: contextvars.copy_context().run(list_folder_shares, name), with_folder)))
+    except (RuntimeError, ValueError, KeyError, ET.ParseError) as e:
+        print(f"💥 Could not read the current state: {e}")
+        return False
+
+    steps = []
+    for name in group_names:
+        steps += plan_teardown(name, server, shares.get(name, []), archive)
+    print_plan([{'name': name} for name in group_names], steps, unchanged="nothing to remove")
+    if dry_run or not steps:
+        return True
+    if any(step.action == 'archive' for step in steps):
+        backup = load_archiver()
+        for url in (f"{NEXTCLOUD_URL}{backup.REMOTE_TARGET_FOLDER}",
+                    f"{NEXTCLOUD_URL}{backup.REMOTE_TARGET_FOLDER}{TEARDOWN_ARCHIVE_FOLDER}"):
+            if not backup.ensure_collection(url):
+                print(f"💥 Could not create the archive folder {url}")
+                return False
+
+    timings = {}
+    timings_lock = threading.Lock()
+
+    def timed(step):
+        def run():
+            start = time.monotonic()
+            try:
+                return step.run()
+            finally:
+                with timings_lock:
+                    timings.setdefault(step.name.split(' ')[0], []).append(time.monotonic() - start)
+        return step._replace(run=run)
+
+    print(f"\n🗑️ Removing {len(group_names)} group(s)...")
+    result = apply_plan([timed(step) for step in steps], parallel)
+    print_teardown_timings(timings)
+    print(f"{len(result.values)} of {len(steps)} step(s) done in {result.seconds:.1f}s")
+    return result.ok
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set up Nextcloud working groups.")
+    parser.add_argument("groups", nargs="*", metavar="GROUP",
+                        help="groups to set up with the default quota and subfolders (default: prompt for one)")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="provision all groups of a CSV or YAML manifest without prompting")
+    parser.add_argument("--plan", action="store_true",
+                        help="compare the groups with the server and print what --apply would change")
+    parser.add_argument("--apply", action="store_true",
+                        help="reconcile the groups: only create what is missing and fix what drifted")
+    parser.add_argument("--teardown", action="store_true",
+                        help="remove the groups and everything provisioned for them")
+    parser.add_argument("--archive", action="store_true",
+                        help="with --teardown: archive the group folder and collective into the backup folder first")
+    parser.add_argument("--dry-run", action="store_true", help="with --teardown: only print what would be removed")
+    parser.add_argument("--yes", action="store_true", help="with --teardown: do not ask for confirmation")
+    parser.add_argument("--parallel", type=int, default=NC_SETUP_PARALLEL,
+                        help="groups provisioned at the same time with --manifest")
+    parser.add_argument("--report", metavar="FILE", help="write the per-group results as JSON")
+    parser.add_argument("--state", action="store_true",
+                        help="show the resource IDs recorded for the groups (default: all recorded groups)")
+    parser.add_argument("--refresh-state", action="store_true",
+                        help="re-read the recorded groups (or the given ones) from the server in bulk first")
+    parser.add_argument("--trace", metavar="FILE", default=NC_TRACE_FILE,
+                        help="write JSONL spans of all steps and HTTP requests and print a latency summary")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+
+    groups = [{'name': name, 'quota_gb': QUOTA_GB, 'subfolders': SUBFOLDERS} for name in args.groups]
+    if args.manifest:
+        try:
+            groups += load_group_manifest(args.manifest)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"💥 Invalid manifest {args.manifest}: {e}")
+            sys.exit(1)
+        if not groups:
+            print("Abort: The manifest lists no groups.")
+            sys.exit(1)
+    parallel = max(args.parallel, 1)
+    # Each group runs up to four branches, and subfolders in parallel within its folder branch
+    http_client.set_max_connections(max(NC_HTTP_MAX_CONNECTIONS, 4 * parallel + 2))
+
+    if args.state or args.refresh_state:
+        if args.refresh_state:
+            names = [g['name'] for g in groups] or get_state_store().groups()
+            try:
+                fetch_states([{'name': name} for name in names], parallel, recorded=False)
+            except (RuntimeError, ValueError, KeyError, ET.ParseError) as e:
+                print(f"💥 Could not read the current state: {e}")
+                sys.exit(1)
+            print(f"✅ Refreshed {len(names)} group(s) from the server")
+        print_state([g['name'] for g in groups])
+        sys.exit(0)
+
+    if args.teardown:
+        names = [g['name'] for g in groups]
+        if not names:
+            group_name = input("Enter name of the group to remove: ").strip()
+            if not group_name:
+                print("Abort: No group name provided.")
+                sys.exit(1)
+            names = [group_name]
+        if args.archive:
+            load_archiver()
+        if not args.dry_run and not args.yes:
+            answer = input(f"Remove {', '.join(names)} and all their data? Type 'yes' to continue: ").strip()
+            if answer != 'yes':
+                print("Abort: Not confirmed.")
+                sys.exit(1)
+        ok = teardown_groups(names, args.archive, args.dry_run, parallel)
+        http_client.print_stats()
+        sys.exit(0 if ok else 1)
+
+    if args.plan or args.apply:
+        if not groups:
+            group_name = input("Enter name of the group to reconcile: ").strip()
+            if not group_name:
+                print("Abort: No group name provided.")
+                sys.exit(1)
+            groups = [{'name': group_name, 'quota_gb': QUOTA_GB, 'subfolders': SUBFOLDERS}]
+        ok = reconcile_groups(groups, args.apply, parallel)
+        http_client.print_stats()
+        sys.exit(0 if ok else 1)
+
+    if groups:
+        print(f"🚀 Provisioning {len(groups)} groups, {min(parallel, len(groups))} at a time")
+        start = time.monotonic()
+        results = provision_groups(groups, parallel)
+        print_report(results, time.monotonic() - start, args.report)
+        http_client.print_stats()
+        sys.exit(0 if all(r['ok'] for r in results) else 1)
+
     group_name = input("Enter name for new group (e.g., AK_Strategy): ").strip()
     if group_name:
+        line_buffered_output()
         if run_group_setup(group_name):
             print(f"\n✨ Success! Group '{group_name}' is technically ready.")
         else:
             print(f"\n💥 Setup failed.")
+        http_client.print_stats()
 
     else:
         print("Abort: No group name provided.")
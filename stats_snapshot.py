@@ -0,0 +1,316 @@
+"""
+Compact storage format for serverinfo samples. Consecutive samples are
+mostly identical (system config, app versions, PHP settings), so a file
+keeps a full keyframe every keyframe_interval samples and, in between, only
+the fields that changed. Each keyframe starts a block that is compressed on
+its own and indexed by its first timestamp, so a reader can rebuild any
+sample or stream a time range by decompressing only the blocks it needs.
+
+    with SnapshotWriter(open('stats.ncsnap', 'wb')) as writer:
+        writer.add(time.time(), sample)
+
+    reader = SnapshotReader('stats.ncsnap')
+    timestamp, sample = reader.sample(10)
+    for timestamp, sample in reader.samples(start, end):
+        ...
+
+File layout: MAGIC, then blocks of a header (payload length, first
+timestamp, sample count) and a zlib payload of JSON lines. The first line
+of a block is {"t": time, "f": sample}; every further line is
+{"t": time, "s": [[path, value], ...], "u": [path, ...]} with the leaves
+set and removed since the previous sample, paths being lists of keys.
+
+A file can be summarised or decoded again:
+
+    python stats_snapshot.py FILE [--dump] [--start ISO] [--end ISO]
+"""
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime
+
+MAGIC = b'NCSNAP1\n'
+BLOCK_HEADER = struct.Struct('>IdI')
+SNAPSHOT_EXTENSION = '.ncsnap'
+# Samples per block; the first one of every block is stored in full
+DEFAULT_KEYFRAME_INTERVAL = 60
+
+
+def flatten(sample, prefix=()):
+    """
+    Leaf path (tuple of keys) -> value of a nested dict; lists count as leaves.
+    """
+    leaves = {}
+    for key, value in sample.items():
+        path = prefix + (key,)
+        if isinstance(value, dict) and value:
+            leaves.update(flatten(value, path))
+        else:
+            leaves[path] = value
+    return leaves
+
+
+def diff(previous, current):
+    """
+    The changes between two flattened samples as (set, removed):
+    [[path, value], ...] and [path, ...].
+    """
+    changed = [[list(path), value] for path, value in current.items()
+               if path not in previous or previous[path] != value
+               or type(previous[path]) is not type(value)]
+    removed = []
+    gone = [path for path in previous if path not in current]
+    if gone:
+        # A vanished subtree is removed as a whole, at its shortest prefix missing from current
+        present = {path[:depth] for path in current for depth in range(1, len(path) + 1)}
+        seen = set()
+        for path in gone:
+            # None: an empty dict that got children, which the changed leaves recreate
+            depth = next((depth for depth in range(1, len(path) + 1) if path[:depth] not in present), None)
+            if depth is not None and path[:depth] not in seen:
+                seen.add(path[:depth])
+                removed.append(list(path[:depth]))
+    return changed, removed
+
+
+def apply_diff(sample, changed, removed):
+    """
+    Returns the sample after a delta line. Only the dicts along changed
+    paths are copied; the rest is shared with the previous sample, so
+    decoded samples must be treated as read-only.
+    """
+    result = dict(sample)
+    # ids of the dicts already copied for this line
+    fresh = {id(result)}
+
+    def parent(path, create):
+        node = result
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                if not create:
+                    return None
+                child = {}
+            elif id(child) in fresh:
+                node = child
+                continue
+            else:
+                child = dict(child)
+            node[key] = child
+            fresh.add(id(child))
+            node = child
+        return node
+
+    for path in removed:
+        node = parent(path, False)
+        if node is not None:
+            node.pop(path[-1], None)
+    for path, value in changed:
+        parent(path, True)[path[-1]] = value
+    return result
+
+
+def to_timestamp(when):
+    if isinstance(when, datetime):
+        return when.timestamp()
+    if isinstance(when, str):
+        return datetime.fromisoformat(when).timestamp()
+    return float(when)
+
+
+class SnapshotWriter:
+    """
+    Writes samples (nested dicts) to a binary file object. Samples must be
+    added in time order; a block is compressed and written every
+    keyframe_interval samples and on close().
+    """
+    def __init__(self, fileobj, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, level=9):
+        self.fileobj = fileobj
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.level = level
+        self.count = 0
+        self._lines = []
+        self._first = None
+        self._previous = None
+        self._last_time = None
+        fileobj.write(MAGIC)
+
+    def add(self, when, sample):
+        timestamp = to_timestamp(when)
+        if self._last_time is not None and timestamp < self._last_time:
+            raise ValueError(f"Sample at {timestamp} is older than the previous one")
+        self._last_time = timestamp
+        leaves = flatten(sample)
+        if not self._lines:
+            self._first = timestamp
+            line = {'t': timestamp, 'f': sample}
+        else:
+            changed, removed = diff(self._previous, leaves)
+            line = {'t': timestamp, 's': changed}
+            if removed:
+                line['u'] = removed
+        self._lines.append(json.dumps(line, separators=(',', ':')))
+        self._previous = leaves
+        self.count += 1
+        if len(self._lines) >= self.keyframe_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending samples as a block; the next sample becomes a keyframe.
+        """
+        if not self._lines:
+            return
+        payload = zlib.compress('\n'.join(self._lines).encode('utf-8'), self.level)
+        self.fileobj.write(BLOCK_HEADER.pack(len(payload), self._first, len(self._lines)))
+        self.fileobj.write(payload)
+        self._lines = []
+        self._previous = None
+
+    def close(self):
+        self.flush()
+        self.fileobj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode_samples(samples, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    """
+    Encodes (time, sample) pairs into the bytes of a snapshot file.
+    """
+    out = io.BytesIO()
+    with SnapshotWriter(out, keyframe_interval) as writer:
+        for when, sample in samples:
+            writer.add(when, sample)
+    return out.getvalue()
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot file from a path, bytes or a seekable binary file
+    object. Opening only reads the block headers; samples are decompressed
+    block by block when they are asked for.
+    """
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        elif isinstance(source, (str, os.PathLike)):
+            source = open(source, 'rb')
+        self.fileobj = source
+        if source.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a serverinfo snapshot file")
+        # (payload offset, payload length, first timestamp, sample count, index of the first sample)
+        self.blocks = []
+        total = 0
+        while True:
+            header = source.read(BLOCK_HEADER.size)
+            if not header:
+                break
+            if len(header) < BLOCK_HEADER.size:
+                raise ValueError("Truncated block header")
+            length, first, count = BLOCK_HEADER.unpack(header)
+            self.blocks.append((source.tell(), length, first, count, total))
+            total += count
+            source.seek(length, io.SEEK_CUR)
+        self.count = total
+        self._cache = (None, None)
+
+    def __len__(self):
+        return self.count
+
+    def _block(self, number):
+        """
+        The decoded samples of one block as [(timestamp, sample)]; the last block read is cached.
+        """
+        if self._cache[0] == number:
+            return self._cache[1]
+        offset, length, _, _, _ = self.blocks[number]
+        self.fileobj.seek(offset)
+        payload = self.fileobj.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated block")
+        samples = []
+        current = None
+        for line in zlib.decompress(payload).decode('utf-8').split('\n'):
+            record = json.loads(line)
+            if 'f' in record:
+                current = record['f']
+            else:
+                current = apply_diff(current, record['s'], record.get('u', ()))
+            samples.append((record['t'], current))
+        self._cache = (number, samples)
+        return samples
+
+    def sample(self, index):
+        """
+        The sample at index as (timestamp, sample dict).
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("Sample index out of range")
+        for number, (_, _, _, count, first_index) in enumerate(self.blocks):
+            if index < first_index + count:
+                return self._block(number)[index - first_index]
+
+    def samples(self, start=None, end=None):
+        """
+        Yields (timestamp, sample) with start <= timestamp < end (times,
+        datetimes or ISO strings; None = unbounded). Blocks that end before
+        start are skipped without decompressing them.
+        """
+        start = None if start is None else to_timestamp(start)
+        end = None if end is None else to_timestamp(end)
+        for number, (_, _, first, _, _) in enumerate(self.blocks):
+            if end is not None and first >= end:
+                return
+            following = self.blocks[number + 1][2] if number + 1 < len(self.blocks) else None
+            if start is not None and following is not None and following <= start:
+                continue
+            for timestamp, sample in self._block(number):
+                if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                    yield timestamp, sample
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def summarize_file(path, out=sys.stdout):
+    with SnapshotReader(path) as reader:
+        size = os.path.getsize(path)
+        print(f"{path}: {len(reader)} samples in {len(reader.blocks)} blocks, {size / 1024:.1f} KB "
+              f"({size / max(len(reader), 1):.0f} bytes/sample)", file=out)
+        if len(reader):
+            first, last = reader.sample(0)[0], reader.sample(-1)[0]
+            print(f"from {datetime.fromtimestamp(first).isoformat()} to {datetime.fromtimestamp(last).isoformat()}",
+                  file=out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise or decode a serverinfo snapshot file.")
+    parser.add_argument("file", metavar="FILE")
+    parser.add_argument("--dump", action="store_true", help="print the samples as JSON lines")
+    parser.add_argument("--start", help="first sample time (ISO), with --dump")
+    parser.add_argument("--end", help="end of the range (ISO, exclusive), with --dump")
+    args = parser.parse_args()
+    if not args.dump:
+        summarize_file(args.file)
+        sys.exit(0)
+    with SnapshotReader(args.file) as reader:
+        for timestamp, sample in reader.samples(args.start, args.end):
+            print(json.dumps({'time': datetime.fromtimestamp(timestamp).astimezone().isoformat(),
+                              'serverinfo': sample}, separators=(',', ':')))
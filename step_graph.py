@@ -0,0 +1,120 @@
+"""
+Runs provisioning steps as a dependency graph: every step starts as soon as
+the steps it depends on have succeeded, so independent branches run at the
+same time and a chain of steps takes as long as its longest path.
+
+    graph = StepGraph()
+    graph.add("group", lambda: create_group(name))
+    graph.add("folder", lambda: create_group_folder(name), after=["group"])
+    graph.add("calendar", lambda: create_calendar(name), after=["group"])
+    result = graph.run()
+
+A step succeeds if its function returns a truthy value. Steps that depend on
+a failed step are skipped; the others keep running.
+"""
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Seconds to wait for the server to report a resource as ready
+NC_SETUP_READY_TIMEOUT = float(os.getenv("NC_SETUP_READY_TIMEOUT", "30"))
+
+
+class StepResult:
+    """
+    Outcome of StepGraph.run(): the return values of the succeeded steps,
+    the failed steps and the steps skipped because a dependency failed.
+    """
+    def __init__(self):
+        self.values = {}
+        self.failed = []
+        self.skipped = []
+        self.errors = {}
+        self.seconds = 0
+
+    @property
+    def ok(self):
+        return not self.failed and not self.skipped
+
+    def __bool__(self):
+        return self.ok
+
+
+class StepGraph:
+    def __init__(self):
+        # name -> (function, names of the steps it waits for)
+        self.steps = {}
+
+    def add(self, name, func, after=()):
+        """
+        Adds a step; after names steps that must succeed before it starts.
+        """
+        if name in self.steps:
+            raise ValueError(f"Step {name} added twice")
+        missing = [dep for dep in after if dep not in self.steps]
+        if missing:
+            raise ValueError(f"Step {name} depends on unknown step(s) {', '.join(missing)}")
+        self.steps[name] = (func, tuple(after))
+        return name
+
+    def run(self, max_workers=None):
+        """
+        Executes all steps, each in a worker thread that inherits the caller's
+        context (trace span, output prefix). max_workers bounds the steps that
+        run at the same time (default: all that are ready). An exception
+        counts as a failure of its step. Returns a StepResult.
+        """
+        result = StepResult()
+        start = time.monotonic()
+        pending = dict(self.steps)
+        done = set()
+        running = {}
+        workers = max_workers or max(len(self.steps), 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for name, (func, after) in list(pending.items()):
+                    if any(dep in result.failed or dep in result.skipped for dep in after):
+                        result.skipped.append(name)
+                        del pending[name]
+                    elif all(dep in done for dep in after) and len(running) < workers:
+                        running[pool.submit(contextvars.copy_context().run, func)] = name
+                        del pending[name]
+                if not running:
+                    # The remaining steps were all skipped in this pass
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        print(f"💥 Step {name} raised {type(e).__name__}: {e}")
+                        result.errors[name] = f"{type(e).__name__}: {e}"
+                        value = None
+                    if value:
+                        result.values[name] = value
+                        done.add(name)
+                    else:
+                        result.failed.append(name)
+        result.seconds = time.monotonic() - start
+        return result
+
+
+def poll_until(check, what, timeout=NC_SETUP_READY_TIMEOUT, interval=0.2, max_interval=2):
+    """
+    Calls check() until it returns a truthy value, waiting between calls with
+    a growing interval. Used instead of fixed sleeps where the server needs
+    time before a new resource is usable. Returns the value, or None after
+    timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        value = check()
+        if value:
+            return value
+        if time.monotonic() + interval > deadline:
+            print(f"❌ Timed out after {timeout:.0f}s waiting for {what}")
+            return None
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
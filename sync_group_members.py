@@ -0,0 +1,253 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
+from nextcloud_client import NC_HTTP_MAX_CONNECTIONS, NC_HTTP_RATE, NextcloudClient, ocs_data
+from tracing import NC_TRACE_FILE, traced, tracer
+
+
+NEXTCLOUD_URL = os.getenv("NC_URL")
+ANCHOR_USER = os.getenv("NC_ANCHOR_USER")
+ANCHOR_APP_PW = os.getenv("NC_ANCHOR_APP_PW")
+# Membership requests sent at the same time
+NC_SYNC_PARALLEL = int(os.getenv("NC_SYNC_PARALLEL", "16"))
+
+# ---------------------
+
+http_client = NextcloudClient(NEXTCLOUD_URL, ANCHOR_USER, ANCHOR_APP_PW)
+ocs_headers = {"OCS-APIRequest": "true",
+               "Accept": "application/json"}
+
+
+def load_roster(path):
+    """
+    Reads the wanted members per group from a CSV or JSON roster. CSV needs a
+    header with a group column and either a user column (one membership per
+    row) or a users column (all members of a group, separated by commas or
+    semicolons); a row without users lists a group that should be empty:
+
+        group,user
+        AK_Strategy,alice
+        AK_Strategy,bob
+
+    JSON maps group names to lists of users. Returns {group: set of users};
+    raises ValueError for invalid rosters.
+    """
+    roster = {}
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("A JSON roster must map group names to lists of users")
+        for group, users in data.items():
+            if isinstance(users, str) or not isinstance(users, (list, tuple)):
+                raise ValueError(f"Group {group}: users must be a list")
+            roster[str(group).strip()] = {str(u).strip() for u in users if str(u).strip()}
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            if 'group' not in (reader.fieldnames or []):
+                raise ValueError("The CSV roster needs a group column")
+            for number, row in enumerate(reader, 2):
+                group = (row.get('group') or '').strip()
+                if not group:
+                    raise ValueError(f"Line {number} has no group")
+                users = re.split(r'[,;]', row.get('users') or '') + [row.get('user') or '']
+                roster.setdefault(group, set()).update(u.strip() for u in users if u.strip())
+    if '' in roster:
+        raise ValueError("The roster lists a group without a name")
+    return roster
+
+
+@traced()
+def fetch_group_members(group_name):
+    """
+    Current members of a group, or None if the group does not exist.
+    """
+    resp = http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/groups/{quote(group_name, safe='')}/users",
+                           headers=ocs_headers)
+    if resp.status_code == 404:
+        return None
+    return set(ocs_data(resp, f"members of {group_name}")['users'])
+
+
+@traced()
+def fetch_current_state(groups, parallel=NC_SYNC_PARALLEL):
+    """
+    Reads all users and the members of every roster group concurrently.
+    Returns (set of users, {group: set of members}); groups that do not exist
+    are left out.
+    """
+    def users():
+        return set(ocs_data(http_client.get(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/users", headers=ocs_headers),
+                            "users")['users'])
+
+    with ThreadPoolExecutor(max_workers=max(min(parallel, len(groups) + 1), 1)) as pool:
+        all_users = pool.submit(contextvars.copy_context().run, users)
+        futures = {group: pool.submit(contextvars.copy_context().run, fetch_group_members, group)
+                   for group in groups}
+        members = {group: future.result() for group, future in futures.items()}
+        return all_users.result(), {group: m for group, m in members.items() if m is not None}
+
+
+def plan_changes(roster, all_users, members, remove=True):
+    """
+    Diffs the roster against the current members. Returns one dict per
+    roster group with the users to add and remove, the roster users that do
+    not exist and whether the group is missing. The anchor user is never
+    removed since it owns the group's resources.
+    """
+    plan = []
+    for group in sorted(roster):
+        wanted = roster[group]
+        current = members.get(group)
+        entry = {'group': group, 'missing': current is None, 'add': [], 'remove': [],
+                 'unknown': sorted(wanted - all_users)}
+        if current is not None:
+            entry['add'] = sorted((wanted & all_users) - current)
+            if remove:
+                entry['remove'] = sorted(current - wanted - {ANCHOR_USER})
+        plan.append(entry)
+    return plan
+
+
+@traced()
+def add_user_to_group(user, group_name):
+    resp = http_client.post(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/users/{quote(user, safe='')}/groups",
+                            headers=ocs_headers, data={"groupid": group_name})
+    if resp.status_code != 200:
+        return f"{resp.status_code} {resp.text[:200]}"
+    return None
+
+
+@traced()
+def remove_user_from_group(user, group_name):
+    resp = http_client.delete(f"{NEXTCLOUD_URL}/ocs/v2.php/cloud/users/{quote(user, safe='')}/groups",
+                              headers=ocs_headers, data={"groupid": group_name})
+    if resp.status_code != 200:
+        return f"{resp.status_code} {resp.text[:200]}"
+    return None
+
+
+@traced()
+def apply_changes(plan, parallel=NC_SYNC_PARALLEL):
+    """
+    Sends all adds and removes of the plan as one concurrent batch, paced by
+    the client's rate limiter. Records the failures in each plan entry
+    (failed: list of (action, user, error)) and returns the number of
+    memberships changed.
+    """
+    calls = [(entry, action, user) for entry in plan
+             for action in ('add', 'remove') for user in entry[action]]
+    changed = 0
+    with ThreadPoolExecutor(max_workers=max(min(parallel, len(calls)), 1)) as pool:
+        futures = {pool.submit(contextvars.copy_context().run,
+                               add_user_to_group if action == 'add' else remove_user_from_group,
+                               user, entry['group']): (entry, action, user)
+                   for entry, action, user in calls}
+        for future in as_completed(futures):
+            entry, action, user = futures[future]
+            try:
+                error = future.result()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if error:
+                print(f"❌ Failed to {action} {user} {'to' if action == 'add' else 'from'} {entry['group']}: {error}")
+                entry.setdefault('failed', []).append((action, user, error))
+            else:
+                changed += 1
+    return changed
+
+
+def print_plan(plan, details=True):
+    """
+    Prints the changes per group; details lists every user added or removed.
+    """
+    for entry in plan:
+        if entry['missing']:
+            print(f"💥 {entry['group']}: group does not exist, skipped")
+            continue
+        if entry['unknown']:
+            print(f"⚠️ {entry['group']}: unknown user(s) skipped: {', '.join(entry['unknown'])}")
+        if not entry['add'] and not entry['remove']:
+            print(f"✅ {entry['group']}: up to date")
+            continue
+        print(f"📋 {entry['group']}: +{len(entry['add'])} -{len(entry['remove'])}")
+        if not details:
+            continue
+        for user in entry['add']:
+            print(f"   + {user}")
+        for user in entry['remove']:
+            print(f"   - {user}")
+
+
+def print_report(plan, changed, seconds, path=None):
+    """
+    Prints the changes per group and the overall throughput; with path, the
+    full plan with its failures is also written there as JSON.
+    """
+    print(f"\n{'group':<30} {'added':>6} {'removed':>8} {'failed':>7}")
+    for entry in plan:
+        failed = entry.get('failed', [])
+        added = len(entry['add']) - sum(1 for f in failed if f[0] == 'add')
+        removed = len(entry['remove']) - sum(1 for f in failed if f[0] == 'remove')
+        print(f"{entry['group'][:30]:<30} {added:>6} {removed:>8} {len(failed):>7}"
+              f"{'  missing group' if entry['missing'] else ''}")
+    rate = changed / seconds if seconds else 0
+    print(f"\n{changed} membership(s) changed in {seconds:.1f}s ({rate:.1f}/s)")
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'seconds': round(seconds, 3), 'changed': changed, 'groups': plan}, f, indent=1)
+        print(f"Report written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync Nextcloud group memberships with a roster file.")
+    parser.add_argument("roster", metavar="ROSTER", help="CSV or JSON file with the wanted members per group")
+    parser.add_argument("--dry-run", action="store_true", help="only print the changes")
+    parser.add_argument("--no-remove", action="store_true", help="only add missing members, never remove any")
+    parser.add_argument("--parallel", type=int, default=NC_SYNC_PARALLEL, help="membership requests at the same time")
+    parser.add_argument("--rate", type=float, default=NC_HTTP_RATE,
+                        help="maximum requests per second (default: NC_HTTP_RATE, 0 = adaptive only)")
+    parser.add_argument("--report", metavar="FILE", help="write the changes and failures per group as JSON")
+    parser.add_argument("--trace", metavar="FILE", default=NC_TRACE_FILE,
+                        help="write JSONL spans and HTTP requests and print a latency summary")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.configure(args.trace)
+
+    try:
+        roster = load_roster(args.roster)
+    except (OSError, ValueError) as e:
+        print(f"💥 Invalid roster {args.roster}: {e}")
+        sys.exit(1)
+    parallel = max(args.parallel, 1)
+    http_client.set_max_connections(max(NC_HTTP_MAX_CONNECTIONS, parallel))
+    if args.rate != NC_HTTP_RATE:
+        http_client.set_rate(args.rate)
+
+    print(f"Reading the members of {len(roster)} group(s)...")
+    start = time.monotonic()
+    try:
+        all_users, members = fetch_current_state(sorted(roster), parallel)
+    except (RuntimeError, ValueError, KeyError) as e:
+        print(f"💥 Could not read the current members: {e}")
+        sys.exit(1)
+    plan = plan_changes(roster, all_users, members, remove=not args.no_remove)
+    print_plan(plan, details=args.dry_run)
+    total = sum(len(entry['add']) + len(entry['remove']) for entry in plan)
+    changed = 0
+    if total and not args.dry_run:
+        print(f"\n🚀 Applying {total} membership change(s)...")
+        changed = apply_changes(plan, parallel)
+    if not args.dry_run:
+        print_report(plan, changed, time.monotonic() - start, args.report)
+    http_client.print_stats()
+    ok = changed == total and not any(entry['missing'] or entry['unknown'] for entry in plan)
+    sys.exit(0 if args.dry_run or ok else 1)
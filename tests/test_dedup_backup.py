@@ -0,0 +1,68 @@
+"""
+Deduplicated backups (collectives_backup.py --dedup) with many workers against
+mock_nextcloud.py, so files whose digests share a prefix folder or are equal
+are stored at the same time.
+
+    python -m pytest tests
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import benchmark  # noqa: E402
+from mock_nextcloud import build_server, parse_args  # noqa: E402
+
+STORE = 'files/anchor_user/Backup/Collectives/store/'
+
+
+class ConcurrentDedupTest(unittest.TestCase):
+    def setUp(self):
+        self.server = build_server(parse_args(['--port', '0', '--files', '300', '--collectives', '3',
+                                               '--latency', '1', '--jitter', '30']))
+        self.state = self.server.RequestHandlerClass.state
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.env = benchmark.child_env(f"http://127.0.0.1:{self.server.server_address[1]}")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.workdir.cleanup()
+
+    def add_file(self, path, data):
+        spool = self.state.spool_path()
+        with open(spool, 'wb') as f:
+            f.write(data)
+        with self.state.lock:
+            node = self.state.add_file(path, size=len(data))
+            node.path = spool
+            self.state.touch(path)
+
+    def test_concurrent_objects_are_all_stored(self):
+        # Identical contents in several collectives are stored while their first copy is still uploading
+        for i in range(20):
+            for collective in ('WG_000', 'WG_001', 'WG_002'):
+                self.add_file(f"files/anchor_user/Collectives/{collective}/copy_{i}.bin", f"same {i}".encode() * 500)
+        result = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'collectives_backup.py'),
+                                 '--dedup', '--workers', '32'],
+                                env=self.env, cwd=self.workdir.name, capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stdout[-3000:] + result.stderr[-3000:])
+
+        with self.state.lock:
+            snapshots = [path for path in self.state.nodes if path.startswith(STORE + 'snapshots/snapshot_')]
+            self.assertEqual(len(snapshots), 1)
+            snapshot = json.loads(self.state.read(self.state.nodes[snapshots[0]]))
+            stored = {path.rpartition('/')[2] for path in self.state.nodes if path.startswith(STORE + 'objects/')}
+        self.assertEqual(len(snapshot['files']), 360)
+        self.assertEqual({info['hash'] for info in snapshot['files'].values()} - stored, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Plan and teardown of working groups against mock_nextcloud.py: groups recorded
+in the state store are looked up by their IDs instead of the bulk listings.
+
+    python -m pytest tests
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import benchmark  # noqa: E402
+from mock_nextcloud import build_server, parse_args  # noqa: E402
+
+# The six calls of fetch_server_state as (method, path, depth)
+LISTINGS = {
+    ('GET', '/ocs/v1.php/cloud/groups', None),
+    ('GET', '/ocs/v1.php/cloud/users/anchor_user/groups', None),
+    ('GET', '/apps/groupfolders/folders', None),
+    ('GET', '/ocs/v2.php/apps/collectives/api/v1.0/collectives', None),
+    ('GET', '/ocs/v2.php/apps/spreed/api/v4/room', None),
+    ('PROPFIND', '/remote.php/dav/calendars/anchor_user/', '1'),
+}
+
+
+class RecordedGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.server = build_server(parse_args(['--port', '0', '--files', '0', '--collectives', '0']))
+        self.state = self.server.RequestHandlerClass.state
+        for group in ('all_users', 'admin'):
+            self.state.groups.setdefault(group, set())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.workdir = tempfile.TemporaryDirectory()
+        self.env = benchmark.child_env(self.url)
+        self.env['NC_SETUP_STATE_DB'] = os.path.join(self.workdir.name, 'working_groups.db')
+        self.setup('WG_Alpha')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.workdir.cleanup()
+
+    def setup(self, *args):
+        result = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'setup_working_group.py'), *args],
+                                env=self.env, cwd=self.workdir.name, capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return result.stdout
+
+    def mock(self, what, method='GET'):
+        request = urllib.request.Request(f"{self.url}/__mock/{what}", method=method)
+        with urllib.request.urlopen(request) as resp:
+            return json.load(resp)
+
+    def listings(self):
+        return {tuple(request) for request in self.mock('requests')['requests']} & LISTINGS
+
+    def test_plan_recorded_group_without_listings(self):
+        self.mock('reset', 'POST')
+        output = self.setup('--plan', 'WG_Alpha')
+        self.assertIn("WG_Alpha: up to date", output)
+        self.assertEqual(self.listings(), set())
+
+    def test_teardown_recorded_group_without_listings(self):
+        self.mock('reset', 'POST')
+        self.setup('--teardown', '--yes', 'WG_Alpha')
+        self.assertEqual(self.listings(), set())
+        self.assertNotIn('WG_Alpha', self.state.groups)
+        self.assertEqual(self.state.groupfolders, {})
+        self.assertEqual(self.state.rooms, {})
+        self.assertFalse(any(c['name'] == 'WG_Alpha' and not c['trashed'] for c in self.state.collectives.values()))
+
+    def test_stale_rows_fall_back_to_listings(self):
+        with self.state.lock:
+            self.state.rooms.clear()
+        self.mock('reset', 'POST')
+        output = self.setup('--plan', 'WG_Alpha')
+        self.assertIn("Talk room WG_Alpha", output)
+        self.assertEqual(self.listings(), LISTINGS)
+
+    def test_unrecorded_group_uses_listings(self):
+        self.mock('reset', 'POST')
+        output = self.setup('--plan', 'WG_Beta')
+        self.assertIn("group WG_Beta", output)
+        self.assertEqual(self.listings(), LISTINGS)
+
+
+if __name__ == "__main__":
+    unittest.main()
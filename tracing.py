@@ -0,0 +1,215 @@
+"""
+Structured tracing for the scripts: spans for pipeline phases and one record
+per HTTP request, written as JSON lines, plus a latency summary per endpoint.
+
+Tracing is off unless NC_TRACE_FILE is set (or a script calls
+tracer.configure()). An existing trace can be summarised again later:
+
+    python tracing.py trace.jsonl
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+from urllib.parse import unquote, urlsplit
+
+NC_TRACE_FILE = os.getenv("NC_TRACE_FILE")
+
+# Path segments that name a collection; the segment after one of them is an id
+COLLECTION_SEGMENTS = {'users', 'groups', 'members', 'circles', 'folders', 'shares', 'collectives', 'room'}
+ACTION_SEGMENTS = {'trash'}
+
+
+def endpoint_template(url):
+    """
+    Collapses ids, names and file paths so requests group by endpoint:
+    /ocs/v2.php/apps/circles/circles/ab12/members/m7/level -> .../circles/{id}/members/{id}/level,
+    /remote.php/dav/files/anchor/Collectives/x.md -> /remote.php/dav/files/{user}/{path}.
+    """
+    path = unquote(urlsplit(url).path)
+    match = re.match(r'(/remote\.php/dav/[^/]+)(/[^/]+)?(/.+)?', path)
+    if match:
+        return match.group(1) + ('/{user}' if match.group(2) else '') + ('/{path}' if match.group(3) else '')
+    segments = path.strip('/').split('/')
+    template = []
+    for i, segment in enumerate(segments):
+        previous = segments[i - 1] if i else ''
+        # /apps/<app>/... names an app, not a collection
+        is_app = i > 1 and segments[i - 2] == 'apps'
+        if segment.isdigit() or (previous in COLLECTION_SEGMENTS and not is_app and segment not in COLLECTION_SEGMENTS
+                                 and segment not in ACTION_SEGMENTS):
+            segment = '{id}'
+        template.append(segment)
+    return '/' + '/'.join(template)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Tracer:
+    """
+    Collects spans and HTTP records from all threads. Spans nest per context
+    (a thread, or work submitted with contextvars.copy_context().run); an
+    HTTP record belongs to the innermost open span of its context.
+    """
+    def __init__(self, path=None):
+        self.enabled = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._stack = contextvars.ContextVar('trace_stack', default=())
+        self._ids = count(1)
+        # Compact copies for the summary: (key, milliseconds, failed, bytes)
+        self._http = []
+        self._spans = []
+        if path:
+            self.configure(path)
+
+    def configure(self, path):
+        """
+        Starts writing JSON lines to path; the summary is printed at exit.
+        """
+        if self.enabled:
+            return
+        self._file = open(path, 'a', buffering=1024 * 1024)
+        self.enabled = True
+        atexit.register(self.close)
+
+    def _emit(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Times the enclosed block. The yielded dict can be filled with more attributes.
+        """
+        if not self.enabled:
+            yield attrs
+            return
+        stack = self._stack.get()
+        span_id = next(self._ids)
+        parent = stack[-1] if stack else None
+        token = self._stack.set(stack + (span_id,))
+        started = time.time()
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield attrs
+        except BaseException as e:
+            status = 'error'
+            attrs['error'] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            self._stack.reset(token)
+            ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._spans.append((name, ms, status != 'ok'))
+            self._emit({'type': 'span', 'name': name, 'id': span_id, 'parent': parent,
+                        'thread': threading.current_thread().name, 'start': started, 'ms': round(ms, 3),
+                        'status': status, **attrs})
+
+    def traced(self, name=None):
+        """
+        Decorator form of span(); a leading string argument (a group name,
+        a path, ...) is recorded as 'arg'.
+        """
+        def decorate(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                attrs = {'arg': args[0]} if args and isinstance(args[0], str) else {}
+                with self.span(span_name, **attrs):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def http(self, method, url, status, ms, sent=0, received=0, attempt=0, error=None):
+        """
+        Records one HTTP attempt; status is None if no response arrived.
+        ms is the time until the response headers were received.
+        """
+        if not self.enabled:
+            return
+        endpoint = endpoint_template(url)
+        stack = self._stack.get()
+        failed = status is None or status >= 400
+        with self._lock:
+            self._http.append((f"{method} {endpoint}", ms, failed, sent + received))
+        record = {'type': 'http', 'method': method, 'endpoint': endpoint, 'url': url, 'status': status,
+                  'ms': round(ms, 3), 'sent': sent, 'received': received, 'attempt': attempt,
+                  'parent': stack[-1] if stack else None, 'thread': threading.current_thread().name,
+                  'start': time.time() - ms / 1000}
+        if error:
+            record['error'] = error
+        self._emit(record)
+
+    def summary(self, out=sys.stdout):
+        print_summary(self._spans, self._http, out)
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._file.close()
+        self.summary()
+
+
+def print_summary(spans, http, out=sys.stdout):
+    """
+    Prints phase totals and latency percentiles per endpoint.
+    spans are (name, ms, failed) and http records (key, ms, failed, bytes).
+    """
+    def table(title, rows):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[0], []).append(row)
+        if not groups:
+            return
+        print(f"\n{title:<58} {'count':>7} {'err':>5} {'total s':>9} {'p50 ms':>8} {'p90 ms':>8} "
+              f"{'p99 ms':>8} {'max ms':>8} {'MB':>8}", file=out)
+        for key, items in sorted(groups.items(), key=lambda g: -sum(r[1] for r in g[1])):
+            values = sorted(r[1] for r in items)
+            size = sum(r[3] for r in items) / 1024 / 1024 if len(items[0]) > 3 else 0
+            print(f"{key[:58]:<58} {len(items):>7} {sum(r[2] for r in items):>5} {sum(values) / 1000:>9.2f} "
+                  f"{percentile(values, 0.5):>8.1f} {percentile(values, 0.9):>8.1f} {percentile(values, 0.99):>8.1f} "
+                  f"{values[-1]:>8.1f} {size:>8.1f}", file=out)
+
+    table("phase", spans)
+    table("endpoint", http)
+
+
+def summarize_file(path, out=sys.stdout):
+    spans, http = [], []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'span':
+                spans.append((record['name'], record['ms'], record['status'] != 'ok'))
+            else:
+                http.append((f"{record['method']} {record['endpoint']}", record['ms'],
+                             record['status'] is None or record['status'] >= 400,
+                             record['sent'] + record['received']))
+    print_summary(spans, http, out)
+
+
+tracer = Tracer(NC_TRACE_FILE)
+traced = tracer.traced
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py TRACE.jsonl")
+        sys.exit(1)
+    summarize_file(sys.argv[1])